@@ -64,7 +64,7 @@ class DLoss(Loss):
 
 class EvaluateTargetClassifier(Trace):
     def __init__(self, model_name, model_path):
-        super().__init__()
+        super().__init__(batch_inputs=["target_img", "target_label"])
         self.model_name = model_name
         self.model_path = model_path
         self.target_model = tf.keras.Sequential()
@@ -35,9 +35,10 @@ class Rescale(TensorOp):
 
 
 class ExtractVGGFeatures(TensorOp):
-    def __init__(self, inputs, outputs, mode=None):
+    def __init__(self, inputs, outputs, mode=None, batch_independent=False):
         super().__init__(inputs, outputs, mode)
         self.vgg = lossNet()
+        self.batch_independent = batch_independent
 
     def forward(self, data, state):
         return self.vgg(data)
@@ -127,7 +128,7 @@ def get_estimator(style_img_path=None,
 
     network = fe.Network(ops=[
         ModelOp(inputs="image", model=model, outputs="image_out"),
-        ExtractVGGFeatures(inputs=lambda: style_img_t, outputs="y_style"),
+        ExtractVGGFeatures(inputs=lambda: style_img_t, outputs="y_style", batch_independent=True),
         ExtractVGGFeatures(inputs="image", outputs="y_content"),
         ExtractVGGFeatures(inputs="image_out", outputs="y_pred"),
         StyleContentLoss(style_weight=style_weight,
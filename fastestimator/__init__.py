@@ -18,11 +18,27 @@ from fastestimator.estimator import Estimator
 from fastestimator.network import Network, build
 from fastestimator.pipeline import Pipeline
 from fastestimator.record_writer import RecordWriter
-from fastestimator.util.util import get_num_devices
+from fastestimator.util.cpu_budget import get_cpu_budget, set_num_cpus
+from fastestimator.util.util import get_num_devices, get_num_workers
 
 __version__ = '1.0-beta2'
 
-if get_num_devices() > 1:
+# the op thread pools can only be sized before the devices are detected below, which initializes TensorFlow
+get_cpu_budget().apply()
+
+if get_num_workers() > 1:
+    # the cluster is described by the TF_CONFIG environment variable
+    distribute_strategy = tf.distribute.experimental.MultiWorkerMirroredStrategy()
+elif get_num_devices() > 1 and tf.config.experimental.list_physical_devices("GPU"):
     distribute_strategy = tf.distribute.MirroredStrategy()
+elif get_num_devices() > 1:
+    # virtual cpu devices run the data-parallel code path without GPU
+    num_cpu_replicas = get_num_devices()
+    tf.config.experimental.set_virtual_device_configuration(
+        tf.config.experimental.list_physical_devices("CPU")[0],
+        [tf.config.experimental.VirtualDeviceConfiguration() for _ in range(num_cpu_replicas)])
+    distribute_strategy = tf.distribute.MirroredStrategy(
+        devices=["/cpu:{}".format(idx) for idx in range(num_cpu_replicas)],
+        cross_device_ops=tf.distribute.ReductionToOneDevice())
 else:
     distribute_strategy = None
@@ -13,5 +13,6 @@
 # limitations under the License.
 # ==============================================================================
 from fastestimator.cli.predict import configure_predict_parser
+from fastestimator.cli.serve import configure_serve_parser
 from fastestimator.cli.train import configure_train_parser
 from fastestimator.cli.visualize import configure_visualization_parser
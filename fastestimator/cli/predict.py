@@ -12,16 +12,102 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-import sys
+import argparse
+
+import fastestimator as fe
+from fastestimator.cli.train import load_estimator
+from fastestimator.inference import BatchPredictor
+from fastestimator.op.tensorop import ModelOp
+from fastestimator.schedule import Scheduler
+
+
+def load_predict_components(args, unknown):
+    """Build the pipeline and network used for inference from either a saved model or a `get_estimator` entry point.
+
+    Args:
+        args (dict): Parsed known arguments.
+        unknown (list): Remaining command line arguments, passed as hyperparameters to `get_estimator`.
+
+    Returns:
+        The pipeline (None for a saved model) and the network.
+    """
+    if args['entry_point'].endswith(".h5"):
+        assert args['inputs'], "must provide --inputs when predicting with a saved model"
+        model = fe.build(model_def=args['entry_point'], model_name="model", optimizer="adam", loss_name="loss")
+        inputs = args['inputs'][0] if len(args['inputs']) == 1 else args['inputs']
+        outputs = args['outputs'] or ["y_pred"]
+        outputs = outputs[0] if len(outputs) == 1 else outputs
+        network = fe.Network(ops=ModelOp(model=model, inputs=inputs, outputs=outputs))
+        return None, network
+    estimator = load_estimator(args, unknown)
+    pipeline = estimator.pipeline
+    if isinstance(pipeline, Scheduler):
+        pipeline = pipeline.get_current_value(args['epoch'])
+    network = estimator.network
+    network.prepare(mode_list=[args['mode']])
+    for weights in args['weights'] or []:
+        model_name, _, weights_path = weights.rpartition("=")
+        if not model_name:
+            assert len(network.model) == 1, "must specify model_name=path when the network has several models"
+            model_name = list(network.model.keys())[0]
+        network.model[model_name].load_weights(weights_path)
+        print("FastEstimator-Predict: Loaded weights of {} from {}".format(model_name, weights_path))
+    return pipeline, network
 
 
 def predict(args, unknown):
-    if len(unknown) > 0:
-        print("error: unrecognized arguments: ", str.join(", ", unknown))
-        sys.exit(-1)
-    print("Prediction not yet supported, but coming soon...!")
+    pipeline, network = load_predict_components(args, unknown)
+    predictor = BatchPredictor(network=network,
+                               data=args['data'],
+                               save_dir=args['save_dir'],
+                               pipeline=pipeline,
+                               batch_size=args['predict_batch_size'],
+                               outputs=args['outputs'] if pipeline else None,
+                               mode=args['mode'],
+                               epoch=args['epoch'],
+                               examples_per_shard=args['examples_per_shard'],
+                               output_format=args['output_format'],
+                               log_steps=args['log_steps'],
+                               resume=not args['restart'])
+    predictor.predict()
 
 
 def configure_predict_parser(subparsers):
-    parser = subparsers.add_parser('predict', description='Evaluate a trained model on new inputs', allow_abbrev=False)
+    parser = subparsers.add_parser('predict',
+                                   description='Evaluate a trained model on new inputs',
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                   allow_abbrev=False)
+    parser.add_argument('entry_point',
+                        type=str,
+                        help='The path to the model python file defining get_estimator, or to a saved model (.h5)')
+    parser.add_argument('data', type=str, help='The path to a csv file or to a record directory')
+    parser.add_argument('save_dir', type=str, help='The directory to write the predictions into')
+    parser.add_argument('--hyperparameters',
+                        dest='hyperparameters_json',
+                        type=str,
+                        help="The path to the hyperparameters JSON file")
+    parser.add_argument('--weights',
+                        type=str,
+                        nargs='+',
+                        help="Saved model files whose weights are loaded into the network, given as \
+                        <model_name>=<path> or just <path> for single model networks")
+    parser.add_argument('--inputs', type=str, nargs='+', help="Input keys of the model when using a saved model")
+    parser.add_argument('--outputs', type=str, nargs='+', help="Keys to save, defaults to every network output")
+    parser.add_argument('--predict_batch_size',
+                        type=int,
+                        default=256,
+                        help="The number of examples per prediction batch")
+    parser.add_argument('--mode', type=str, default="eval", help="The mode of the ops to apply")
+    parser.add_argument('--epoch', type=int, default=0, help="The epoch used to resolve scheduled ops")
+    parser.add_argument('--examples_per_shard',
+                        type=int,
+                        default=100000,
+                        help="The number of examples written to each output file")
+    parser.add_argument('--output_format', type=str, default="npz", choices=["npz", "csv"], help="Output file format")
+    parser.add_argument('--log_steps', type=int, default=100, help="The number of batches between throughput logs")
+    parser.add_argument('--restart', action='store_true', help="Ignore previous progress found in save_dir")
+    parser.add_argument_group(
+        'hyperparameter arguments',
+        'Arguments to be passed through to the get_estimator() call. \
+        Examples might look like --epochs <int>, --batch_size <int>, --optimizer <str>, etc...')
     parser.set_defaults(func=predict)
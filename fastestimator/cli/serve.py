@@ -0,0 +1,79 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+
+from fastestimator.cli.predict import load_predict_components
+from fastestimator.inference import CompiledTransform, InferenceServer
+
+
+def serve(args, unknown):
+    pipeline, network = load_predict_components(args, unknown)
+    transform = CompiledTransform(pipeline=pipeline,
+                                  network=network,
+                                  mode=args['mode'],
+                                  epoch=args['epoch'],
+                                  outputs=args['outputs'],
+                                  batch=True)
+    server = InferenceServer(transform,
+                             host=args['host'],
+                             port=args['port'],
+                             max_batch_size=args['max_batch_size'],
+                             max_latency_ms=args['max_latency_ms'],
+                             max_queue_size=args['max_queue_size'],
+                             request_timeout=args['request_timeout'])
+    server.serve_forever()
+
+
+def configure_serve_parser(subparsers):
+    parser = subparsers.add_parser('serve',
+                                   description='Serve a trained model over HTTP with dynamic request batching',
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                   allow_abbrev=False)
+    parser.add_argument('entry_point',
+                        type=str,
+                        help='The path to the model python file defining get_estimator, or to a saved model (.h5)')
+    parser.add_argument('--hyperparameters',
+                        dest='hyperparameters_json',
+                        type=str,
+                        help="The path to the hyperparameters JSON file")
+    parser.add_argument('--weights',
+                        type=str,
+                        nargs='+',
+                        help="Saved model files whose weights are loaded into the network, given as \
+                        <model_name>=<path> or just <path> for single model networks")
+    parser.add_argument('--inputs', type=str, nargs='+', help="Input keys of the model when using a saved model")
+    parser.add_argument('--outputs', type=str, nargs='+', help="Keys to return, defaults to every available key")
+    parser.add_argument('--mode', type=str, default="eval", help="The mode of the ops to apply")
+    parser.add_argument('--epoch', type=int, default=0, help="The epoch used to resolve scheduled ops")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help="The host to bind")
+    parser.add_argument('--port', type=int, default=8080, help="The port to bind")
+    parser.add_argument('--max_batch_size', type=int, default=32, help="The maximum number of requests per batch")
+    parser.add_argument('--max_latency_ms',
+                        type=float,
+                        default=5,
+                        help="The maximum time in milliseconds a request waits for its batch to fill up")
+    parser.add_argument('--max_queue_size',
+                        type=int,
+                        default=1024,
+                        help="The maximum number of pending requests before new ones are rejected")
+    parser.add_argument('--request_timeout',
+                        type=float,
+                        default=30,
+                        help="The number of seconds to wait for a prediction before answering with an error")
+    parser.add_argument_group(
+        'hyperparameter arguments',
+        'Arguments to be passed through to the get_estimator() call. \
+        Examples might look like --epochs <int>, --batch_size <int>, --optimizer <str>, etc...')
+    parser.set_defaults(func=serve)
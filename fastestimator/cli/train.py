@@ -15,12 +15,25 @@
 import argparse
 import json
 import os
+import socket
+import subprocess
 import sys
+import time
 
 from fastestimator.cli.cli_util import parse_cli_to_dictionary
+from fastestimator.util.cpu_budget import get_cpu_budget
 
 
-def train(args, unknown):
+def load_estimator(args, unknown):
+    """Build the estimator defined by the `get_estimator` function of an entry point file.
+
+    Args:
+        args (dict): Parsed known arguments, including 'entry_point' and 'hyperparameters_json'.
+        unknown (list): Remaining command line arguments, passed as hyperparameters to `get_estimator`.
+
+    Returns:
+        The estimator returned by `get_estimator`.
+    """
     entry_point = args['entry_point']
     hyperparameters = {}
     if args['hyperparameters_json']:
@@ -31,10 +44,68 @@ def train(args, unknown):
     dir_name = os.path.abspath(os.path.dirname(entry_point))
     sys.path.insert(0, dir_name)
     spec_module = __import__(module_name, globals(), locals(), ["get_estimator"])
-    estimator = spec_module.get_estimator(**hyperparameters)
+    return spec_module.get_estimator(**hyperparameters)
+
+
+def train(args, unknown):
+    if args['num_workers'] > 1 and "TF_CONFIG" not in os.environ:
+        launch_workers(args['num_workers'])
+        return
+    estimator = load_estimator(args, unknown)
     estimator.fit()
 
 
+def launch_workers(num_workers):
+    """Run the current command in local worker processes forming a multi-worker cluster.
+
+    Every worker gets a TF_CONFIG describing the cluster and its own task, and an equal share of the cpu budget. When
+    a worker fails, the other workers are stopped.
+
+    Args:
+        num_workers (int): Number of worker processes.
+    """
+    cluster = {"worker": ["localhost:{}".format(port) for port in _get_free_ports(num_workers)]}
+    num_cpus = max(1, get_cpu_budget().num_cpus // num_workers)
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env["TF_CONFIG"] = json.dumps({"cluster": cluster, "task": {"type": "worker", "index": index}})
+        env["FE_NUM_CPUS"] = str(num_cpus)
+        processes.append(subprocess.Popen([sys.executable] + sys.argv, env=env))
+    exit_code = 0
+    try:
+        running = list(processes)
+        while running:
+            for process in list(running):
+                if process.poll() is None:
+                    continue
+                running.remove(process)
+                if process.returncode != 0 and exit_code == 0:
+                    exit_code = process.returncode
+                    print("FastEstimator-Error: worker {} exited with code {}, stopping the other workers".format(
+                        processes.index(process), exit_code))
+                    for other in running:
+                        other.terminate()
+            time.sleep(0.5)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+    if exit_code:
+        sys.exit(exit_code)
+
+
+def _get_free_ports(num_ports):
+    sockets = [socket.socket() for _ in range(num_ports)]
+    try:
+        for sock in sockets:
+            sock.bind(("localhost", 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
 def configure_train_parser(subparsers):
     parser = subparsers.add_parser('train',
                                    description='Train a FastEstimator model',
@@ -46,6 +117,10 @@ def configure_train_parser(subparsers):
                         dest='hyperparameters_json',
                         type=str,
                         help="The path to the hyperparameters JSON file")
+    parser.add_argument('--num_workers',
+                        type=int,
+                        default=1,
+                        help="Number of local worker processes training together with a multi-worker strategy")
     parser.add_argument_group(
         'hyperparameter arguments',
         'Arguments to be passed through to the get_estimator() call. \
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-import multiprocessing as mp
 import os
 import shutil
 from glob import glob
@@ -27,6 +26,8 @@ import SimpleITK as sitk
 from nilearn.image import reorder_img
 from nilearn.image.image import _crop_img_to
 
+from fastestimator.util.cpu_budget import get_cpu_budget
+
 labels = [1, 2, 4]  # segmentation ground truth has 3 different class
 nlabels = len(labels)  # segmentation ground truth classes are 1 2 4
 modalities = ["t1", "t1ce", "flair", "t2", "seg"]
@@ -184,7 +185,7 @@ def _generate_samples(path_brats, val_split=0.8, resized_img_shape=(144, 144, 14
     path_brats_bias_corrected = os.path.join(path_brats, 'bias_corrected')
     path_brats_preprocessed = os.path.join(path_brats, 'preprocessed')
 
-    num_cpu = mp.cpu_count()
+    num_cpu = get_cpu_budget().num_processes
     pool = Pool(processes=num_cpu)
 
     if bias_correction is True:
@@ -21,6 +21,8 @@ import pandas as pd
 import tensorflow as tf
 from PIL import Image
 
+from fastestimator.util.cpu_budget import get_cpu_budget
+
 
 def _write_images_serial(start_idx, end_idx, data, image_path, mode):
     for idx in range(start_idx, end_idx):
@@ -29,7 +31,7 @@ def _write_images_serial(start_idx, end_idx, data, image_path, mode):
 
 
 def _write_images_parallel(img, image_path, mode):
-    num_cpu = mp.cpu_count()
+    num_cpu = get_cpu_budget().num_processes
     num_example = img.shape[0]
     example_per_cpu = num_example // num_cpu
     processes = []
@@ -23,10 +23,12 @@ import os
 import PIL
 from PIL import Image
 import numpy as np
-import multiprocessing as mp
 from multiprocessing import Pool
 import pandas as pd
 
+from fastestimator.util.cpu_budget import get_cpu_budget
+
+
 def _generate_crop_samples(in_tup):
     imgpath, path_hr, path_lr = in_tup
     filename = os.path.basename(imgpath)
@@ -89,7 +91,7 @@ def  _generate_samples(ext, path_imgnet):
 
 
     if path_hr_not_exists or path_hr_empty or path_lr_not_exists or path_lr_empty:
-        num_cpu = mp.cpu_count()
+        num_cpu = get_cpu_budget().num_processes
         pool = Pool(processes=num_cpu)
         length = len(selected_imgnet)
         pool.map(_generate_crop_samples, zip(selected_imgnet, [path_hr]*length, [path_lr]*length))
@@ -22,6 +22,7 @@ import h5py
 import pandas as pd
 import wget
 
+from fastestimator.util.cpu_budget import get_cpu_budget
 from fastestimator.util.wget_util import bar_custom, callback_progress
 
 wget.callback_progress = callback_progress
@@ -99,7 +100,7 @@ def _create_csv(data_folder, mode, csv_path):
     df = pd.DataFrame(columns=['image', 'label', 'x1', 'y1', 'width', 'height'])
     print("Retrieving bounding box for {} data. This will take several minutes ...".format(mode))
     futures = []
-    with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+    with ProcessPoolExecutor(max_workers=get_cpu_budget().num_processes) as executor:
         for idx in range(num_examples):
             futures.append(executor.submit(_get_name_and_bbox, idx, mat_path, num_examples))
 
@@ -24,6 +24,7 @@ import tensorflow as tf
 import wget
 from PIL import Image
 
+from fastestimator.util.cpu_budget import get_cpu_budget
 from fastestimator.util.wget_util import bar_custom, callback_progress
 
 wget.callback_progress = callback_progress
@@ -38,7 +39,7 @@ def _write_images_serial(start_idx, end_idx, data, image_path, mode):
 
 
 def _write_images_parallel(img, image_path, mode):
-    num_cpu = mp.cpu_count()
+    num_cpu = get_cpu_budget().num_processes
     num_example = img.shape[0]
     example_per_cpu = num_example // num_cpu
     processes = []
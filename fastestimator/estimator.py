@@ -13,18 +13,28 @@
 # limitations under the License.
 # ==============================================================================
 """Estimator Class."""
+import functools
+import gc
+import numbers
+import time
 from collections import ChainMap, deque
 
 import numpy as np
 import tensorflow as tf
+from tensorflow.python.keras import backend
 
 import fastestimator as fe
 from fastestimator.cli.cli_util import draw
+from fastestimator.op.tensorop import UpdateOp
 from fastestimator.schedule.epoch_scheduler import Scheduler
 from fastestimator.summary import Summary
-from fastestimator.trace import Logger, ModelSaver, MonitorLoss, Trace, TrainInfo
-from fastestimator.util.util import get_num_devices, per_replica_to_global
+from fastestimator.trace import Checkpoint, Logger, ModelSaver, MonitorLoss, Trace, TrainInfo
+from fastestimator.util.util import NonContext, ReplicaData, RetraceMonitor, get_base_optimizer, get_num_devices, \
+    get_peak_rss, is_chief, per_replica_to_global, reset_peak_rss, to_list
 
+# parts of the messages with which XLA rejects a step it can not compile
+_XLA_ERROR_MARKERS = ("XLA_CPU_JIT", "XLA_GPU_JIT", "not compilable", "unsupported operations when trying to compile",
+                      "compile-time constant")
 
 class Estimator:
     """Estimator is the highest level class that user can directly use for traning a model (estimator.fit). It wraps
@@ -44,6 +54,13 @@ class Estimator:
         traces (list, optional): List of the traces objects to run during training. If None, there will be only basic
             traces.
         log_steps (int, optional): Interval steps of logging. Defaults to 100.
+        jit_compile (bool, optional): Whether to compile the training and evaluation steps with XLA. Models built with
+            an explicit `jit_compile` in `fe.build` override it for the steps using them. Steps that XLA can not compile
+            fall back to the regular graph automatically. Defaults to False.
+        strict_tracing (bool, optional): Whether to pass the numeric scalars of the step state (for example
+            `num_examples`) as tensors, so that changing them does not retrace the step functions. The batch sizes stay
+            python ints since they are the static batch dimension, which changes together with the shapes. Every retrace
+            is reported with the arguments that triggered it either way. Defaults to False.
     """
     def __init__(self,
                  pipeline,
@@ -52,7 +69,9 @@ class Estimator:
                  steps_per_epoch=None,
                  validation_steps=None,
                  traces=None,
-                 log_steps=100):
+                 log_steps=100,
+                 jit_compile=False,
+                 strict_tracing=False):
 
         self.pipeline = pipeline
         self.network = network
@@ -62,6 +81,9 @@ class Estimator:
         self.traces = traces
         assert log_steps is None or log_steps > 0, "log_steps must be positive or None"
         self.log_steps = log_steps
+        self.jit_compile = jit_compile
+        self.strict_tracing = strict_tracing
+        self.retrace_monitor = RetraceMonitor()
         self.summary = False
         self.inputs = None
         self.num_devices = get_num_devices()
@@ -71,28 +93,339 @@ class Estimator:
         self.num_examples = {}
         self.do_eval = False
         self._is_initialized = False
+        self._resume_state = None
         self.mode_list = ["train"]
-
-    def fit(self, summary=None):
+        self._step_fns = {}
+        self._jit_checked = set()
+        self._jit_failed = set()
+        self._warmed_up = set()
+        self._warmup_time = 0.0
+        self.chief_traces = []
+        self.signature_epochs = {}
+
+    def fit(self, summary=None, resume_from=None, dry_run=False):
         """Function to perform training on the estimator.
 
         Args:
             summary (str, optional): Experiment name to return. If None, it won't return anything. Defaults to None.
+            resume_from (str, optional): Directory of a checkpoint written by the `Checkpoint` trace, or the save_dir of
+                the trace to use its latest checkpoint. Training continues from the saved position with the saved
+                model, optimizer, trace and random generator states. Defaults to None.
+            dry_run (bool, optional): Whether to forecast the training instead of running it. A few steps of every
+                phase (mode and signature epoch of the pipeline and network schedules) are timed, their peak memory
+                is measured, and the duration of each phase is extrapolated from its number of steps. Traces are not
+                run, and the weights, optimizer states and gradient accumulators of the models are restored afterwards.
+                Defaults to False.
 
         Returns:
-            Experiment object.
+            Experiment object, or the list of phase forecasts for a dry run.
         """
         draw()
+        self.summary = summary
+        self._initialize()
+        if dry_run:
+            return self._dry_run()
+        if resume_from:
+            # the data position of the chief does not apply to the shards of the other workers
+            self._resume_state = Checkpoint.load(resume_from,
+                                                 self.network.model,
+                                                 iterators=self._get_data_iterators() if is_chief() else None)
+        return self._start()
+
+    def find_batch_size(self, max_batch_size=1024, memory_limit=None, scale_lr=False, epoch=0, num_steps=2):
+        """Search the largest batch size per device whose training step fits in memory and use it in the pipeline.
+
+        The training step of the network runs on synthetic batches made by repeating an example of the pipeline. The
+        batch size doubles until the step runs out of memory, exceeds `memory_limit` or reaches `max_batch_size`, then
+        the search bisects between the last size that fit and the first one that did not. Gradient accumulation runs
+        as configured, with `num_steps` rounded up to whole accumulation cycles. The weights, optimizer states and
+        gradient accumulators of the models are restored afterwards.
+
+        Args:
+            max_batch_size (int, optional): Largest batch size per device to try. Defaults to 1024.
+            memory_limit (int, optional): Limit of the peak resident memory of the process in bytes, for devices which
+                use the host memory. None only stops at resource exhausted errors. Defaults to None.
+            scale_lr (bool, optional): Whether to scale the current learning rate of the optimizers linearly with the
+                batch size. Defaults to False.
+            epoch (int, optional): Epoch whose pipeline and network are used. Defaults to 0.
+            num_steps (int, optional): Number of training steps to run for each batch size. Defaults to 2.
+
+        Returns:
+            int: The batch size per device written into the pipeline.
+        """
+        self._initialize()
+        pipeline = self.pipeline.get_current_value(epoch)
+        assert pipeline.batch, "the pipeline does not batch the data"
+        assert not isinstance(pipeline.batch_size, Scheduler), "can not search a scheduled batch size"
+        example = next(pipeline.dataset_schedule["train"].get_current_value(epoch))
+        if fe.distribute_strategy:
+            example = per_replica_to_global(example)
+        example = {key: value[:1] for key, value in example.items()}
+        ops = self.network.load_epoch(epoch, "train")
+        # whole accumulation cycles also measure the optimizer update, the accumulators are restored afterwards
+        num_steps = self._round_to_accumulation_cycle(num_steps, ops)
+        variables = self._get_training_variables()
+        values = [variable.numpy() for variable in variables]
+        fit_size, fail_size = 0, max_batch_size + 1
+        candidate = 1
+        try:
+            while fit_size + 1 < fail_size:
+                if self._fits_batch_size(candidate, example, ops, epoch, memory_limit, num_steps):
+                    fit_size = candidate
+                else:
+                    fail_size = candidate
+                if fail_size > max_batch_size:
+                    candidate = min(fit_size * 2, max_batch_size)
+                else:
+                    candidate = (fit_size + fail_size) // 2
+        finally:
+            for variable, value in zip(variables, values):
+                variable.assign(value)
+            # release the step graphs traced for the probed batch sizes, training traces its own batch size
+            self._step_fns = {}
+            self.retrace_monitor = RetraceMonitor()
+        assert fit_size > 0, "the training step does not fit in memory with a batch size of 1"
+        if scale_lr:
+            for model in self.network.model.values():
+                optimizer = get_base_optimizer(model.optimizer)
+                if isinstance(optimizer.lr, tf.keras.optimizers.schedules.LearningRateSchedule):
+                    print("FastEstimator-Warn: the learning rate schedule of {} is not scaled".format(model.model_name))
+                else:
+                    backend.set_value(optimizer.lr, backend.get_value(optimizer.lr) * fit_size / pipeline.batch_size)
+        print("FastEstimator-BatchSize: batch size per device changed from {} to {}".format(
+            pipeline.batch_size, fit_size))
+        pipeline.batch_size = fit_size
+        pipeline._reset()  # pylint: disable=protected-access
+        self._configure_single_pipeline(pipeline)
+        self._warmup()
+        return fit_size
+
+    def benchmark(self, num_steps=100, mode="train", epoch=0):
+        """Measure the throughput of the pipeline alone, the network alone and both together.
+
+        The network alone runs repeatedly on one cached batch of the pipeline, which gives the compute ceiling of the
+        step. An end-to-end rate close to the pipeline rate means the job is input-bound, one close to the network rate
+        means it is compute-bound. The weights, optimizer states and gradient accumulators of the models are restored
+        afterwards.
+
+        Args:
+            num_steps (int, optional): Number of steps to time for each measurement. In train mode it is rounded up to
+                a multiple of the gradient accumulation steps. Defaults to 100.
+            mode (str, optional): Mode of the step, "train" or "eval". Defaults to "train".
+            epoch (int, optional): Epoch whose pipeline and network are used. Defaults to 0.
+
+        Returns:
+            dict: Steps per second of "pipeline", "network" and "end_to_end".
+        """
+        self._initialize()
+        pipeline = self.pipeline.get_current_value(epoch)
+        ds_iter = pipeline.dataset_schedule[mode].get_current_value(epoch)
+        global_batch_size = pipeline.get_global_batch_size(epoch)
+        ops = self.network.load_epoch(epoch, mode)
+        state = {
+            "mode": mode,
+            "batch_size": global_batch_size,
+            "local_batch_size": global_batch_size // self.num_devices,
+            "epoch": tf.convert_to_tensor(epoch),
+            "num_examples": self.num_examples[mode].get_current_value(epoch),
+            "warmup": False
+        }
+        num_steps = self._round_to_accumulation_cycle(num_steps, ops)
+        variables = self._get_training_variables()
+        values = [variable.numpy() for variable in variables]
+        cached_batch = next(ds_iter)
+        results = {}
+        try:
+            # trace the step before timing it
+            self._run_step(mode, cached_batch, ops, state)
+            results["pipeline"] = self._time_steps(num_steps, lambda: next(ds_iter))
+            results["network"] = self._time_steps(num_steps, lambda: self._run_step(mode, cached_batch, ops, state))
+            results["end_to_end"] = self._time_steps(num_steps,
+                                                     lambda: self._run_step(mode, next(ds_iter), ops, state))
+        finally:
+            for variable, value in zip(variables, values):
+                variable.assign(value)
+        for name, steps_per_sec in results.items():
+            print("FastEstimator-Benchmark: {}: {:.2f} steps/sec, {:.1f} examples/sec".format(
+                name, steps_per_sec, steps_per_sec * global_batch_size))
+        bound = "input" if results["pipeline"] < results["network"] else "compute"
+        print("FastEstimator-Benchmark: the {} step is {}-bound".format(mode, bound))
+        return results
+
+    @staticmethod
+    def _round_to_accumulation_cycle(num_steps, ops):
+        # whole accumulation cycles leave the gradient accumulators empty
+        accumulation_steps = [op.accumulation_steps for op in ops if isinstance(op, UpdateOp)]
+        if accumulation_steps:
+            cycle = int(np.lcm.reduce(accumulation_steps))
+            num_steps = -(-num_steps // cycle) * cycle
+        return num_steps
+
+    @staticmethod
+    def _time_steps(num_steps, step):
+        start = time.perf_counter()
+        for _ in range(num_steps):
+            outputs = step()
+        # wait for the device to finish the queued steps, without combining the values of the replicas
+        outputs = [output.data if isinstance(output, ReplicaData) else output for output in to_list(outputs)]
+        for value in tf.nest.flatten(outputs):
+            if hasattr(value, "numpy"):
+                value.numpy()
+        return num_steps / (time.perf_counter() - start)
+
+    def _dry_run(self, num_steps=10):
+        variables = self._get_training_variables()
+        values = [variable.numpy() for variable in variables]
+        forecasts = []
+        try:
+            for mode in self.mode_list:
+                signature_epochs = self.signature_epochs[mode]
+                for start_epoch, end_epoch in zip(signature_epochs, signature_epochs[1:] + [self.epochs]):
+                    forecasts.append(self._forecast_phase(mode, start_epoch, end_epoch, num_steps))
+        finally:
+            for variable, value in zip(variables, values):
+                variable.assign(value)
+        for forecast in forecasts:
+            print("FastEstimator-DryRun: {}; batch size: {}; steps per epoch: {}; step time: {:.2f} ms; compile time: "
+                  "{:.2f} sec; peak memory: {}; device peak memory: {}; forecast: {}".format(
+                      forecast["phase"],
+                      forecast["batch_size"],
+                      forecast["steps_per_epoch"],
+                      forecast["step_time"] * 1000,
+                      forecast["compile_time"],
+                      self._format_memory(forecast["peak_memory"]),
+                      self._format_memory(forecast["device_peak_memory"]),
+                      self._format_duration(forecast["forecast_time"])))
+        slowest = max(forecasts, key=lambda forecast: forecast["forecast_time"])
+        largest = max(forecasts, key=lambda forecast: max(forecast["peak_memory"], forecast["device_peak_memory"] or 0))
+        print("FastEstimator-DryRun: total forecast: {}; slowest phase: {}; largest phase: {}".format(
+            self._format_duration(sum(forecast["forecast_time"] for forecast in forecasts)),
+            slowest["phase"],
+            largest["phase"]))
+        return forecasts
+
+    def _forecast_phase(self, mode, start_epoch, end_epoch, num_steps):
+        pipeline = self.pipeline.get_current_value(start_epoch)
+        ds_iter = pipeline.dataset_schedule[mode].get_current_value(start_epoch)
+        global_batch_size = pipeline.get_global_batch_size(start_epoch)
+        ops = self.network.load_epoch(start_epoch, mode)
+        state = {
+            "mode": mode,
+            "batch_size": global_batch_size,
+            "local_batch_size": global_batch_size // self.num_devices,
+            "epoch": tf.convert_to_tensor(start_epoch),
+            "num_examples": self.num_examples[mode].get_current_value(start_epoch),
+            "warmup": False
+        }
+        if mode == "train":
+            num_steps = self._round_to_accumulation_cycle(num_steps, ops)
+        reset_peak_rss()
+        self._reset_device_memory_stats()
+        # the first step also traces and compiles the step function of the phase
+        first_step_time = 1 / self._time_steps(1, lambda: self._run_step(mode, next(ds_iter), ops, state))
+        step_time = 1 / self._time_steps(num_steps, lambda: self._run_step(mode, next(ds_iter), ops, state))
+        steps_per_epoch = self._get_max_steps(mode, start_epoch)
+        compile_time = max(first_step_time - step_time, 0.0)
+        return {
+            "phase": "{} epochs {}-{}".format(mode, start_epoch, end_epoch - 1),
+            "batch_size": global_batch_size,
+            "steps_per_epoch": steps_per_epoch,
+            "step_time": step_time,
+            "compile_time": compile_time,
+            "peak_memory": get_peak_rss(),
+            "device_peak_memory": self._get_device_peak_memory(),
+            "forecast_time": (end_epoch - start_epoch) * steps_per_epoch * step_time + compile_time
+        }
+
+    @staticmethod
+    def _reset_device_memory_stats():
+        reset_memory_stats = getattr(tf.config.experimental, "reset_memory_stats", None)
+        if reset_memory_stats:
+            for idx, _ in enumerate(tf.config.experimental.list_physical_devices("GPU")):
+                reset_memory_stats("GPU:{}".format(idx))
+
+    @staticmethod
+    def _get_device_peak_memory():
+        # the memory statistics of the devices are only available in recent TensorFlow versions
+        get_memory_info = getattr(tf.config.experimental, "get_memory_info", None)
+        gpus = tf.config.experimental.list_physical_devices("GPU")
+        if get_memory_info is None or not gpus:
+            return None
+        return max(get_memory_info("GPU:{}".format(idx))["peak"] for idx in range(len(gpus)))
+
+    @staticmethod
+    def _format_memory(num_bytes):
+        return "n/a" if num_bytes is None else "{:.2f} GB".format(num_bytes / 1024**3)
+
+    @staticmethod
+    def _format_duration(seconds):
+        if seconds < 120:
+            return "{:.1f} sec".format(seconds)
+        if seconds < 7200:
+            return "{:.1f} min".format(seconds / 60)
+        return "{:.1f} hours".format(seconds / 3600)
+
+    def _fits_batch_size(self, batch_size, example, ops, epoch, memory_limit, num_steps):
+        global_batch_size = batch_size * self.num_devices
+        batch = {
+            key: tf.tile(value, [global_batch_size] + [1] * (value.shape.rank - 1))
+            for key, value in example.items()
+        }
+        dataset = tf.data.Dataset.from_tensors(batch).repeat()
+        if fe.distribute_strategy:
+            dataset = fe.distribute_strategy.experimental_distribute_dataset(dataset)
+        ds_iter = iter(dataset)
+        state = {
+            "mode": "train",
+            "batch_size": global_batch_size,
+            "local_batch_size": batch_size,
+            "epoch": tf.convert_to_tensor(epoch),
+            "num_examples": self.num_examples["train"].get_current_value(epoch),
+            "warmup": False
+        }
+        reset_peak_rss()
+        try:
+            for _ in range(num_steps):
+                self._run_step("train", next(ds_iter), ops, state)
+        except tf.errors.ResourceExhaustedError:
+            print("FastEstimator-BatchSize: batch size {} per device: out of memory".format(batch_size))
+            return False
+        finally:
+            del batch, dataset, ds_iter
+            gc.collect()
+        peak_rss = get_peak_rss()
+        fits = memory_limit is None or peak_rss <= memory_limit
+        print("FastEstimator-BatchSize: batch size {} per device: peak memory {:.2f} GB{}".format(
+            batch_size, peak_rss / 1024**3, "" if fits else ", over the memory limit"))
+        return fits
+
+    def _get_training_variables(self):
+        variables = []
+        for model in self.network.model.values():
+            variables.extend(model.variables)
+            variables.extend(get_base_optimizer(model.optimizer).variables())
+            if getattr(model, "ema", None):
+                variables.extend(model.ema.variables)
+        # a partial accumulation cycle would leave stale gradients and shift the cycle of the training
+        update_ops = []
+        for ops in self.network.op_schedule["train"].epoch_dict.values():
+            update_ops.extend(op for op in ops if isinstance(op, UpdateOp) and op not in update_ops)
+        for op in update_ops:
+            if op.accumulators:
+                variables.extend(op.accumulators)
+                variables.append(op.accumulated_steps)
+        return variables
+
+    def _initialize(self):
         if not self._is_initialized:
-            self.summary = summary
+            # the keys read by the traces, including the default ones, decide which ops and features are kept
+            self._prepare_traces()
             self._prepare_pipeline()
             self._prepare_network()
             self._warmup()
             self._prepare_estimator()
             self._is_initialized = True
 
-        return self._start()
-
     def _prepare_pipeline(self):
         if not isinstance(self.pipeline, Scheduler):
             self.pipeline = Scheduler({0: self.pipeline})
@@ -108,19 +441,41 @@ class Estimator:
     def _configure_single_pipeline(self, pipeline):
         pipeline.global_batch_multiplier = get_num_devices()
         pipeline.eval_shuffle = self.validation_steps is not None
+        trace_keys = self._get_trace_keys()
+        pipeline.required_keys = None if trace_keys is None else self.network.get_input_keys() | trace_keys
         pipeline.prepare()
 
     def _prepare_network(self):
         self.network.num_devices = self.num_devices
-        self.network.prepare(mode_list=self.mode_list)
+        self.network.prepare(mode_list=self.mode_list, required_keys=self._get_trace_keys())
 
-    def _prepare_estimator(self):
+    def _get_trace_keys(self):
+        """Return the keys which traces declare to read, through `Trace.inputs` and `Trace.batch_inputs`.
+
+        Returns:
+            set: The keys, or None if a trace does not declare the keys it reads from the batch, in which case every op
+            and feature is kept.
+        """
+        keys = set()
+        for trace in self.traces:
+            if trace.batch_inputs is None:
+                return None
+            keys |= trace.inputs | trace.batch_inputs
+        return keys
+
+    def _prepare_traces(self):
         if self.traces is None:
             self.traces = []
         elif not isinstance(self.traces, list):
             self.traces = [self.traces]
         self._add_traces()
-        no_save_warning = True
+
+    def _prepare_estimator(self):
+        if not is_chief():
+            # logs, models and summaries are written by the chief worker only
+            self.chief_traces = [trace for trace in self.traces if trace.chief_only]
+            self.traces = [trace for trace in self.traces if not trace.chief_only]
+        no_save_warning = is_chief()
         for trace in self.traces:
             assert isinstance(trace, Trace)
             trace.network = self.network
@@ -157,7 +512,8 @@ class Estimator:
             "total_epochs",
             "total_train_steps",
             "summary",
-            "warmup"
+            "warmup",
+            "warmup_time"
         } | self.network.all_output_keys
         for _, pipeline in self.pipeline.epoch_dict.items():
             available_outputs = available_outputs | pipeline.all_output_keys
@@ -213,35 +569,27 @@ class Estimator:
             self.num_examples[mode] = Scheduler(num_examples_mode)
             epochs_network = self.network.op_schedule[mode].keys
             signature_epochs = sorted(list(set(epochs_pipeline) | set(epochs_network)))
+            self.signature_epochs[mode] = signature_epochs
             if mode == "train":
                 elapse_epochs = np.diff(signature_epochs + [self.epochs])
                 assert np.all(elapse_epochs > 0), "signature epoch is not sorted correctly"
-            state = {"mode": mode}
-            for idx, epoch in enumerate(signature_epochs):
-                pipeline = self.pipeline.get_current_value(epoch)
-                ds_iter = pipeline.dataset_schedule[mode].get_current_value(epoch)
-                if mode == "train":
-                    global_batch_size = pipeline.get_global_batch_size(epoch)
-                    if self.steps_per_epoch:
-                        max_steps = self.steps_per_epoch
-                    else:
-                        max_steps = self.num_examples[mode].get_current_value(epoch) // global_batch_size
-                    self.total_train_steps += max_steps * elapse_epochs[idx]
-                batch = next(ds_iter)
-                state["batch_size"] = pipeline.get_global_batch_size(epoch)
-                state["local_batch_size"] = state["batch_size"] // self.num_devices
-                state["epoch"] = epoch
-                state["num_examples"] = self.num_examples[mode].get_current_value(epoch)
-                state["warmup"] = True
-                ops = self.network.load_epoch(epoch, mode)
-                if fe.distribute_strategy:
-                    fe.distribute_strategy.experimental_run_v2(self.network.run_step, args=(batch, ops, state))
-                else:
-                    self.network.run_step(batch, ops, state)
+                for idx, epoch in enumerate(signature_epochs):
+                    self.total_train_steps += self._get_max_steps(mode, epoch) * elapse_epochs[idx]
+        # optimizer slots only depend on the model variables, the steps of each phase are warmed up lazily
+        with fe.distribute_strategy.scope() if fe.distribute_strategy else NonContext():
+            for ops in self.network.op_schedule["train"].epoch_dict.values():
+                for op in ops:
+                    if isinstance(op, UpdateOp) and op.model.trainable_variables:
+                        op.build()
 
     def _start(self):
+        resume_state = self._resume_state or {}
+        self._resume_state = None
         try:
-            self.train_step = 0
+            self.train_step = resume_state.get("train_step", 0)
+            start_epoch = resume_state.get("epoch", 0)
+            start_batch = resume_state.get("batch_idx", 0)
+            data_restored = resume_state.get("data_restored", False)
             self._run_traces_on_begin({
                 "train_step": self.train_step,
                 "num_devices": self.num_devices,
@@ -250,8 +598,14 @@ class Estimator:
                 "total_epochs": self.epochs,
                 "total_train_steps": self.total_train_steps
             })
-            for self.train_epoch in range(self.epochs):
-                self._run_epoch("train")
+            if resume_state:
+                self._restore_traces(resume_state["traces"])
+            # in the middle of an epoch, the states are restored again after the epoch begin of the traces
+            trace_states = resume_state["traces"] if start_batch else None
+            for self.train_epoch in range(start_epoch, self.epochs):
+                self._run_epoch("train", start_batch, data_restored, trace_states)
+                start_batch = 0
+                trace_states = None
                 if self.do_eval:
                     self._run_epoch("eval")
         except EarlyStop:
@@ -260,47 +614,82 @@ class Estimator:
         self._run_traces_on_end({"train_step": self.train_step, "epoch": self.train_epoch, "summary": summary})
         return None if not self.summary else summary
 
-    def _run_epoch(self, mode):
+    def _restore_traces(self, trace_states):
+        # the checkpoint also holds the states of the traces which only the chief worker runs
+        chief_trace_names = [type(trace).__name__ for trace in self.chief_traces]
+        worker_trace_states = []
+        for name, state in trace_states:
+            if name in chief_trace_names:
+                chief_trace_names.remove(name)
+            else:
+                worker_trace_states.append((name, state))
+        trace_states = worker_trace_states
+        assert [name for name, _ in trace_states] == [type(trace).__name__ for trace in self.traces], \
+            "traces of the checkpoint do not match the traces of the estimator"
+        for trace, (_, state) in zip(self.traces, trace_states):
+            trace.set_state(state)
+
+    def _save_checkpoints(self, batch_idx):
+        for trace in self.traces:
+            if isinstance(trace, Checkpoint) and trace.save_pending:
+                trace.save(models=self.network.model,
+                           traces=self.traces,
+                           iterators=self._get_data_iterators(),
+                           position={
+                               "epoch": self.train_epoch, "batch_idx": batch_idx + 1, "train_step": self.train_step
+                           })
+
+    def _get_data_iterators(self):
+        iterators = {}
+        for pipeline_epoch, pipeline in self.pipeline.epoch_dict.items():
+            for mode in self.mode_list:
+                for epoch, ds_iter in pipeline.dataset_schedule[mode].epoch_dict.items():
+                    if all(ds_iter is not value for value in iterators.values()):
+                        iterators["{}_{}_{}".format(mode, pipeline_epoch, epoch)] = ds_iter
+        return iterators
+
+    def _get_max_steps(self, mode, epoch):
+        num_examples = self.num_examples[mode].get_current_value(epoch)
+        if self.steps_per_epoch and mode == "train":
+            return self.steps_per_epoch
+        if self.validation_steps and mode == "eval":
+            return self.validation_steps
+        if num_examples > 0:
+            return num_examples // self.pipeline.get_current_value(epoch).get_global_batch_size(epoch)
+        raise ValueError("must specify steps_per_epoch or validations_steps when using generator")
+
+    def _run_epoch(self, mode, start_batch=0, data_restored=False, trace_states=None):
         pipeline = self.pipeline.get_current_value(self.train_epoch)
         ds_iter = pipeline.dataset_schedule[mode].get_current_value(self.train_epoch)
         global_batch_size = pipeline.get_global_batch_size(self.train_epoch)
         num_examples = self.num_examples[mode].get_current_value(self.train_epoch)
-        if self.steps_per_epoch and mode == "train":
-            max_steps = self.steps_per_epoch
-        elif self.validation_steps and mode == "eval":
-            max_steps = self.validation_steps
-        elif num_examples > 0:
-            max_steps = num_examples // global_batch_size
-        else:
-            raise ValueError("must specify steps_per_epoch or validations_steps when using generator")
+        max_steps = self._get_max_steps(mode, self.train_epoch)
         ops = self.network.load_epoch(self.train_epoch, mode)
-        self._run_traces_on_epoch_begin({
-            "mode": mode, "epoch": self.train_epoch, "train_step": self.train_step, "num_examples": num_examples
-        })
-        for batch_idx in range(max_steps):
-            batch = next(ds_iter)
-            self._run_traces_on_batch_begin({
-                "mode": mode,
-                "epoch": self.train_epoch,
-                "train_step": self.train_step,
-                "batch_idx": batch_idx,
-                "batch_size": global_batch_size,
-                "local_batch_size": global_batch_size // self.num_devices
+        # averaged weights are in place for evaluation and for the epoch end traces only
+        ema_swapped = mode == "eval"
+        if ema_swapped:
+            self._swap_ema()
+        try:
+            self._run_traces_on_epoch_begin({
+                "mode": mode, "epoch": self.train_epoch, "train_step": self.train_step, "num_examples": num_examples
             })
-            if fe.distribute_strategy:
-                prediction, batch = self._forward_step_parallel(
-                    batch,
-                    ops,
-                    {
-                        "mode": mode,
-                        "batch_size": global_batch_size,
-                        "local_batch_size": global_batch_size // self.num_devices,
-                        "epoch": tf.convert_to_tensor(self.train_epoch),
-                        "num_examples": num_examples,
-                        "warmup": False
-                    })
-            else:
-                prediction = self._forward_step(
+            if trace_states:
+                self._restore_traces(trace_states)
+            for batch_idx in range(start_batch if data_restored else 0, max_steps):
+                batch = next(ds_iter)
+                if batch_idx < start_batch:
+                    # the data iterators could not be checkpointed, fast-forward to the position of the checkpoint
+                    continue
+                self._run_traces_on_batch_begin({
+                    "mode": mode,
+                    "epoch": self.train_epoch,
+                    "train_step": self.train_step,
+                    "batch_idx": batch_idx,
+                    "batch_size": global_batch_size,
+                    "local_batch_size": global_batch_size // self.num_devices
+                })
+                prediction, batch = self._run_step(
+                    mode,
                     batch,
                     ops,
                     {
@@ -311,19 +700,32 @@ class Estimator:
                         "num_examples": num_examples,
                         "warmup": False
                     })
-            batch = ChainMap(prediction, batch)
-            self._run_traces_on_batch_end({
-                "mode": mode,
-                "epoch": self.train_epoch,
-                "train_step": self.train_step,
-                "batch_idx": batch_idx,
-                "batch_size": global_batch_size,
-                "local_batch_size": global_batch_size // self.num_devices,
-                "batch": batch,
-            })
+                batch = ChainMap(prediction, batch)
+                self._run_traces_on_batch_end({
+                    "mode": mode,
+                    "epoch": self.train_epoch,
+                    "train_step": self.train_step,
+                    "batch_idx": batch_idx,
+                    "batch_size": global_batch_size,
+                    "local_batch_size": global_batch_size // self.num_devices,
+                    "batch": batch,
+                    "warmup_time": self._warmup_time
+                })
+                if mode == "train":
+                    self.train_step += 1
+                    self._save_checkpoints(batch_idx)
             if mode == "train":
-                self.train_step += 1
-        self._run_traces_on_epoch_end({"mode": mode, "epoch": self.train_epoch, "train_step": self.train_step})
+                self._swap_ema()
+                ema_swapped = True
+            self._run_traces_on_epoch_end({"mode": mode, "epoch": self.train_epoch, "train_step": self.train_step})
+        finally:
+            if ema_swapped:
+                self._swap_ema()
+
+    def _swap_ema(self):
+        for model in self.network.model.values():
+            if getattr(model, "ema", None):
+                model.ema.swap()
 
     def _run_traces_on_begin(self, state):
         trace_outputs = {}
@@ -374,24 +776,111 @@ class Estimator:
         if self.network.stop_training:
             raise EarlyStop
 
-    @tf.function
-    def _forward_step(self, batch, ops, state):
-        prediction = self.network.run_step(batch, ops, state)
+    def _run_step(self, mode, batch, ops, state):
+        step_key = (mode, tuple(id(op) for op in ops))
+        self._warmup_time = 0.0
+        if step_key not in self._warmed_up:
+            warmup_start = time.perf_counter()
+            self._warmup_step(batch, ops, dict(state, warmup=True))
+            self._warmup_time = time.perf_counter() - warmup_start
+            self._warmed_up.add(step_key)
+        if self.strict_tracing:
+            state = {
+                key: tf.convert_to_tensor(value) if self._is_dynamic_scalar(key, value) else value
+                for key, value in state.items()
+            }
+        jit_compile = step_key not in self._jit_failed and self._use_jit(mode)
+        if not jit_compile or step_key in self._jit_checked:
+            return self._call_step(jit_compile, batch, ops, state)
+        # XLA only reports unsupported ops when compiling, which happens before anything runs in the first call
+        try:
+            outputs = self._call_step(True, batch, ops, state)
+        except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError) as err:
+            if not self._is_xla_error(err):
+                raise
+            print("FastEstimator-Warn: XLA can not compile the {} step, falling back to the regular graph: {}".format(
+                mode, err.message.split("\n")[0]))
+            self._jit_failed.add(step_key)
+            outputs = self._call_step(False, batch, ops, state)
+        self._jit_checked.add(step_key)
+        return outputs
+
+    @staticmethod
+    def _is_xla_error(err):
+        # the same error types report invalid data or shapes, which the regular graph would fail on as well
+        return any(marker in err.message for marker in _XLA_ERROR_MARKERS)
+
+    def _warmup_step(self, batch, ops, state):
+        # an eager run creates the variables of the ops before the step is traced, the stateful layers (such as the
+        # statistics of batch normalization) are restored afterwards so that the batch only updates them once
+        variables = self._get_training_variables()
+        values = [variable.numpy() for variable in variables]
+        try:
+            if fe.distribute_strategy:
+                fe.distribute_strategy.experimental_run_v2(self.network.run_step, args=(batch, ops, state))
+            else:
+                self.network.run_step(batch, ops, state)
+        finally:
+            for variable, value in zip(variables, values):
+                variable.assign(value)
+
+    @staticmethod
+    def _is_dynamic_scalar(key, value):
+        if key in ("batch_size", "local_batch_size"):
+            return False
+        # numpy scalars, such as the num_examples of a memmap pipeline, are numbers too
+        return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+    def _call_step(self, jit_compile, batch, ops, state):
+        if fe.distribute_strategy:
+            # the values of the replicas are only combined for the keys which traces read
+            prediction = self._get_step_fn(jit_compile)(batch, ops, state)
+            batch = {key: fe.distribute_strategy.experimental_local_results(value) for key, value in batch.items()}
+            return ReplicaData(prediction), ReplicaData(batch)
+        return self._get_step_fn(jit_compile)(batch, ops, state), batch
+
+    def _use_jit(self, mode):
+        models = self.network.model_schedule[mode].get_current_value(self.train_epoch)
+        model_options = {getattr(model, "jit_compile", None) for model in models} - {None}
+        if model_options:
+            return all(model_options)
+        return self.jit_compile
+
+    def _get_step_fn(self, jit_compile):
+        if jit_compile not in self._step_fns:
+            run_step = self.network.run_step
+            if jit_compile:
+                try:
+                    run_step = tf.function(run_step, experimental_compile=True)
+                except TypeError:
+                    print("FastEstimator-Warn: XLA compilation is not available in this TensorFlow version, falling "
+                          "back to the regular graph")
+            forward_step = self._forward_step_parallel if fe.distribute_strategy else self._forward_step
+            self._step_fns[jit_compile] = tf.function(
+                functools.partial(self._traced_step, forward_step, run_step, "XLA step" if jit_compile else "step"))
+        return self._step_fns[jit_compile]
+
+    def _traced_step(self, forward_step, run_step, step_name, batch, ops, state):
+        # the python body only runs while tracing
+        self.retrace_monitor.record("{} {}".format(state["mode"], step_name), batch=batch, ops=ops, state=state)
+        return forward_step(run_step, batch, ops, state)
+
+    @staticmethod
+    def _forward_step(run_step, batch, ops, state):
+        prediction = run_step(batch, ops, state)
         # expand dimension on scalar value for consistency with distributed training
         for key, value in prediction.items():
             if isinstance(value, tf.Tensor) and value.shape.rank == 0:
                 prediction[key] = tf.expand_dims(value, axis=0)
         return prediction
 
-    @tf.function
-    def _forward_step_parallel(self, batch, ops, state):
-        prediction = fe.distribute_strategy.experimental_run_v2(self.network.run_step, args=(
+    @staticmethod
+    def _forward_step_parallel(run_step, batch, ops, state):
+        prediction = fe.distribute_strategy.experimental_run_v2(run_step, args=(
             batch,
             ops,
             state, ))
-        prediction = per_replica_to_global(prediction)
-        batch = per_replica_to_global(batch)
-        return prediction, batch
+        return {key: fe.distribute_strategy.experimental_local_results(value) for key, value in prediction.items()}
 
 
 class EarlyStop(Exception):
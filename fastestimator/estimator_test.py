@@ -0,0 +1,404 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+from unittest import TestCase, mock, skipIf
+
+import numpy as np
+import tensorflow as tf
+
+import fastestimator as fe
+from fastestimator.op.tensorop import MeanSquaredError, ModelOp, Scale, UpdateOp
+from fastestimator.trace import Checkpoint, EarlyStopping, Trace
+
+
+def _dense_model():
+    return tf.keras.Sequential([tf.keras.layers.Dense(1, input_shape=(2, ))])
+
+
+def _batch_norm_model():
+    return tf.keras.Sequential(
+        [tf.keras.layers.BatchNormalization(input_shape=(2, ), momentum=0.5),
+         tf.keras.layers.Dense(1)])
+
+
+def _get_estimator(num_examples=16,
+                   batch_size=4,
+                   model_kwargs=None,
+                   update_kwargs=None,
+                   epochs=1,
+                   extra_ops=None,
+                   log_steps=None,
+                   record_dir=None,
+                   model_def=None,
+                   optimizer="sgd",
+                   **kwargs):
+    model = fe.build(model_def=model_def or _dense_model,
+                     model_name="model",
+                     optimizer=optimizer,
+                     loss_name="loss",
+                     **(model_kwargs or {}))
+    if not model_def:
+        model.set_weights([np.full((2, 1), 0.5, dtype=np.float32), np.zeros(1, dtype=np.float32)])
+    rng = np.random.RandomState(0)
+    data = {
+        "x": rng.uniform(size=(num_examples, 2)).astype(np.float32),
+        "y": rng.uniform(size=(num_examples, 1)).astype(np.float32)
+    }
+    if record_dir:
+        data["z"] = np.arange(num_examples)
+        fe.RecordWriter(train_data=data, save_dir=record_dir, output_format="memmap").write()
+        pipeline = fe.Pipeline(data=record_dir, batch_size=batch_size)
+    else:
+        pipeline = fe.Pipeline(data={"train": data, "eval": data}, batch_size=batch_size)
+    network = fe.Network(ops=[
+        ModelOp(model=model, inputs="x", outputs="y_pred"),
+        MeanSquaredError(y_true="y", y_pred="y_pred", outputs="loss"),
+        UpdateOp(model=model, **(update_kwargs or {}))
+    ] + (extra_ops or []))
+    return fe.Estimator(pipeline=pipeline, network=network, epochs=epochs, log_steps=log_steps, **kwargs)
+
+
+# the distribute strategy is created when fastestimator is imported, so it needs a fresh process
+_MIRRORED_TRAIN_STEP = textwrap.dedent("""
+    import numpy as np
+    import tensorflow as tf
+
+    import fastestimator as fe
+    from fastestimator.estimator_test import _get_estimator
+
+    assert isinstance(fe.distribute_strategy, tf.distribute.MirroredStrategy)
+    assert fe.distribute_strategy.num_replicas_in_sync == 2
+    estimator = _get_estimator(steps_per_epoch=1)
+    initial_weights = estimator.network.model["model"].get_weights()
+    estimator.fit()
+    weights = estimator.network.model["model"].get_weights()
+    assert estimator.train_step == 1
+    assert all(np.all(np.isfinite(weight)) for weight in weights)
+    assert any(np.any(weight != initial) for weight, initial in zip(weights, initial_weights))
+""")
+
+
+class _EpochMetric(Trace):
+    """Write a given value per evaluation epoch and record the weights and averages at the end of each epoch."""
+    def __init__(self, values):
+        super().__init__(outputs="metric", mode="eval")
+        self.values = values
+        self.weights = []
+        self.averages = []
+
+    def on_epoch_end(self, state):
+        state["metric"] = self.values[state["epoch"]]
+        model = self.network.model["model"]
+        self.weights.append(model.get_weights())
+        self.averages.append([variable.numpy() for variable in model.ema.variables])
+
+
+class _ReadBatch(Trace):
+    """Read a key of the batch, optionally without declaring it."""
+    def __init__(self, key, declared):
+        super().__init__(mode="train", batch_inputs=[key] if declared else None)
+        self.key = key
+        self.values = []
+
+    def on_batch_end(self, state):
+        self.values.append(state["batch"][self.key])
+
+
+class _BatchCounter(Trace):
+    """Count the training batches of each epoch, keeping the count of the current epoch in checkpoints."""
+    state_keys = ("count", )
+
+    def __init__(self):
+        super().__init__(mode="train", batch_inputs=[])
+        self.count = 0
+        self.epoch_counts = []
+
+    def on_epoch_begin(self, state):
+        self.count = 0
+
+    def on_batch_end(self, state):
+        self.count += 1
+
+    def on_epoch_end(self, state):
+        self.epoch_counts.append(self.count)
+
+
+class _StopAtBatch(Trace):
+    """Stop the training before a given batch of the epoch, or never if it is None."""
+    def __init__(self, batch_idx):
+        super().__init__(mode="train", batch_inputs=[])
+        self.batch_idx = batch_idx
+
+    def on_batch_begin(self, state):
+        if state["batch_idx"] == self.batch_idx:
+            self.network.stop_training = True
+
+
+class TestEstimator(TestCase):
+    # -------------------------------------------------------------------------------------------------------- #
+    # ---------------------------------------- Gradient Accumulation ----------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_accumulation_matches_large_batch(self):
+        accumulated = _get_estimator(num_examples=8, batch_size=4, update_kwargs={"accumulation_steps": 2})
+        accumulated.fit()
+        large_batch = _get_estimator(num_examples=8, batch_size=8)
+        large_batch.fit()
+        for weight, expected in zip(accumulated.network.model["model"].get_weights(),
+                                    large_batch.network.model["model"].get_weights()):
+            np.testing.assert_allclose(weight, expected, rtol=1e-5)
+        self.assertEqual(int(accumulated.network.model["model"].optimizer.iterations.numpy()), 1)
+        self._assert_accumulators_empty(accumulated)
+
+    def test_partial_accumulation_does_not_update(self):
+        estimator = _get_estimator(num_examples=4, batch_size=4, update_kwargs={"accumulation_steps": 2})
+        weights = estimator.network.model["model"].get_weights()
+        estimator.fit()
+        for weight, restored in zip(weights, estimator.network.model["model"].get_weights()):
+            np.testing.assert_array_equal(weight, restored)
+        self.assertEqual(int(estimator.network.model["model"].optimizer.iterations.numpy()), 0)
+
+    def test_accumulation_skips_overflowing_micro_batch(self):
+        optimizer = tf.keras.mixed_precision.experimental.LossScaleOptimizer(tf.optimizers.SGD(), "dynamic")
+        estimator = _get_estimator(num_examples=8,
+                                   batch_size=4,
+                                   optimizer=optimizer,
+                                   update_kwargs={"accumulation_steps": 2})
+        # the gradients of the micro-batch holding this example overflow
+        estimator.pipeline.data["train"]["x"][0] = 1e36
+        initial_scale = float(optimizer.loss_scale())
+        initial_weights = estimator.network.model["model"].get_weights()
+        estimator.fit()
+        weights = estimator.network.model["model"].get_weights()
+        self.assertTrue(all(np.all(np.isfinite(weight)) for weight in weights))
+        self.assertTrue(any(np.any(weight != initial) for weight, initial in zip(weights, initial_weights)))
+        self.assertEqual(float(optimizer.loss_scale()), initial_scale / 2)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ---------------------------------------- Exponential Moving Average ------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_ema_does_not_change_training(self):
+        # a single step, so that the shuffled order of the examples does not matter
+        averaged = _get_estimator(num_examples=8, batch_size=8, model_kwargs={"ema_decay": 0.9})
+        averaged.fit()
+        plain = _get_estimator(num_examples=8, batch_size=8)
+        plain.fit()
+        model = averaged.network.model["model"]
+        # the averages are only swapped in for evaluation, the trained weights are back in place afterwards
+        for weight, expected in zip(model.get_weights(), plain.network.model["model"].get_weights()):
+            np.testing.assert_allclose(weight, expected, rtol=1e-5)
+        for average, weight in zip(model.ema.variables, model.get_weights()):
+            self.assertFalse(np.allclose(average.numpy(), weight))
+
+    def test_early_stopping_restores_weights_and_averages(self):
+        metric = _EpochMetric(values=[1.0, 2.0, 3.0])
+        estimator = _get_estimator(model_kwargs={"ema_decay": 0.9},
+                                   epochs=3,
+                                   traces=[metric, EarlyStopping(monitor="metric", patience=1,
+                                                                 restore_best_weights=True)])
+        estimator.fit()
+        self.assertEqual(len(metric.weights), 2)
+        model = estimator.network.model["model"]
+        # the averages are swapped into the model at the epoch end, the best epoch is the first one
+        for weight, expected in zip(model.trainable_variables, metric.averages[0]):
+            np.testing.assert_allclose(weight.numpy(), expected)
+        for average, expected in zip(model.ema.variables, metric.weights[0]):
+            np.testing.assert_allclose(average.numpy(), expected)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ---------------------------------------------- XLA ----------------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_jit_failure_falls_back_to_graph(self):
+        estimator = _get_estimator(jit_compile=True)
+        call_step = fe.Estimator._call_step
+
+        def _call_step_without_xla(self, jit_compile, batch, ops, state):
+            if jit_compile:
+                raise tf.errors.UnimplementedError(None, None, "Detected unsupported operations when trying to compile "
+                                                   "graph on XLA_CPU_JIT: Unique")
+            return call_step(self, jit_compile, batch, ops, state)
+
+        with mock.patch.object(fe.Estimator, "_call_step", autospec=True,
+                               side_effect=_call_step_without_xla) as mock_call_step:
+            estimator.fit()
+        jit_calls = [call for call in mock_call_step.call_args_list if call[0][1]]
+        # XLA is tried once per step, train and eval, the later steps use the regular graph
+        self.assertEqual(len(jit_calls), 2)
+        self.assertEqual(len(estimator._jit_failed), 2)
+        self.assertEqual(estimator.train_step, 4)
+
+    def test_jit_data_error_is_raised(self):
+        estimator = _get_estimator(jit_compile=True)
+
+        def _call_step_with_bad_data(self, jit_compile, batch, ops, state):
+            raise tf.errors.InvalidArgumentError(None, None, "Incompatible shapes: [4,1] vs. [3,1]")
+
+        with mock.patch.object(fe.Estimator, "_call_step", autospec=True, side_effect=_call_step_with_bad_data):
+            with self.assertRaises(tf.errors.InvalidArgumentError):
+                estimator.fit()
+        self.assertFalse(estimator._jit_failed)
+
+    def test_model_jit_option_overrides_estimator(self):
+        estimator = _get_estimator(model_kwargs={"jit_compile": False}, jit_compile=True)
+        estimator._initialize()
+        self.assertFalse(estimator._use_jit("train"))
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------------ Warmup ------------------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_warmup_does_not_update_batch_statistics(self):
+        read_batch = _ReadBatch("x", declared=True)
+        estimator = _get_estimator(model_def=_batch_norm_model, steps_per_epoch=1, traces=[read_batch])
+        estimator.fit()
+        moving_mean = estimator.network.model["model"].layers[0].moving_mean.numpy()
+        np.testing.assert_allclose(moving_mean, 0.5 * np.mean(read_batch.values[0], axis=0), rtol=1e-5)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------------ Resume ------------------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_resume_mid_epoch_keeps_trace_state(self):
+        with tempfile.TemporaryDirectory() as save_dir:
+            interrupted = _get_estimator(
+                traces=[_BatchCounter(), Checkpoint(save_dir=save_dir, save_steps=1), _StopAtBatch(2)])
+            interrupted.fit()
+            counter = _BatchCounter()
+            resumed = _get_estimator(traces=[counter, Checkpoint(save_dir=save_dir, save_steps=1), _StopAtBatch(None)])
+            resumed.fit(resume_from=save_dir)
+        self.assertEqual(counter.epoch_counts, [4])
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # --------------------------------------------- Unused Ops ----------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def _prepare_with_trace(self, trace):
+        scale = Scale(scalar=2, inputs="y_pred", outputs="y_scaled")
+        estimator = _get_estimator(extra_ops=[scale], traces=[trace])
+        estimator._initialize()
+        return estimator, scale in estimator.network.load_epoch(0, "train")
+
+    def test_undeclared_trace_keeps_all_ops(self):
+        trace = _ReadBatch("y_scaled", declared=False)
+        estimator, kept = self._prepare_with_trace(trace)
+        self.assertTrue(kept)
+        estimator.fit()
+        self.assertEqual(len(trace.values), 4)
+
+    def test_declared_trace_keys_are_kept(self):
+        _, kept = self._prepare_with_trace(_ReadBatch("y_scaled", declared=True))
+        self.assertTrue(kept)
+        _, kept = self._prepare_with_trace(_ReadBatch("y", declared=True))
+        self.assertFalse(kept)
+
+    def test_record_features_read_by_undeclared_trace_are_kept(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trace = _ReadBatch("z", declared=False)
+            estimator = _get_estimator(record_dir=os.path.join(tmp_dir, "records"), traces=[trace])
+            estimator.fit()
+            self.assertIn("z", estimator.pipeline.get_current_value(0).feature_name["train"][0])
+            self.assertEqual(len(trace.values), 4)
+
+    def test_record_features_not_declared_are_skipped(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            estimator = _get_estimator(record_dir=os.path.join(tmp_dir, "records"))
+            estimator._initialize()
+            self.assertNotIn("z", estimator.pipeline.get_current_value(0).feature_name["train"][0])
+
+    def test_default_traces_declare_batch_inputs(self):
+        estimator = _get_estimator(log_steps=1)
+        estimator._initialize()
+        self.assertTrue(all(trace.batch_inputs is not None for trace in estimator.traces))
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------- Strict Tracing --------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_numpy_scalars_are_dynamic(self):
+        self.assertTrue(fe.Estimator._is_dynamic_scalar("num_examples", np.int64(16)))
+        self.assertTrue(fe.Estimator._is_dynamic_scalar("lr", np.float32(0.1)))
+        self.assertTrue(fe.Estimator._is_dynamic_scalar("num_examples", 16))
+        self.assertFalse(fe.Estimator._is_dynamic_scalar("flag", True))
+        self.assertFalse(fe.Estimator._is_dynamic_scalar("flag", np.bool_(True)))
+        self.assertFalse(fe.Estimator._is_dynamic_scalar("batch_size", np.int64(4)))
+
+    def test_strict_tracing_does_not_retrace_on_numpy_scalars(self):
+        estimator = _get_estimator(strict_tracing=True)
+        estimator._initialize()
+        ops = estimator.network.load_epoch(0, "train")
+        batch = {"x": tf.ones((4, 2)), "y": tf.zeros((4, 1))}
+        for num_examples in (np.int64(16), np.int64(32)):
+            estimator._run_step("train", batch, ops, {
+                "mode": "train",
+                "batch_size": 4,
+                "local_batch_size": 4,
+                "epoch": tf.convert_to_tensor(0),
+                "num_examples": num_examples,
+                "warmup": False
+            })
+        self.assertEqual(estimator.retrace_monitor.trace_counts["train step"], 1)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------- Benchmark/DryRun ------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def _assert_accumulators_empty(self, estimator):
+        update_op = [op for op in estimator.network.load_epoch(0, "train") if isinstance(op, UpdateOp)][0]
+        self.assertEqual(int(update_op.accumulated_steps.numpy()), 0)
+        for accumulator in update_op.accumulators:
+            np.testing.assert_array_equal(accumulator.numpy(), np.zeros(accumulator.shape))
+
+    def test_benchmark_restores_accumulators(self):
+        estimator = _get_estimator(update_kwargs={"accumulation_steps": 2})
+        weights = estimator.network.model["model"].get_weights()
+        estimator.benchmark(num_steps=3)
+        self._assert_accumulators_empty(estimator)
+        for weight, restored in zip(weights, estimator.network.model["model"].get_weights()):
+            np.testing.assert_array_equal(weight, restored)
+
+    def test_dry_run_restores_accumulators(self):
+        estimator = _get_estimator(update_kwargs={"accumulation_steps": 2})
+        estimator.fit(dry_run=True)
+        self._assert_accumulators_empty(estimator)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------- Find Batch Size -------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_find_batch_size_keeps_accumulation(self):
+        estimator = _get_estimator(num_examples=32, update_kwargs={"accumulation_steps": 2})
+        weights = estimator.network.model["model"].get_weights()
+        batch_size = estimator.find_batch_size(max_batch_size=8)
+        self.assertEqual(batch_size, 8)
+        self.assertEqual(estimator.pipeline.get_current_value(0).batch_size, 8)
+        update_op = [op for op in estimator.network.load_epoch(0, "train") if isinstance(op, UpdateOp)][0]
+        self.assertEqual(update_op.accumulation_steps, 2)
+        self._assert_accumulators_empty(estimator)
+        for weight, restored in zip(weights, estimator.network.model["model"].get_weights()):
+            np.testing.assert_array_equal(weight, restored)
+        self.assertEqual(estimator._step_fns, {})
+        estimator.fit()
+        self.assertEqual(estimator.retrace_monitor.trace_counts["train step"], 1)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------- Distributed ------------------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    @skipIf(tf.config.experimental.list_physical_devices("GPU"), "virtual cpu replicas are only used without GPU")
+    def test_train_step_on_virtual_cpu_replicas(self):
+        env = dict(os.environ, FE_NUM_CPU_REPLICAS="2")
+        result = subprocess.run([sys.executable, "-c", _MIRRORED_TRAIN_STEP],
+                                env=env,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stdout)
@@ -0,0 +1,83 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Load generator for benchmarking an `InferenceServer`.
+
+Example: ::
+
+    python -m fastestimator.inference.benchmark request.json --url http://127.0.0.1:8080 --concurrency 32
+"""
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def run_load_test(url, body, num_requests=1000, concurrency=16):
+    """Send the same request concurrently to an inference server and measure the client side latencies.
+
+    Args:
+        url (str): Base url of the server, for example "http://127.0.0.1:8080".
+        body (bytes): JSON request body of a single example.
+        num_requests (int, optional): Total number of requests to send. Defaults to 1000.
+        concurrency (int, optional): Number of requests in flight at the same time. Defaults to 16.
+
+    Returns:
+        dict: Throughput, failure count and p50/p99 latencies in milliseconds.
+    """
+    def _send(_):
+        request = urllib.request.Request(url + "/predict", data=body, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            return time.perf_counter() - start
+        except OSError:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(_send, range(num_requests)))
+    elapsed = time.perf_counter() - start
+    succeeded = np.array([latency for latency in latencies if latency is not None]) * 1000
+    return {
+        "requests/sec": len(succeeded) / elapsed,
+        "num_failed": num_requests - len(succeeded),
+        "p50_ms": float(np.percentile(succeeded, 50)) if succeeded.size else 0.0,
+        "p99_ms": float(np.percentile(succeeded, 99)) if succeeded.size else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a FastEstimator inference server",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     allow_abbrev=False)
+    parser.add_argument('request', type=str, help="The path to a JSON file holding the features of one example")
+    parser.add_argument('--url', type=str, default="http://127.0.0.1:8080", help="The base url of the server")
+    parser.add_argument('--num_requests', type=int, default=1000, help="The total number of requests to send")
+    parser.add_argument('--concurrency', type=int, default=16, help="The number of requests in flight")
+    args = parser.parse_args()
+    with open(args.request, 'rb') as fp:
+        body = fp.read()
+    result = run_load_test(args.url, body, num_requests=args.num_requests, concurrency=args.concurrency)
+    print("FastEstimator-Benchmark: client: {}".format(json.dumps(result)))
+    with urllib.request.urlopen(args.url + "/metrics") as response:
+        print("FastEstimator-Benchmark: server: {}".format(response.read().decode("utf-8")))
+
+
+if __name__ == '__main__':
+    main()
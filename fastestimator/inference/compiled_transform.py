@@ -0,0 +1,165 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Compiled transform for low latency inference."""
+import numpy as np
+import tensorflow as tf
+
+from fastestimator.network import _HoistedOp
+from fastestimator.op import get_op_from_mode
+from fastestimator.pipeline import Pipeline
+from fastestimator.util.util import to_list
+
+
+class CompiledTransform:
+    """Apply the `Pipeline` and `Network` ops of a mode to incoming requests through a single `tf.function`.
+
+    The op chain is traced once against a fixed input signature and the resulting graph is reused by every call, no
+    `tf.data` dataset is involved. Ops whose inputs are not available from the request (for example losses which need
+    labels) are skipped.
+
+    Args:
+        pipeline (Pipeline, optional): Pipeline whose ops are applied to the request first. Defaults to None.
+        network (Network, optional): Network whose ops are applied to the pipeline output. Defaults to None.
+        mode (str, optional): Mode of the ops to apply. Defaults to "eval".
+        epoch (int, optional): Epoch used to resolve scheduled ops. Defaults to 0.
+        input_signature (dict, optional): Dictionary mapping feature name to the `tf.TensorSpec` of a single example
+            (without batch dimension). If None, it is inferred from the first request. Defaults to None.
+        outputs (str, list, optional): Keys to return. If None, every available key is returned. Defaults to None.
+        batch (bool, optional): Whether requests carry a leading batch dimension. Pipeline ops are then mapped over the
+            batch while network ops process the whole batch at once. Defaults to False.
+    """
+    def __init__(self,
+                 pipeline=None,
+                 network=None,
+                 mode="eval",
+                 epoch=0,
+                 input_signature=None,
+                 outputs=None,
+                 batch=False):
+        assert pipeline or network, "must provide pipeline or network"
+        self.pipeline = pipeline
+        self.network = network
+        self.mode = mode
+        self.epoch = epoch
+        self.outputs = to_list(outputs) if outputs else None
+        self.batch = batch
+        self.input_signature = None
+        self.pipeline_ops = []
+        self.network_ops = []
+        self._transform_fn = None
+        if pipeline:
+            epoch_ops_all, _, filter_ops = pipeline._get_epoch_ops(get_op_from_mode(pipeline.ops, mode), epoch)
+            assert not filter_ops, "CompiledTransform does not support TensorFilter"
+            self.pipeline_ops = epoch_ops_all
+        if network:
+            if not network.op_schedule:
+                network.prepare(mode_list=[mode])
+            assert mode in network.op_schedule, "network is not prepared for mode {}".format(mode)
+            self.network_ops = network.op_schedule[mode].get_current_value(epoch)
+        if input_signature:
+            self._build(input_signature)
+
+    def __call__(self, data):
+        """Transform a single request.
+
+        Args:
+            data (dict): Dictionary mapping feature name to value. Values are cast to the dtype of the input signature.
+
+        Returns:
+            dict: Dictionary mapping output keys to numpy arrays.
+        """
+        if self._transform_fn is None:
+            self._build({key: self._get_spec(value) for key, value in data.items()})
+        inputs = {
+            key: np.asarray(data[key], dtype=spec.dtype.as_numpy_dtype)
+            for key, spec in self.input_signature.items()
+        }
+        return {key: value.numpy() for key, value in self._transform_fn(inputs).items()}
+
+    def _get_spec(self, value):
+        value = np.asarray(value)
+        shape = value.shape[1:] if self.batch else value.shape
+        if value.dtype.kind in ("U", "S", "O"):
+            # text columns, such as file paths read from a csv file, are passed as strings
+            if value.dtype.kind == "O" and not all(isinstance(item, (str, bytes)) for item in value.flat):
+                raise ValueError("unsupported object feature of shape {}, only strings and numbers are supported"
+                                 .format(value.shape))
+            return tf.TensorSpec(shape, tf.string)
+        return tf.TensorSpec(shape, tf.as_dtype(value.dtype))
+
+    def _build(self, input_signature):
+        self.input_signature = dict(input_signature)
+        pipeline_ops, available_keys = self._select_ops(self.pipeline_ops, set(self.input_signature))
+        network_ops, available_keys = self._select_ops(self.network_ops, available_keys)
+        outputs = self.outputs or sorted(available_keys)
+        assert set(outputs) <= available_keys, "outputs {} cannot be computed from inputs {}".format(
+            ", ".join(set(outputs) - available_keys), ", ".join(self.input_signature))
+        if self.batch:
+            signature = {key: tf.TensorSpec([None] + spec.shape.as_list(), spec.dtype)
+                         for key, spec in self.input_signature.items()}
+        else:
+            signature = self.input_signature
+        pipeline_fn = None
+        if self.batch and pipeline_ops:
+            pipeline_fn = self.pipeline._build_bulk_transform_fn([pipeline_ops], [], {"mode": self.mode})
+
+        @tf.function(input_signature=[signature])
+        def _transform(data):
+            data = dict(data)
+            if pipeline_fn:
+                data = pipeline_fn(data)
+            elif pipeline_ops:
+                data = Pipeline._preprocess_fn(data, pipeline_ops, {"mode": self.mode})
+            if network_ops:
+                batch = data if self.batch else {key: tf.expand_dims(value, axis=0) for key, value in data.items()}
+                batch_size = tf.shape(next(iter(batch.values())))[0]
+                state = {
+                    "mode": self.mode,
+                    "epoch": self.epoch,
+                    "warmup": False,
+                    "batch_size": batch_size,
+                    "local_batch_size": batch_size
+                }
+                prediction = self.network.run_step(batch, network_ops, state)
+                for key, value in prediction.items():
+                    if not self.batch and value.shape.rank:
+                        value = tf.squeeze(value, axis=0)
+                    data[key] = value
+            return {key: data[key] for key in outputs}
+
+        self._transform_fn = _transform
+
+    @staticmethod
+    def _select_ops(ops, available_keys):
+        """Keep the ops whose inputs can be computed from the available keys."""
+        selected_ops = []
+        available_keys = set(available_keys)
+        previous_selected = False
+        for op in ops:
+            if isinstance(op, _HoistedOp):
+                # a hoisted op serves its cached output, it does not read the output of the previous op
+                selected = True
+            elif op.inputs is None:
+                selected = previous_selected
+            elif hasattr(op.inputs, "__call__"):
+                selected = True
+            else:
+                selected = set(to_list(op.inputs)) <= available_keys
+            if selected:
+                selected_ops.append(op)
+                if op.outputs:
+                    available_keys |= set(to_list(op.outputs))
+            previous_selected = selected
+        return selected_ops, available_keys
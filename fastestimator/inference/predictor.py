@@ -0,0 +1,250 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Batch inference engine."""
+import json
+import os
+import time
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from fastestimator.inference.compiled_transform import CompiledTransform
+from fastestimator.pipeline import Pipeline
+from fastestimator.record_writer import RecordWriter
+from fastestimator.util.util import to_list
+
+ROW_INDEX_KEY = "row_index"
+
+
+class BatchPredictor:
+    """Run the eval-mode `Pipeline` and `Network` ops over a dataset in large batches and stream the predictions to
+    sharded output files.
+
+    Inputs are read in their original order and prepared on a background thread while the previous batch is being
+    predicted. Every output row carries the `row_index` of the input example it was computed from. Every completed
+    shard is recorded in a progress file inside `save_dir`, so that a restarted prediction resumes after the last
+    input example of the last completed shard instead of starting over.
+
+    Args:
+        network (Network): Network whose ops compute the predictions.
+        data (str, dict): A CSV file, a record directory written by `RecordWriter`, or a dictionary of features.
+        save_dir (str): Directory to write the prediction shards into.
+        pipeline (Pipeline, optional): Pipeline whose ops are applied before the network. If its data is a
+            `RecordWriter`, the writer ops are also applied to CSV or dictionary inputs. Defaults to None.
+        batch_size (int, optional): Number of examples per prediction batch. Defaults to 256.
+        outputs (str, list, optional): Keys to save. If None, every key produced by the network is saved. Defaults
+            to None.
+        mode (str, optional): Mode of the ops to apply. Defaults to "eval".
+        epoch (int, optional): Epoch used to resolve scheduled ops. Defaults to 0.
+        examples_per_shard (int, optional): Number of examples written to each output file. Defaults to 100000.
+        output_format (str, optional): Either "npz" or "csv". Defaults to "npz".
+        log_steps (int, optional): Number of batches between throughput reports. Defaults to 100.
+        prefetch (int, optional): Number of input batches prepared ahead of the prediction. Defaults to 4.
+        resume (bool, optional): Whether to resume from the progress file found in `save_dir`. Defaults to True.
+    """
+    def __init__(self,
+                 network,
+                 data,
+                 save_dir,
+                 pipeline=None,
+                 batch_size=256,
+                 outputs=None,
+                 mode="eval",
+                 epoch=0,
+                 examples_per_shard=100000,
+                 output_format="npz",
+                 log_steps=100,
+                 prefetch=4,
+                 resume=True):
+        assert isinstance(data, (str, dict)), "data must be either a csv path, a record directory or a dictionary"
+        assert output_format in ("npz", "csv"), "output_format must be either 'npz' or 'csv'"
+        assert examples_per_shard >= batch_size, "examples_per_shard must be at least batch_size"
+        self.network = network
+        self.data = data
+        self.save_dir = save_dir
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.outputs = to_list(outputs) if outputs else None
+        self.mode = mode
+        self.epoch = epoch
+        self.examples_per_shard = examples_per_shard
+        self.output_format = output_format
+        self.log_steps = log_steps
+        self.prefetch = prefetch
+        self.resume = resume
+        self.progress_file = os.path.join(self.save_dir, "predict_progress.json")
+        self.transform = None
+
+    def predict(self):
+        """Predict every example of the data and write the prediction shards.
+
+        Returns:
+            list: Names of all shards written in `save_dir`.
+        """
+        os.makedirs(self.save_dir, exist_ok=True)
+        progress = self._load_progress()
+        num_examples = self._get_num_examples()
+        print("FastEstimator-Predict: {} examples, {} already predicted".format(num_examples,
+                                                                                progress["num_examples"]))
+        results, num_result = [], 0
+        num_done, step = progress["num_examples"], 0
+        time_start, example_start = time.perf_counter(), num_done
+        for batch in self._prefetch(self._get_batches(num_done)):
+            row_index = batch.pop(ROW_INDEX_KEY)
+            if self.transform is None:
+                self.transform = self._get_transform(batch)
+            prediction = self.transform(batch)
+            prediction[ROW_INDEX_KEY] = row_index
+            results.append(prediction)
+            num_result += len(next(iter(prediction.values())))
+            step += 1
+            if num_result >= self.examples_per_shard:
+                num_done = self._write_shard(results, progress)
+                results, num_result = [], 0
+            if self.log_steps and step % self.log_steps == 0:
+                num_read = int(row_index[-1]) + 1 if len(row_index) else num_done
+                example_per_sec = (num_read - example_start) / (time.perf_counter() - time_start)
+                print("FastEstimator-Predict: step: {}; examples/sec: {:.1f}; progress: {:.1%}".format(
+                    step, example_per_sec, num_read / max(num_examples, 1)))
+        if results:
+            num_done = self._write_shard(results, progress)
+        elapsed = time.perf_counter() - time_start
+        print("FastEstimator-Predict: predicted {} examples in {:.2f} sec; examples/sec: {:.1f}".format(
+            num_done - example_start, elapsed, (num_done - example_start) / max(elapsed, 1e-9)))
+        return progress["shards"]
+
+    def _get_transform(self, batch):
+        transform = CompiledTransform(pipeline=self.pipeline,
+                                      network=self.network,
+                                      mode=self.mode,
+                                      epoch=self.epoch,
+                                      batch=True)
+        outputs = self.outputs
+        if outputs is None:
+            # default to every key the network can produce from this input
+            _, pipeline_keys = transform._select_ops(transform.pipeline_ops, set(batch))
+            _, available_keys = transform._select_ops(transform.network_ops, pipeline_keys)
+            outputs = sorted(available_keys - pipeline_keys)
+        transform.outputs = outputs
+        return transform
+
+    def _get_num_examples(self):
+        if isinstance(self.data, dict):
+            return len(next(iter(self.data.values())))
+        if os.path.isdir(self.data):
+            reader = self._get_record_reader()
+            return int(reader.num_examples[self._get_record_mode(reader)][0])
+        return len(pd.read_csv(self.data))
+
+    def _get_batches(self, num_skip):
+        if isinstance(self.data, str) and os.path.isdir(self.data):
+            for batch in self._get_record_batches(num_skip):
+                yield batch
+            return
+        if isinstance(self.data, dict):
+            data = self.data
+        else:
+            data = pd.read_csv(self.data).to_dict('list')
+        assert ROW_INDEX_KEY not in data, "input feature name '{}' is reserved".format(ROW_INDEX_KEY)
+        num_examples = len(next(iter(data.values())))
+        writer = self.pipeline.data if self.pipeline and isinstance(self.pipeline.data, RecordWriter) else None
+        for start in range(num_skip, num_examples, self.batch_size):
+            batch = {key: np.asarray(value[start:start + self.batch_size]) for key, value in data.items()}
+            row_index = np.arange(start, start + len(next(iter(batch.values()))))
+            if writer:
+                batch = writer.bulk_transform(batch, self.mode)
+                if writer.expand_dims:
+                    # every input example turns into several examples, which all keep the row index of their input
+                    num_patches = len(next(iter(batch.values()))[0])
+                    batch = {key: value.reshape((-1, ) + value.shape[2:]) for key, value in batch.items()}
+                    row_index = np.repeat(row_index, num_patches)
+            batch[ROW_INDEX_KEY] = row_index
+            yield batch
+
+    def _get_record_batches(self, num_skip):
+        reader = self._get_record_reader()
+        mode = self._get_record_mode(reader)
+        reader._get_feature_name(mode)
+        num_examples = int(reader.num_examples[mode][0])
+        rows = tf.data.Dataset.range(num_examples)
+        dataset = tf.data.Dataset.zip((reader._read_ordered_records(mode), rows)).skip(num_skip)
+        dataset = dataset.batch(self.batch_size).prefetch(1)
+        for batch, row_index in dataset:
+            batch = {key: value.numpy() for key, value in batch.items()}
+            assert ROW_INDEX_KEY not in batch, "record feature name '{}' is reserved".format(ROW_INDEX_KEY)
+            batch[ROW_INDEX_KEY] = row_index.numpy()
+            yield batch
+
+    def _get_record_reader(self):
+        reader = Pipeline(data=self.data, batch_size=self.batch_size)
+        reader._get_tfrecord_config(self.data)
+        return reader
+
+    def _get_record_mode(self, reader):
+        return self.mode if self.mode in reader.mode_list else reader.mode_list[0]
+
+    def _prefetch(self, batches):
+        queue = Queue(maxsize=self.prefetch)
+        end = object()
+
+        def _produce():
+            try:
+                for batch in batches:
+                    queue.put(batch)
+            except Exception as error:  # pylint: disable=broad-except
+                queue.put(error)
+            queue.put(end)
+
+        Thread(target=_produce, daemon=True).start()
+        while True:
+            batch = queue.get()
+            if batch is end:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+
+    def _write_shard(self, results, progress):
+        shard = {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+        shard_name = "predictions_{:05d}.{}".format(len(progress["shards"]), self.output_format)
+        shard_path = os.path.join(self.save_dir, shard_name)
+        temp_path = shard_path + ".tmp"
+        if self.output_format == "npz":
+            with open(temp_path, "wb") as fp:
+                np.savez(fp, **shard)
+        else:
+            shard = {key: value.tolist() if value.ndim > 1 else value for key, value in shard.items()}
+            pd.DataFrame(shard).to_csv(temp_path, index=False)
+        os.replace(temp_path, shard_path)
+        progress["shards"].append(shard_name)
+        # progress counts input examples, which may each produce several output rows
+        progress["num_examples"] = int(shard[ROW_INDEX_KEY][-1]) + 1
+        self._save_progress(progress)
+        return progress["num_examples"]
+
+    def _load_progress(self):
+        if self.resume and os.path.exists(self.progress_file):
+            with open(self.progress_file, 'r') as fp:
+                return json.load(fp)
+        return {"num_examples": 0, "shards": []}
+
+    def _save_progress(self, progress):
+        temp_path = self.progress_file + ".tmp"
+        with open(temp_path, 'w') as fp:
+            json.dump(progress, fp, indent=4)
+        os.replace(temp_path, self.progress_file)
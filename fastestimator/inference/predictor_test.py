@@ -0,0 +1,104 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import tensorflow as tf
+
+import fastestimator as fe
+from fastestimator.inference.compiled_transform import CompiledTransform
+from fastestimator.inference.predictor import BatchPredictor
+from fastestimator.op import TensorOp
+from fastestimator.op.tensorop import MeanSquaredError, ModelOp, Scale
+from fastestimator.pipeline import Pipeline
+from fastestimator.record_writer import RecordWriter
+
+
+class TestBatchPredictor(TestCase):
+    def _predict(self, record_dir, save_dir):
+        pipeline = Pipeline(data=record_dir, batch_size=4, ops=Scale(scalar=2, inputs="x", outputs="y"))
+        predictor = BatchPredictor(network=None,
+                                   data=record_dir,
+                                   save_dir=save_dir,
+                                   pipeline=pipeline,
+                                   batch_size=3,
+                                   outputs="y",
+                                   mode="train",
+                                   examples_per_shard=3)
+        shards = [np.load(os.path.join(save_dir, shard)) for shard in predictor.predict()]
+        return {key: np.concatenate([shard[key] for shard in shards]) for key in ["row_index", "y"]}
+
+    def test_predict_records_in_order(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            record_dir = os.path.join(tmp_dir, "records")
+            x = np.random.rand(10).astype("float32")
+            RecordWriter(train_data={"x": x}, save_dir=record_dir, output_format="memmap").write()
+            prediction = self._predict(record_dir, os.path.join(tmp_dir, "predictions"))
+            np.testing.assert_array_equal(prediction["row_index"], np.arange(10))
+            np.testing.assert_allclose(prediction["y"], x * 2, rtol=1e-6)
+
+    def test_predict_resume(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            record_dir = os.path.join(tmp_dir, "records")
+            save_dir = os.path.join(tmp_dir, "predictions")
+            x = np.random.rand(10).astype("float32")
+            RecordWriter(train_data={"x": x}, save_dir=record_dir, output_format="memmap").write()
+            self._predict(record_dir, save_dir)
+            # pretend the prediction was interrupted after the second shard
+            for shard in ["predictions_00002.npz", "predictions_00003.npz"]:
+                os.remove(os.path.join(save_dir, shard))
+            with open(os.path.join(save_dir, "predict_progress.json"), "w") as fp:
+                json.dump({"num_examples": 6, "shards": ["predictions_00000.npz", "predictions_00001.npz"]}, fp)
+            prediction = self._predict(record_dir, save_dir)
+            np.testing.assert_array_equal(prediction["row_index"], np.arange(10))
+            np.testing.assert_allclose(prediction["y"], x * 2, rtol=1e-6)
+
+
+class _Constant(TensorOp):
+    batch_independent = True
+
+    def forward(self, data, state):
+        return tf.identity(data)
+
+
+class TestCompiledTransform(TestCase):
+    def test_string_feature_spec(self):
+        transform = CompiledTransform(pipeline=Pipeline(data={"train": {"x": np.zeros(2)}}, batch_size=1), batch=True)
+        spec = transform._get_spec(np.array(["a.png", "b.png"], dtype=object))
+        self.assertEqual(spec.dtype, tf.string)
+        self.assertEqual(spec.shape.as_list(), [])
+        with self.assertRaises(ValueError):
+            transform._get_spec(np.array([[1, 2], [3]], dtype=object))
+
+    def test_hoisted_op_after_skipped_op(self):
+        model = fe.build(model_def=lambda: tf.keras.Sequential([tf.keras.layers.Dense(1, input_shape=(2, ))]),
+                         model_name="model",
+                         optimizer="sgd",
+                         loss_name="loss")
+        network = fe.Network(ops=[
+            ModelOp(model=model, inputs="x", outputs="y_pred"),
+            MeanSquaredError(y_true="y", y_pred="y_pred", outputs="loss"),
+            _Constant(inputs=lambda: tf.ones((2, 2)), outputs="style")
+        ])
+        network.prepare(mode_list=["eval"])
+        # the loss is skipped since requests carry no label, the hoisted op follows it
+        self.assertNotIn("_Constant", [type(op).__name__ for op in network.op_schedule["eval"].get_current_value(0)])
+        transform = CompiledTransform(network=network, outputs=["y_pred", "style"], batch=True)
+        result = transform({"x": np.ones((3, 2), dtype="float32")})
+        self.assertEqual(result["y_pred"].shape, (3, 1))
+        np.testing.assert_array_equal(result["style"], np.ones((2, 2)))
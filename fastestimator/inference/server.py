@@ -0,0 +1,292 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Local inference server with dynamic request batching."""
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Full, Queue
+
+import numpy as np
+
+
+class LatencyTracker:
+    """Thread-safe record of request latencies and batch sizes over a sliding window.
+
+    Args:
+        window (int, optional): Number of most recent requests used to compute the percentiles. Defaults to 10000.
+    """
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.num_requests = 0
+        self.num_rejected = 0
+        self.lock = threading.Lock()
+
+    def record_batch(self, latencies):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes.append(len(latencies))
+            self.num_requests += len(latencies)
+
+    def record_rejected(self):
+        with self.lock:
+            self.num_rejected += 1
+
+    def summary(self):
+        """Return the number of requests, the p50/p99 latencies in milliseconds and the mean batch size."""
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            summary = {
+                "num_requests": self.num_requests,
+                "num_rejected": self.num_rejected,
+                "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0
+            }
+        summary["p50_ms"] = float(np.percentile(latencies, 50)) if latencies.size else 0.0
+        summary["p99_ms"] = float(np.percentile(latencies, 99)) if latencies.size else 0.0
+        return summary
+
+
+class DynamicBatcher:
+    """Coalesce concurrent single-example requests into batches for a batched transform.
+
+    A background thread takes requests from a bounded queue and runs them as one batch once `max_batch_size` requests
+    are collected or the oldest request has waited `max_latency_ms`, whichever comes first. Requests are checked
+    against the input signature of the transform when they are submitted, so that a malformed request cannot fail
+    the other requests of its batch. Until the transform is built, the first request defines the signature.
+
+    Args:
+        transform (CompiledTransform): Transform created with `batch=True`.
+        max_batch_size (int, optional): Maximum number of requests per batch. Defaults to 32.
+        max_latency_ms (float, optional): Maximum time a request waits for the batch to fill up. Defaults to 5.
+        max_queue_size (int, optional): Maximum number of pending requests, further requests are rejected. Defaults
+            to 1024.
+    """
+    def __init__(self, transform, max_batch_size=32, max_latency_ms=5, max_queue_size=1024):
+        assert transform.batch, "DynamicBatcher requires a CompiledTransform with batch=True"
+        self.transform = transform
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue = Queue(maxsize=max_queue_size)
+        self.metrics = LatencyTracker()
+        self._signature = None
+        self._signature_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def submit(self, data):
+        """Queue a single example.
+
+        Args:
+            data (dict): Dictionary mapping feature name to the value of one example.
+
+        Returns:
+            Future: Resolves to the dictionary of outputs for the example.
+
+        Raises:
+            ValueError: If the features, shapes or types of the example do not match the input signature.
+            queue.Full: If the number of pending requests reached `max_queue_size`.
+        """
+        self._verify_request(data)
+        future = Future()
+        try:
+            self.queue.put_nowait((data, future, time.perf_counter()))
+        except Full:
+            self.metrics.record_rejected()
+            raise
+        return future
+
+    def _verify_request(self, data):
+        signature = self._get_signature(data)
+        if set(data) != set(signature):
+            raise ValueError("expected features {}, found {}".format(sorted(signature), sorted(data)))
+        for key, (shape, is_string) in signature.items():
+            value = np.asarray(data[key])
+            if value.ndim != len(shape) or any(dim not in (None, size) for dim, size in zip(shape, value.shape)):
+                raise ValueError("expected shape {} for feature '{}', found {}".format(shape, key, list(value.shape)))
+            if is_string != (value.dtype.kind in "USO"):
+                raise ValueError("expected {} value for feature '{}', found {}".format(
+                    "string" if is_string else "numeric", key, value.dtype))
+
+    def _get_signature(self, data):
+        if self.transform.input_signature:
+            return {
+                key: (spec.shape.as_list(), spec.dtype.name == "string")
+                for key, spec in self.transform.input_signature.items()
+            }
+        with self._signature_lock:
+            if self._signature is None:
+                self._signature = {
+                    key: (list(np.shape(value)), np.asarray(value).dtype.kind in "USO")
+                    for key, value in data.items()
+                }
+            return self._signature
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                requests = [self.queue.get(timeout=0.1)]
+            except Empty:
+                continue
+            deadline = requests[0][2] + self.max_latency
+            while len(requests) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    requests.append(self.queue.get(timeout=remaining))
+                except Empty:
+                    break
+            self._run_batch(requests)
+
+    def _run_batch(self, requests):
+        try:
+            batch = {key: np.stack([data[key] for data, _, _ in requests]) for key in requests[0][0]}
+            result = self.transform(batch)
+        except Exception as error:  # pylint: disable=broad-except
+            for _, future, _ in requests:
+                future.set_exception(error)
+            return
+        end = time.perf_counter()
+        for idx, (_, future, _) in enumerate(requests):
+            future.set_result({key: value[idx] for key, value in result.items()})
+        self.metrics.record_batch([end - arrival for _, _, arrival in requests])
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default listen backlog of 5 makes concurrent clients wait for connection retries
+    request_queue_size = 1024
+
+
+class InferenceServer:
+    """HTTP server answering single-example prediction requests through a `DynamicBatcher`.
+
+    Endpoints:
+        * POST /predict: JSON dictionary of features for one example, returns the JSON dictionary of outputs.
+        * GET /metrics: request count, rejected count, mean batch size and p50/p99 latency in milliseconds.
+        * GET /health: returns {"status": "ok"}.
+
+    Args:
+        transform (CompiledTransform): Transform created with `batch=True`.
+        host (str, optional): Host to bind. Defaults to "127.0.0.1".
+        port (int, optional): Port to bind. Defaults to 8080.
+        max_batch_size (int, optional): Maximum number of requests per batch. Defaults to 32.
+        max_latency_ms (float, optional): Maximum time a request waits for the batch to fill up. Defaults to 5.
+        max_queue_size (int, optional): Maximum number of pending requests. Defaults to 1024.
+        request_timeout (float, optional): Seconds to wait for a prediction before answering with an error. Defaults
+            to 30.
+    """
+    def __init__(self,
+                 transform,
+                 host="127.0.0.1",
+                 port=8080,
+                 max_batch_size=32,
+                 max_latency_ms=5,
+                 max_queue_size=1024,
+                 request_timeout=30):
+        self.batcher = DynamicBatcher(transform,
+                                      max_batch_size=max_batch_size,
+                                      max_latency_ms=max_latency_ms,
+                                      max_queue_size=max_queue_size)
+        self.request_timeout = request_timeout
+        self.httpd = _HTTPServer((host, port), self._get_handler())
+
+    def serve_forever(self):
+        self.batcher.start()
+        host, port = self.httpd.server_address[:2]
+        print("FastEstimator-Serve: Serving on http://{}:{}".format(host, port))
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.batcher.stop()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @staticmethod
+    def parse_request(body):
+        """Convert a JSON request body to numpy arrays, using int32 and float32 like the `Pipeline` decoding."""
+        data = {}
+        for key, value in json.loads(body).items():
+            value = np.asarray(value)
+            if value.dtype.kind in "iu":
+                value = value.astype(np.int32)
+            elif value.dtype.kind in "fb":
+                value = value.astype(np.float32)
+            data[key] = value
+        return data
+
+    def _get_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path == "/metrics":
+                    self._respond(200, server.batcher.metrics.summary())
+                elif self.path == "/health":
+                    self._respond(200, {"status": "ok"})
+                else:
+                    self._respond(404, {"error": "unknown path {}".format(self.path)})
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                if self.path != "/predict":
+                    self._respond(404, {"error": "unknown path {}".format(self.path)})
+                    return
+                try:
+                    data = server.parse_request(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                except (ValueError, AttributeError) as error:
+                    self._respond(400, {"error": str(error)})
+                    return
+                try:
+                    future = server.batcher.submit(data)
+                except ValueError as error:
+                    self._respond(400, {"error": str(error)})
+                    return
+                except Full:
+                    self._respond(503, {"error": "server is overloaded"})
+                    return
+                try:
+                    result = future.result(timeout=server.request_timeout)
+                except Exception as error:  # pylint: disable=broad-except
+                    self._respond(500, {"error": str(error)})
+                    return
+                self._respond(200, {key: np.asarray(value).tolist() for key, value in result.items()})
+
+            def _respond(self, code, content):
+                body = json.dumps(content).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        return _Handler
@@ -0,0 +1,44 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+from unittest import TestCase
+
+import numpy as np
+
+from fastestimator.inference.compiled_transform import CompiledTransform
+from fastestimator.inference.server import DynamicBatcher
+from fastestimator.op.tensorop import Scale
+from fastestimator.pipeline import Pipeline
+
+
+class TestDynamicBatcher(TestCase):
+    def test_malformed_request_is_rejected_alone(self):
+        pipeline = Pipeline(data={"train": {"x": np.zeros((2, 3))}},
+                            batch_size=1,
+                            ops=Scale(scalar=2, inputs="x", outputs="y"))
+        batcher = DynamicBatcher(CompiledTransform(pipeline=pipeline, outputs="y", batch=True), max_latency_ms=50)
+        batcher.start()
+        try:
+            future = batcher.submit({"x": np.ones(3, dtype=np.float32)})
+            with self.assertRaises(ValueError):
+                batcher.submit({"x": np.ones(4, dtype=np.float32)})
+            with self.assertRaises(ValueError):
+                batcher.submit({"z": np.ones(3, dtype=np.float32)})
+            with self.assertRaises(ValueError):
+                batcher.submit({"x": np.array(["a", "b", "c"])})
+            other_future = batcher.submit({"x": np.zeros(3, dtype=np.float32)})
+            np.testing.assert_allclose(future.result(timeout=30)["y"], np.full(3, 2.0))
+            np.testing.assert_allclose(other_future.result(timeout=30)["y"], np.zeros(3))
+        finally:
+            batcher.stop()
@@ -14,13 +14,15 @@
 # ==============================================================================
 from collections import ChainMap, defaultdict
 
+import numpy as np
 import tensorflow as tf
+from tensorflow.keras.mixed_precision import experimental as mixed_precision
 
 import fastestimator as fe
-from fastestimator.op import get_inputs_by_op, get_op_from_mode, verify_ops, write_outputs_by_key
-from fastestimator.op.tensorop import Loss, ModelOp, UpdateOp
+from fastestimator.op import TensorOp, get_inputs_by_op, get_op_from_mode, verify_ops, write_outputs_by_key
+from fastestimator.op.tensorop import Gradients, Loss, ModelOp, UpdateOp, Watch
 from fastestimator.schedule import Scheduler
-from fastestimator.util.util import NonContext, flatten_list, to_list, to_set
+from fastestimator.util.util import NonContext, flatten_list, get_base_optimizer, to_list, to_set
 
 
 class Network:
@@ -41,9 +43,21 @@ class Network:
         self.all_output_keys = set()
         self.stop_training = False
         self.num_devices = 1
+        self.tape_plan = {}
+        self.hoisted_ops = {}
+        self.weight_snapshots = {}
 
-    def prepare(self, mode_list):
+    def prepare(self, mode_list, required_keys=None):
         """This function constructs the operations necessary for each epoch
+
+        Ops declared batch-independent which are deterministic are evaluated once per epoch and served from a cache.
+        When `required_keys` is given, ops whose outputs are neither consumed by later ops, losses nor `required_keys`
+        are removed.
+
+        Args:
+            mode_list (list): Modes to prepare.
+            required_keys (set, optional): Keys read outside of the network, for example by traces. None disables the
+                removal of unused ops. Defaults to None.
         """
         all_output_keys = []
         all_models = []
@@ -71,6 +85,8 @@ class Network:
                     if isinstance(op, ModelOp):
                         if op.model not in epoch_model:
                             epoch_model.append(op.model)
+                        # models only used frozen (trainable=False) do not get a default UpdateOp
+                        if op.trainable:
                             epoch_model_update[op.model] = epoch_model_update[op.model]
                         if op.model not in all_models:
                             all_models.append(op.model)
@@ -80,6 +96,16 @@ class Network:
                     for model, has_update in epoch_model_update.items():
                         if not has_update:
                             epoch_ops.append(UpdateOp(model=model))
+                removed_ops = []
+                if required_keys is not None:
+                    loss_keys = {model.loss_name for model in epoch_model}
+                    epoch_ops, removed_ops = self._remove_unused_ops(epoch_ops, set(required_keys) | loss_keys)
+                epoch_ops, hoisted_ops = self._hoist_ops(epoch_ops, mode)
+                if removed_ops or hoisted_ops:
+                    print("FastEstimator-Network: mode {} epoch {}: removed unused ops: {}; hoisted ops: {}".format(
+                        mode, epoch, self._describe_ops(removed_ops), self._describe_ops(hoisted_ops)))
+                if mode == "train":
+                    self.tape_plan[self._get_ops_key(epoch_ops)] = self._plan_tape(epoch_ops)
                 assert epoch_model, "Network has no model for epoch {}".format(epoch)
                 epoch_ops_map[epoch] = epoch_ops
                 epoch_model_map[epoch] = epoch_model
@@ -90,6 +116,212 @@ class Network:
             assert model.model_name not in self.model, "duplicated model name: {}".format(model.model_name)
             self.model[model.model_name] = model
 
+    def snapshot_weights(self, model_name, train_step):
+        """Return a host copy of the model weights, shared by every caller at the same training step.
+
+        Args:
+            model_name (str): Name of the model.
+            train_step (int): Current training step, the weights only change with it.
+
+        Returns:
+            list: Weights of the model as numpy arrays.
+        """
+        snapshot = self.weight_snapshots.get(model_name)
+        if snapshot is None or snapshot[0] != train_step:
+            snapshot = (train_step, self.model[model_name].get_weights())
+            self.weight_snapshots[model_name] = snapshot
+        return snapshot[1]
+
+    def snapshot_averages(self, model_name):
+        """Return a host copy of the moving average variables of the model.
+
+        During the epoch end traces the averages are swapped into the model, so these variables hold the trained
+        weights. Restoring a snapshot of the weights together with this one keeps both consistent.
+
+        Args:
+            model_name (str): Name of the model.
+
+        Returns:
+            list: Values of the moving average variables, None if the model has no moving average.
+        """
+        ema = getattr(self.model[model_name], "ema", None)
+        return [variable.numpy() for variable in ema.variables] if ema else None
+
+    def restore_weights(self, model_name, weights, averages=None):
+        """Write a snapshot of the weights, and of the moving average variables if given, back into the model.
+
+        Args:
+            model_name (str): Name of the model.
+            weights (list): Weights returned by `snapshot_weights`.
+            averages (list, optional): Values returned by `snapshot_averages`. Defaults to None.
+        """
+        model = self.model[model_name]
+        model.set_weights(weights)
+        if averages is not None:
+            for variable, value in zip(model.ema.variables, averages):
+                variable.assign(value)
+        self.weight_snapshots.pop(model_name, None)
+
+    def get_input_keys(self):
+        """Return the keys read by the network ops of every mode and epoch.
+
+        Returns:
+            set: Input keys, ops whose inputs are callables do not contribute.
+        """
+        keys = set()
+        for op in self.ops:
+            for epoch_op in op.epoch_dict.values() if isinstance(op, Scheduler) else [op]:
+                if epoch_op and epoch_op.inputs and not hasattr(epoch_op.inputs, "__call__"):
+                    keys |= to_set(epoch_op.inputs)
+        return keys
+
+    @staticmethod
+    def _remove_unused_ops(ops, required_keys):
+        """Remove ops whose outputs are not consumed, walking the ops backward while tracking the live keys.
+
+        Args:
+            ops (list): Ops of one epoch.
+            required_keys (set): Keys consumed after the network step.
+
+        Returns:
+            The kept ops and the removed ops.
+        """
+        live_keys = set(required_keys)
+        chained = False
+        kept_ops, removed_ops = [], []
+        for op in reversed(ops):
+            outputs = to_set(op.outputs) if op.outputs else set()
+            # ops without outputs only act through side effects or pass their data to the next op
+            if chained or not outputs or isinstance(op, (Loss, Watch)) or outputs & live_keys:
+                kept_ops.append(op)
+                live_keys -= outputs
+                if op.inputs is None:
+                    chained = True
+                else:
+                    chained = False
+                    if not hasattr(op.inputs, "__call__"):
+                        live_keys |= to_set(op.inputs)
+            else:
+                removed_ops.append(op)
+        return kept_ops[::-1], removed_ops[::-1]
+
+    def _hoist_ops(self, ops, mode):
+        """Replace batch-independent ops by a cache refreshed once per epoch.
+
+        Only ops declaring `batch_independent` are considered, because reads of variables updated during the epoch (for
+        example a fade-in alpha changed by a trace) cannot be detected. Such an op is hoisted when its inputs are a
+        callable or outputs of other hoisted ops, and two evaluations give identical results without reading trainable
+        variables.
+
+        Args:
+            ops (list): Ops of one epoch.
+            mode (str): Current mode.
+
+        Returns:
+            The ops with hoisted ops replaced, and the hoisted ops.
+        """
+        constants = {}
+        result_ops, hoisted_ops = [], []
+        for op in ops:
+            hoisted_op = None
+            if self._is_batch_independent(op, constants):
+                key = (id(op), mode)
+                if key not in self.hoisted_ops:
+                    value = self._evaluate_constant(op, constants, mode)
+                    self.hoisted_ops[key] = None if value is None else _HoistedOp(op, value, mode)
+                hoisted_op = self.hoisted_ops[key]
+            if hoisted_op:
+                write_outputs_by_key(constants, hoisted_op.forward(None, {}), op.outputs)
+                result_ops.append(hoisted_op)
+                hoisted_ops.append(op)
+            else:
+                if op.outputs:
+                    for key in to_set(op.outputs):
+                        constants.pop(key, None)
+                result_ops.append(op)
+        return result_ops, hoisted_ops
+
+    @staticmethod
+    def _is_batch_independent(op, constants):
+        if not op.batch_independent or not op.outputs or op.inputs is None:
+            return False
+        if isinstance(op, (Loss, UpdateOp, Gradients, Watch)):
+            return False
+        return hasattr(op.inputs, "__call__") or to_set(op.inputs) <= set(constants)
+
+    @staticmethod
+    def _evaluate_constant(op, constants, mode):
+        results = []
+        try:
+            for _ in range(2):
+                with tf.GradientTape() as tape:
+                    data = op.forward(get_inputs_by_op(op, constants), {"mode": mode, "tape": tape, "warmup": False})
+                if tape.watched_variables():
+                    return None
+                results.append(data)
+            leaves = [tf.nest.flatten(result) for result in results]
+            if not all(tf.is_tensor(leaf) for leaf in leaves[1]):
+                return None
+            if not all(np.array_equal(a.numpy(), b.numpy()) for a, b in zip(*leaves)):
+                return None
+        except Exception:  # pylint: disable=broad-except
+            # ops depending on the step state or on the batch are not hoisted
+            return None
+        return results[1]
+
+    @staticmethod
+    def _describe_ops(ops):
+        return ", ".join("{}({})".format(type(op).__name__, op.outputs) for op in ops) or "none"
+
+    @staticmethod
+    def _get_ops_key(ops):
+        return tuple(id(op) for op in ops)
+
+    @staticmethod
+    def _plan_tape(ops):
+        """Decide whether the gradient tape of a training step has to be persistent, and which frozen models can run
+        without being recorded.
+
+        The tape is persistent when the ops compute more than one gradient from it, as declared by their
+        `num_tape_gradients`. A frozen model (`ModelOp` with trainable=False) is not recorded when no gradient can flow
+        through it: its inputs do not depend on recorded ops, its inputs are not tracked and the model is not updated by
+        the same ops.
+
+        Args:
+            ops (list): Ops of one epoch in train mode.
+
+        Returns:
+            Whether the tape has to be persistent and the list of ops to run under `tape.stop_recording()`.
+        """
+        num_tape_gradients = sum(op.num_tape_gradients for op in ops)
+        updated_models = {op.model for op in ops if isinstance(op, UpdateOp)}
+        updated_models |= {model for op in ops if isinstance(op, Gradients) for model in op.models}
+        recorded_keys = set()
+        recorded = False
+        unrecorded_ops = []
+        for op in ops:
+            if op.inputs is None:
+                inputs_recorded = recorded
+            elif hasattr(op.inputs, "__call__"):
+                inputs_recorded = False
+            else:
+                inputs_recorded = bool(to_set(op.inputs) & recorded_keys)
+            if isinstance(op, Watch):
+                recorded = True
+            elif isinstance(op, ModelOp):
+                recorded = op.trainable or op.track_input or inputs_recorded or op.model in updated_models
+                if not recorded:
+                    unrecorded_ops.append(op)
+            else:
+                # custom ops may hold their own variables
+                recorded = inputs_recorded or not type(op).__module__.startswith("fastestimator.")
+            if op.outputs:
+                if recorded:
+                    recorded_keys |= to_set(op.outputs)
+                else:
+                    recorded_keys -= to_set(op.outputs)
+        return num_tape_gradients > 1, unrecorded_ops
+
     def _get_signature_epoch(self, mode):
         signature_epoch = [0]
         mode_ops = get_op_from_mode(self.ops, mode)
@@ -110,9 +342,12 @@ class Network:
         """
         ops = self.op_schedule[mode].get_current_value(epoch)
         epoch_losses = set()
+        constants = {}
         for op in ops:
             if isinstance(op, Loss):
                 epoch_losses |= to_set(op.outputs)
+            if isinstance(op, _HoistedOp):
+                op.refresh(constants)
         self.epoch_losses = to_list(epoch_losses)
         return ops
 
@@ -131,25 +366,69 @@ class Network:
         prediction = {}
         batch = ChainMap(prediction, batch)
         mode = state["mode"]
+        # ops that were not analyzed in prepare keep the conservative persistent tape
+        persistent, unrecorded_ops = self.tape_plan.get(self._get_ops_key(ops), (True, []))
         # use gradient tape for train, otherwise use a dummy tape
-        with tf.GradientTape(persistent=True) if mode == "train" else NonContext() as tape:
+        with tf.GradientTape(persistent=persistent) if mode == "train" else NonContext() as tape:
             state['tape'] = tape
-            self._forward(batch, state, ops)
+            self._forward(batch, state, ops, unrecorded_ops)
         del state['tape']
         del tape
         return prediction
 
     @staticmethod
-    def _forward(batch, state, ops):
+    def _forward(batch, state, ops, unrecorded_ops=()):
         data = None
         for op in ops:
             data = get_inputs_by_op(op, batch, data)
-            data = op.forward(data, state)
+            with state['tape'].stop_recording() if op in unrecorded_ops else NonContext():
+                data = op.forward(data, state)
             if op.outputs:
                 write_outputs_by_key(batch, data, op.outputs)
 
 
-def build(model_def, model_name, optimizer, loss_name, custom_objects=None):
+class _HoistedOp(TensorOp):
+    """Serve the output of a batch-independent op from non-trainable variables.
+
+    Args:
+        op (TensorOp): The hoisted op.
+        value: Output of the op used to create the cache.
+        mode (str): Mode the op runs in.
+    """
+    def __init__(self, op, value, mode):
+        super().__init__(inputs=None, outputs=op.outputs, mode=op.mode)
+        self.op = op
+        self.run_mode = mode
+        self.structure = tf.nest.map_structure(lambda _: 0, value)
+        with fe.distribute_strategy.scope() if fe.distribute_strategy else NonContext():
+            self.cache = [tf.Variable(leaf, trainable=False) for leaf in tf.nest.flatten(value)]
+
+    def refresh(self, constants):
+        """Evaluate the op again and update the cache.
+
+        Args:
+            constants (dict): Outputs of the previously refreshed ops, updated with the outputs of this op.
+        """
+        with tf.GradientTape() as tape:
+            value = self.op.forward(get_inputs_by_op(self.op, constants), {
+                "mode": self.run_mode, "tape": tape, "warmup": False
+            })
+        for variable, leaf in zip(self.cache, tf.nest.flatten(value)):
+            variable.assign(leaf)
+        write_outputs_by_key(constants, value, self.outputs)
+
+    def forward(self, data, state):
+        return tf.nest.pack_sequence_as(self.structure, [variable.read_value() for variable in self.cache])
+
+
+def build(model_def,
+          model_name,
+          optimizer,
+          loss_name,
+          custom_objects=None,
+          precision=None,
+          ema_decay=None,
+          jit_compile=None):
     """build keras model instance in FastEstimator
 
     Args:
@@ -158,28 +437,44 @@ def build(model_def, model_name, optimizer, loss_name, custom_objects=None):
         optimizer (str, optimizer, list, tuple): optimizer(s)
         loss_name (str, list, tuple): loss name(s)
         custom_objects (dict): dictionary that maps custom
+        precision (str, Policy, optional): keras mixed precision policy used to create the model(s), for example
+            "mixed_bfloat16" on cpu or "mixed_float16" on gpu. Weights are kept in float32, and a policy computing in
+            float16 additionally applies dynamic loss scaling in `UpdateOp`. None keeps the global policy.
+        ema_decay (float, optional): decay of an exponential moving average of the trainable weights, updated after
+            every optimizer step. The averaged weights are used for evaluation and by the traces at the end of each
+            epoch (for example `ModelSaver`). None disables the average.
+        jit_compile (bool, optional): whether to compile the steps using the model(s) with XLA, overriding the
+            `jit_compile` option of the Estimator. None follows the Estimator.
 
     Returns:
         model: model(s) compiled by FastEstimator
     """
-    with fe.distribute_strategy.scope() if fe.distribute_strategy else NonContext():
-        if isinstance(model_def, str):
-            model = tf.keras.models.load_model(model_def, custom_objects=custom_objects)
-        else:
-            model = model_def()
-        model = to_list(model)
-        model_name = to_list(model_name)
-        optimizer = to_list(optimizer)
-        loss_name = to_list(loss_name)
-        assert len(model) == len(model_name) == len(optimizer) == len(loss_name)
-        for idx, (m, m_n, o, l_n) in enumerate(zip(model, model_name, optimizer, loss_name)):
-            model[idx] = _fe_compile(m, m_n, o, l_n)
+    policy = mixed_precision.Policy(precision) if isinstance(precision, str) else precision
+    previous_policy = mixed_precision.global_policy()
+    if policy is not None:
+        mixed_precision.set_policy(policy)
+    try:
+        with fe.distribute_strategy.scope() if fe.distribute_strategy else NonContext():
+            if isinstance(model_def, str):
+                model = tf.keras.models.load_model(model_def, custom_objects=custom_objects)
+            else:
+                model = model_def()
+            model = to_list(model)
+            model_name = to_list(model_name)
+            optimizer = to_list(optimizer)
+            loss_name = to_list(loss_name)
+            assert len(model) == len(model_name) == len(optimizer) == len(loss_name)
+            loss_scale = policy is not None and policy.compute_dtype == "float16"
+            for idx, (m, m_n, o, l_n) in enumerate(zip(model, model_name, optimizer, loss_name)):
+                model[idx] = _fe_compile(m, m_n, o, l_n, loss_scale, ema_decay, jit_compile)
+    finally:
+        mixed_precision.set_policy(previous_policy)
     if len(model) == 1:
         model = model[0]
     return model
 
 
-def _fe_compile(model, model_name, optimizer, loss_name):
+def _fe_compile(model, model_name, optimizer, loss_name, loss_scale=False, ema_decay=None, jit_compile=None):
     if isinstance(optimizer, str):
         optimizer_fn = {
             'adadelta': tf.optimizers.Adadelta,
@@ -196,8 +491,62 @@ def _fe_compile(model, model_name, optimizer, loss_name):
             "must provide provide must provide tf.optimizer.Optimizer instance as optimizer"
     assert isinstance(model_name, str), "model_name must be string"
     assert isinstance(loss_name, str), "loss_name must be string"
+    if loss_scale and not isinstance(optimizer, mixed_precision.LossScaleOptimizer):
+        optimizer = mixed_precision.LossScaleOptimizer(optimizer, loss_scale="dynamic")
     model.model_name = model_name
     model.optimizer = optimizer
     model.loss_name = loss_name
+    model.ema = ExponentialMovingAverage(model, ema_decay) if ema_decay else None
+    model.jit_compile = jit_compile
     model.fe_compiled = True
     return model
+
+
+class ExponentialMovingAverage:
+    """Exponential moving average of the trainable weights of a model, maintained inside the training step.
+
+    The decay is reduced during the first steps (decay = min(decay, (1 + step) / (10 + step))) so that the average is
+    not dominated by the initial weights.
+
+    Args:
+        model (keras.model): Model compiled by fe.build.
+        decay (float): Decay of the average.
+    """
+    def __init__(self, model, decay):
+        assert 0 < decay < 1, "ema_decay must be between 0 and 1"
+        self.model = model
+        self.decay = decay
+        self.variables = []
+        self._swap_fn = None
+
+    def build(self):
+        """Create the average variables, called by `UpdateOp.build` once the model variables exist.
+        """
+        if not self.variables:
+            for variable in self.model.trainable_variables:
+                self.variables.append(
+                    tf.Variable(variable.read_value(),
+                                trainable=False,
+                                aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA))
+
+    def update(self):
+        """Move the averages towards the current weights, called by `UpdateOp` after each optimizer step.
+        """
+        step = tf.cast(get_base_optimizer(self.model.optimizer).iterations, tf.float32)
+        decay = tf.minimum(self.decay, (1.0 + step) / (10.0 + step))
+        for average, variable in zip(self.variables, self.model.trainable_variables):
+            average.assign_sub((1.0 - decay) * (average - variable))
+
+    def swap(self):
+        """Exchange the weights of the model with their averages, calling it twice restores the original weights.
+        """
+        if self._swap_fn is None:
+            self._swap_fn = tf.function(self._swap)
+        self._swap_fn()
+
+    def _swap(self):
+        for average, variable in zip(self.variables, self.model.trainable_variables):
+            value = variable.read_value()
+            variable.assign(average)
+            average.assign(value)
+
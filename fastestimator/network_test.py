@@ -0,0 +1,156 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+from unittest import TestCase
+
+import numpy as np
+import tensorflow as tf
+
+import fastestimator as fe
+from fastestimator.op import TensorOp
+from fastestimator.op.tensorop import MeanSquaredError, ModelOp, Scale
+from fastestimator.trace.metric import Accuracy
+
+
+def _build_model(model_name="model", **kwargs):
+    return fe.build(model_def=lambda: tf.keras.Sequential([tf.keras.layers.Dense(1, input_shape=(2, ))]),
+                    model_name=model_name,
+                    optimizer="sgd",
+                    loss_name="loss",
+                    **kwargs)
+
+
+def _get_state(mode="train", batch_size=4):
+    return {"mode": mode, "batch_size": batch_size, "local_batch_size": batch_size, "epoch": 0, "warmup": False}
+
+
+class _GradientNorm(TensorOp):
+    num_tape_gradients = 1
+
+    def __init__(self, model, inputs=None, outputs=None, mode=None):
+        super().__init__(inputs=inputs, outputs=outputs, mode=mode)
+        self.model = model
+
+    def forward(self, data, state):
+        return tf.linalg.global_norm(self._get_gradients(data, state['tape']))
+
+    def _get_gradients(self, loss, tape):
+        with tape.stop_recording():
+            return tape.gradient(tf.reduce_mean(loss), self.model.trainable_variables)
+
+
+class _Identity(TensorOp):
+    def forward(self, data, state):
+        return tf.identity(data)
+
+
+class TestNetwork(TestCase):
+    def setUp(self):
+        self.batch = {"x": tf.ones((4, 2)), "y": tf.zeros((4, 1))}
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------------ Tape -------------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_single_gradient_uses_non_persistent_tape(self):
+        model = _build_model()
+        network = fe.Network(ops=[
+            ModelOp(model=model, inputs="x", outputs="y_pred"),
+            MeanSquaredError(y_true="y", y_pred="y_pred", outputs="loss")
+        ])
+        network.prepare(mode_list=["train"])
+        ops = network.load_epoch(0, "train")
+        self.assertFalse(network.tape_plan[network._get_ops_key(ops)][0])
+        network.run_step(self.batch, ops, _get_state())
+
+    def test_declared_tape_gradients_use_persistent_tape(self):
+        model = _build_model()
+        network = fe.Network(ops=[
+            ModelOp(model=model, inputs="x", outputs="y_pred"),
+            MeanSquaredError(y_true="y", y_pred="y_pred", outputs="loss"),
+            _GradientNorm(model=model, inputs="loss", outputs="grad_norm")
+        ])
+        network.prepare(mode_list=["train"])
+        ops = network.load_epoch(0, "train")
+        self.assertTrue(network.tape_plan[network._get_ops_key(ops)][0])
+        prediction = network.run_step(self.batch, ops, _get_state())
+        self.assertTrue(np.isfinite(prediction["grad_norm"].numpy()))
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ---------------------------------------------- Hoisting ------------------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_variable_read_is_not_hoisted(self):
+        alpha = tf.Variable(0.0, trainable=False)
+        network = fe.Network(ops=[
+            ModelOp(model=_build_model(), inputs="x", outputs="y_pred"),
+            _Identity(inputs=lambda: alpha.read_value(), outputs="alpha"),
+            MeanSquaredError(y_true="y", y_pred="y_pred", outputs="loss")
+        ])
+        network.prepare(mode_list=["eval"])
+        ops = network.load_epoch(0, "eval")
+        self.assertEqual(network.run_step(self.batch, ops, _get_state("eval"))["alpha"].numpy(), 0.0)
+        # a trace updating the variable during the epoch
+        alpha.assign(0.5)
+        self.assertEqual(network.run_step(self.batch, ops, _get_state("eval"))["alpha"].numpy(), 0.5)
+
+    def test_declared_batch_independent_op_is_hoisted(self):
+        style = _Identity(inputs=lambda: tf.ones((2, 2)), outputs="style")
+        style.batch_independent = True
+        network = fe.Network(ops=[
+            ModelOp(model=_build_model(), inputs="x", outputs="y_pred"),
+            style,
+            MeanSquaredError(y_true="y", y_pred="y_pred", outputs="loss")
+        ])
+        network.prepare(mode_list=["eval"])
+        ops = network.load_epoch(0, "eval")
+        self.assertNotIn(style, ops)
+        np.testing.assert_array_equal(
+            network.run_step(self.batch, ops, _get_state("eval"))["style"].numpy(), np.ones((2, 2)))
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------- Unused Ops ------------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_ops_read_by_traces_are_kept(self):
+        scaled = Scale(scalar=2, inputs="y_pred", outputs="y_scaled")
+        unused = Scale(scalar=2, inputs="y_pred", outputs="y_unused")
+        network = fe.Network(ops=[
+            ModelOp(model=_build_model(), inputs="x", outputs="y_pred"),
+            scaled,
+            unused,
+            MeanSquaredError(y_true="y", y_pred="y_pred", outputs="loss")
+        ])
+        trace = Accuracy(true_key="y", pred_key="y_scaled")
+        network.prepare(mode_list=["eval"], required_keys=trace.inputs | trace.batch_inputs)
+        ops = network.load_epoch(0, "eval")
+        self.assertIn(scaled, ops)
+        self.assertNotIn(unused, ops)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ---------------------------------------- Exponential Moving Average ------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_ema_update_and_swap(self):
+        model = _build_model(ema_decay=0.5)
+        model.set_weights([np.ones((2, 1), dtype=np.float32), np.zeros(1, dtype=np.float32)])
+        model.ema.build()
+        model.set_weights([np.full((2, 1), 3.0, dtype=np.float32), np.ones(1, dtype=np.float32)])
+        # the decay of the first step is min(0.5, 1 / 10)
+        model.ema.update()
+        expected_averages = [np.full((2, 1), 2.8), np.full(1, 0.9)]
+        for average, expected in zip(model.ema.variables, expected_averages):
+            np.testing.assert_allclose(average.numpy(), expected, rtol=1e-6)
+        model.ema.swap()
+        for weight, expected in zip(model.get_weights(), expected_averages):
+            np.testing.assert_allclose(weight, expected, rtol=1e-6)
+        model.ema.swap()
+        np.testing.assert_array_equal(model.get_weights()[0], np.full((2, 1), 3.0))
+        np.testing.assert_array_equal(model.get_weights()[1], np.ones(1))
@@ -15,6 +15,14 @@
 
 
 class TensorOp:
+    # number of gradients that forward computes from the tape of the training step (state['tape']). The tape is only
+    # persistent when the ops of a step compute more than one gradient from it, so ops calling `tape.gradient` must
+    # count every call.
+    num_tape_gradients = 0
+    # ops whose inputs are a callable (or outputs of other such ops) and whose outputs neither depend on the batch nor
+    # on variables changing during an epoch may set it to True, so that `Network` computes them once per epoch
+    batch_independent = False
+
     def __init__(self, inputs=None, outputs=None, mode=None):
         self.inputs = inputs
         self.outputs = outputs
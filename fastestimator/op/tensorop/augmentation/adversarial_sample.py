@@ -44,6 +44,7 @@ class AdversarialSample(TensorOp):
         assert (loss or gradients) is not None and not (loss and gradients) is not None, \
             "AdversarialSample requires either a loss key or a gradient key, but not both"
         self.loss_mode = loss is not None
+        self.num_tape_gradients = 1 if self.loss_mode else 0
         super().__init__(inputs=[loss or gradients, inputs], outputs=outputs, mode=mode)
         self.epsilon = epsilon
         self.clip_low = clip_low
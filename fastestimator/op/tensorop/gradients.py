@@ -33,6 +33,7 @@ class Gradients(TensorOp):
         outputs = to_list(outputs) if outputs else []
         assert len(outputs) == len(inputs) + len(self.models)
         super().__init__(inputs=[loss] + inputs, outputs=outputs, mode=mode)
+        self.num_tape_gradients = 1
 
     def forward(self, data, state):
         loss, *elems = data
@@ -23,6 +23,9 @@ class ModelOp(TensorOp):
         inputs : String key of input training data. Defaults to None.
         outputs : String key of predictions. Defaults to None.
         mode : 'train' or 'eval'. Defaults to None.
+        trainable : If 'false' the model is frozen: it runs in inference mode, it is not updated unless an `UpdateOp`
+            is given explicitly, and it is not recorded on the gradient tape when no gradient can flow through it.
+            Defaults to True.
         track_input : If 'true' it tracks the gradients with respect to inputs. Defaults to False.
     """
     def __init__(self, model, inputs=None, outputs=None, mode=None, trainable=True, track_input=False):
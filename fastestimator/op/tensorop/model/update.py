@@ -13,21 +13,40 @@
 # limitations under the License.
 # ==============================================================================
 import tensorflow as tf
+from tensorflow.keras.mixed_precision import experimental as mixed_precision
 from tensorflow.python.framework import ops as tfops
 
 from fastestimator.op import TensorOp
+from fastestimator.util.util import get_base_optimizer
 
 
 class UpdateOp(TensorOp):
-    """This class performs updates to a model's weights based on the model's loss value
+    """This class performs updates to a model's weights based on the model's loss value. When the model optimizer is
+    a `LossScaleOptimizer` (models built with a float16 precision policy), the loss is scaled dynamically before
+    computing the gradients and steps with non-finite gradients are skipped. Models built with `ema_decay` update
+    their weight averages after each optimizer step.
 
     Args:
         model (keras.model): keras model compiled by fe.build
+        gradients (str, list, optional): keys of precomputed gradients to apply instead of the model loss. Defaults to
+            None.
+        mode (str, optional): mode to run the op. Defaults to "train".
+        accumulation_steps (int, optional): number of micro-batches whose gradients are summed before the optimizer
+            applies them. The loss is normalized by the effective batch size (batch size * accumulation_steps) so the
+            update matches a single large batch. Precomputed gradients are summed as given. With a
+            `LossScaleOptimizer`, a micro-batch with non-finite gradients is left out of the sum and reduces the loss
+            scale, the other micro-batches of the window are still applied. Defaults to 1.
     """
-    def __init__(self, model, gradients=None, mode="train"):
+    def __init__(self, model, gradients=None, mode="train", accumulation_steps=1):
+        assert isinstance(accumulation_steps, int) and accumulation_steps > 0, \
+            "accumulation_steps must be a positive integer"
         self.gradients = gradients
         super().__init__(inputs=self.gradients or model.loss_name, outputs=None, mode=mode)
+        self.num_tape_gradients = 0 if self.gradients else 1
         self.model = model
+        self.accumulation_steps = accumulation_steps
+        self.accumulators = []
+        self.accumulated_steps = None
 
     def forward(self, data, state):
         tape = state['tape']
@@ -35,18 +54,93 @@ class UpdateOp(TensorOp):
         if not self.gradients:
             if state["warmup"]:
                 self._validate_loss(element_wise_loss=data, local_batch_size=state["local_batch_size"])
-            loss = tf.reduce_sum(data) / state["batch_size"]
+            loss = tf.reduce_sum(tf.cast(data, tf.float32)) / (state["batch_size"] * self.accumulation_steps)
+            loss_scaled = isinstance(self.model.optimizer, mixed_precision.LossScaleOptimizer)
+            if loss_scaled:
+                loss = self.model.optimizer.get_scaled_loss(loss)
             with tape.stop_recording():
                 gradients = tape.gradient(loss, self.model.trainable_variables)
+                if loss_scaled:
+                    gradients = self.model.optimizer.get_unscaled_gradients(gradients)
 
         if state["warmup"]:
-            with tfops.init_scope():  # pylint: disable=not-context-manager
-                _ = self.model.optimizer.iterations
-                self.model.optimizer._create_hypers()  # pylint: disable=protected-access
-                self.model.optimizer._create_slots(self.model.trainable_variables)  # pylint: disable=protected-access
+            self.build()
         else:
             with tape.stop_recording():
-                self.model.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+                if self.accumulation_steps > 1:
+                    self._accumulate(gradients)
+                else:
+                    self.model.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+                    if self.model.ema:
+                        self.model.ema.update()
+
+    def build(self):
+        """Create the optimizer slots, the gradient accumulators and the weight averages of the model.
+
+        Only the model variables are needed, so the Estimator calls it before training without running a step. Calling
+        it again has no effect.
+        """
+        optimizer = get_base_optimizer(self.model.optimizer)
+        with tfops.init_scope():  # pylint: disable=not-context-manager
+            _ = optimizer.iterations
+            optimizer._create_hypers()  # pylint: disable=protected-access
+            optimizer._create_slots(self.model.trainable_variables)  # pylint: disable=protected-access
+            if self.accumulation_steps > 1 and not self.accumulators:
+                self._create_accumulators()
+            if self.model.ema:
+                self.model.ema.build()
+
+    def _create_accumulators(self):
+        # on-read variables keep a local copy per replica, the optimizer all-reduces them when they are applied
+        for variable in self.model.trainable_variables:
+            self.accumulators.append(
+                tf.Variable(tf.zeros_like(variable),
+                            trainable=False,
+                            synchronization=tf.VariableSynchronization.ON_READ,
+                            aggregation=tf.VariableAggregation.SUM))
+        self.accumulated_steps = tf.Variable(0, trainable=False, dtype=tf.int64)
+
+    def _accumulate(self, gradients):
+        replica_context = tf.distribute.get_replica_context()
+        finite = tf.constant(True)
+        if isinstance(self.model.optimizer, mixed_precision.LossScaleOptimizer):
+            # the loss scale optimizer only sees the summed gradients, so an overflowing micro-batch would make it skip
+            # the whole window. Every replica leaves out the micro-batch when any of them overflows.
+            finite = tf.reduce_all([tf.reduce_all(tf.math.is_finite(g)) for g in gradients if g is not None])
+            num_finite = replica_context.all_reduce(tf.distribute.ReduceOp.SUM, tf.cast(finite, tf.float32))
+            finite = tf.equal(num_finite, replica_context.num_replicas_in_sync)
+        for accumulator, gradient in zip(self.accumulators, gradients):
+            if gradient is not None:
+                accumulator.assign_add(tf.where(finite, gradient, tf.zeros_like(gradient)))
+        # decide in cross-replica context so that the optimizer can synchronize the replicas inside the condition
+        replica_context.merge_call(self._maybe_apply_accumulated, args=(gradients, finite))
+
+    def _maybe_apply_accumulated(self, distribution, gradients, finite):
+        def _apply():
+            distribution.extended.call_for_each_replica(self._apply_accumulated)
+            return tf.constant(True)
+
+        def _reduce_loss_scale():
+            # the loss scale shrinks when it is updated with the non-finite gradients of the micro-batch
+            update_op, _ = self.model.optimizer.loss_scale.update(gradients)
+            with tf.control_dependencies([update_op]):
+                return tf.constant(True)
+
+        if isinstance(self.model.optimizer, mixed_precision.LossScaleOptimizer):
+            finite = distribution.experimental_local_results(finite)[0]
+            tf.cond(finite, lambda: tf.constant(False), _reduce_loss_scale)
+        # a left out micro-batch still counts, so that the windows of the replicas and of the data stay aligned
+        step = self.accumulated_steps.assign_add(1)
+        return tf.cond(tf.equal(step % self.accumulation_steps, 0), _apply, lambda: tf.constant(False))
+
+    def _apply_accumulated(self):
+        gradients = [tf.identity(accumulator) for accumulator in self.accumulators]
+        apply_op = self.model.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+        with tf.control_dependencies([apply_op]):
+            for accumulator in self.accumulators:
+                accumulator.assign(tf.zeros_like(accumulator))
+            if self.model.ema:
+                self.model.ema.update()
 
     @staticmethod
     def _validate_loss(element_wise_loss, local_batch_size):
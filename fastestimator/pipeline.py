@@ -14,7 +14,6 @@
 # ==============================================================================
 """Pipeline class."""
 import json
-import multiprocessing as mp
 import os
 import time
 
@@ -24,17 +23,20 @@ import tensorflow as tf
 import fastestimator as fe
 from fastestimator.op import get_inputs_by_key, get_inputs_by_op, get_op_from_mode, verify_ops, write_outputs_by_key
 from fastestimator.op.tensorop import TensorFilter
-from fastestimator.record_writer import RecordWriter
+from fastestimator.record_writer import BLOCK_SIZE_KEY, RecordWriter
 from fastestimator.schedule import Scheduler
+from fastestimator.util.cpu_budget import get_cpu_budget
 from fastestimator.util.tfrecord import get_features
-from fastestimator.util.util import convert_tf_dtype, flatten_list, get_num_devices, per_replica_to_global
+from fastestimator.util.util import convert_tf_dtype, flatten_list, get_num_devices, get_num_workers, \
+    get_worker_index, per_replica_to_global, to_set
 
 
 class Pipeline:
     """Class representing the data pipeline required for fastestimator
 
     Args:
-        data: The input for the pipeline. This can be either a dictionary, a tfrecord path or a RecordWriter.
+        data: The input for the pipeline. This can be either a dictionary, a record path or a RecordWriter. The record
+            format (TFRecord or memmap) is detected from the summary file in the record path.
         batch_size: Integer representing the batch size per device for training the model.
         ops: List of fastestimator operations that needs to be applied on the data in the pipeline.
         read_feature: List of features that should be used in training. If None all the features available are used.
@@ -63,10 +65,12 @@ class Pipeline:
         self.padded_shape = None
         self.global_batch_multiplier = 1
         self.eval_shuffle = False
+        self.required_keys = None
         self.batch = True
-        self.num_core = mp.cpu_count()
+        self.num_core = get_cpu_budget().data_threads
         self._verify_input()
         self.all_output_keys = None
+        self._bulk_transform_fn = {}
         self._reset()
         self._is_prepared = False
 
@@ -101,6 +105,9 @@ class Pipeline:
         self.summary_file = {}
         self.record_feature_shape = {"train": [], "eval": []}
         self.compression = {"train": [], "eval": []}
+        self.examples_per_record = {"train": [], "eval": []}
+        self.record_format = {"train": [], "eval": []}
+        self.memmap_columns = {"train": [], "eval": []}
         self.file_names = {"train": [], "eval": []}
         self.global_batch_multiplier = 1
         self.batch = True
@@ -191,8 +198,8 @@ class Pipeline:
         for json_file in self.summary_file[mode]:
             with open(json_file, 'r') as output:
                 summary = json.load(output)
-            file_names = [os.path.join(data_path, f) for f in summary["file_names"]]
-            self.file_names[mode].append(file_names)
+            record_format = summary.get("format", "tfrecord")
+            self.record_format[mode].append(record_format)
             num_examples = np.sum(summary["num_examples"])
             example_size_mb = summary["example_size_mb"]
             self.num_examples[mode].append(num_examples)
@@ -203,27 +210,83 @@ class Pipeline:
             else:
                 compression = None
             self.compression[mode].append(compression)
-            self.all_features[mode].append(get_features(file_names[0], compression=compression))
-            self.shuffle_buffer[mode].append(int(min(num_examples, self.max_shuffle_buffer_mb // example_size_mb)))
+            self.examples_per_record[mode].append(summary.get("examples_per_record", 1))
+            if record_format == "memmap":
+                self.file_names[mode].append([])
+                self.memmap_columns[mode].append(self._open_memmap_columns(data_path, summary))
+                self.all_features[mode].append(dict(summary["feature_dtype"]))
+                # memmap records are shuffled by index when read, no shuffle buffer is needed
+                self.shuffle_buffer[mode].append(0)
+            else:
+                file_names = [os.path.join(data_path, f) for f in summary["file_names"]]
+                self.file_names[mode].append(file_names)
+                self.memmap_columns[mode].append(None)
+                all_features = get_features(file_names[0], compression=compression)
+                all_features.pop(BLOCK_SIZE_KEY, None)
+                self.all_features[mode].append(all_features)
+                self.shuffle_buffer[mode].append(int(min(num_examples,
+                                                         self.max_shuffle_buffer_mb // example_size_mb)))
             print("FastEstimator: Found %d examples for %s in %s" % (int(num_examples), mode, json_file))
 
+    @staticmethod
+    def _open_memmap_columns(data_path, summary):
+        shards = []
+        for shard, num_examples in zip(summary["file_names"], summary["num_examples"]):
+            columns = {}
+            for key, file_name in shard["features"].items():
+                dtype = summary["feature_dtype"][key]
+                shape = summary["feature_shape"][key]
+                file_path = os.path.join(data_path, file_name)
+                if shape == [-1]:
+                    values = np.memmap(file_path, dtype=dtype, mode="r")
+                    if key in shard["offsets"]:
+                        offsets = np.load(os.path.join(data_path, shard["offsets"][key]), mmap_mode="r")
+                    else:
+                        # all examples of this shard happen to be scalars
+                        offsets = np.arange(num_examples + 1)
+                else:
+                    values = np.memmap(file_path, dtype=dtype, mode="r", shape=tuple([num_examples] + list(shape)))
+                    offsets = None
+                columns[key] = (values, offsets)
+            shards.append(columns)
+        shard_start = np.cumsum([0] + summary["num_examples"])[:-1]
+        return {"shard_start": shard_start, "columns": shards}
+
     def _get_feature_name(self, mode):
         if len(self.all_features[mode]) > 1 and self.read_feature:
             assert isinstance(self.read_feature, tuple), "read feature must be a tuple for unpaired feature set"
             assert len(self.read_feature) == len(
                 self.all_features[mode]), "the tuple should be consistent between read_feature and data"
         for idx, feature in enumerate(self.all_features[mode]):
-            if self.read_feature is None:
+            # required_keys is None when a trace does not declare the batch keys it reads, then every feature is read
+            if self.read_feature is None and self.required_keys is not None and not isinstance(self.data, dict):
+                consumed_keys = self.required_keys | self._get_op_input_keys()
+                feature_name = [key for key in feature.keys() if key in consumed_keys]
+                skipped = sorted(set(feature.keys()) - set(feature_name))
+                if skipped:
+                    print("FastEstimator-Pipeline: {} features not read by any op or trace are not decoded: {}".format(
+                        mode, ", ".join(skipped)))
+                self.feature_name[mode].append(feature_name)
+            elif self.read_feature is None:
                 self.feature_name[mode].append(list(feature.keys()))
             elif isinstance(self.read_feature[idx], dict):
                 self.feature_name[mode].append(self.read_feature[idx][mode])
             else:
                 self.feature_name[mode].append(self.read_feature[idx])
 
+    def _get_op_input_keys(self):
+        keys = set()
+        for op in self.ops:
+            for epoch_op in op.epoch_dict.values() if isinstance(op, Scheduler) else [op]:
+                if epoch_op and epoch_op.inputs and not hasattr(epoch_op.inputs, "__call__"):
+                    keys |= to_set(epoch_op.inputs)
+        return keys
+
     def _extract_dataset(self, mode):
         ds_tuple = ()
         # Data Reading
         for idx in range(len(self.all_features[mode])):
+            sharded = False
             if isinstance(self.data, dict):
                 if isinstance(self.data[mode], dict):
                     ds_temp = tf.data.Dataset.from_tensor_slices(self.all_features[mode][idx])
@@ -231,19 +294,36 @@ class Pipeline:
                     ds_temp = tf.data.Dataset.from_generator(self.data[mode],
                                                              output_types=self.feature_dtype[mode][idx],
                                                              output_shapes=self.generator_tensor_shape[mode][idx])
+            elif self.record_format[mode][idx] == "memmap":
+                ds_temp = self._extract_memmap_dataset(mode, idx)
+                sharded = True
             else:
                 if mode == "train":
+                    num_files = len(self.file_names[mode][idx])
                     ds_temp = tf.data.Dataset.from_tensor_slices(self.file_names[mode][idx])
-                    ds_temp = ds_temp.shuffle(len(self.file_names[mode][idx]))
+                    if num_files >= get_num_workers():
+                        ds_temp = self._shard(ds_temp)
+                        sharded = True
+                        ds_temp = ds_temp.shuffle(num_files)
+                        cycle_length = self.num_core
+                    else:
+                        # the examples are sharded after reading, which needs the same order of examples on every
+                        # worker: a seed shared by the workers and a cycle length independent of their cpus
+                        ds_temp = ds_temp.shuffle(num_files, seed=0)
+                        cycle_length = num_files
                     ds_temp = ds_temp.interleave(
                         lambda ds_lam: tf.data.TFRecordDataset(ds_lam, compression_type=self.compression[mode][idx]),
-                        cycle_length=self.num_core,
+                        cycle_length=cycle_length,
                         block_length=2)
                 else:
                     ds_temp = tf.data.TFRecordDataset(self.file_names[mode][idx],
                                                       compression_type=self.compression[mode][idx])
                 ds_temp = ds_temp.map(lambda ds_lam: self._decode_records(ds_lam, mode, idx),
                                       num_parallel_calls=self.num_core)
+                if self.examples_per_record[mode][idx] > 1:
+                    ds_temp = ds_temp.unbatch()
+            if not sharded:
+                ds_temp = self._shard(ds_temp)
             if (mode == "train" or self.eval_shuffle) and self.shuffle_buffer[mode][idx]:
                 ds_temp = ds_temp.shuffle(self.shuffle_buffer[mode][idx])
             if self.num_examples[mode][idx]:
@@ -257,6 +337,23 @@ class Pipeline:
             dataset = ds_tuple[0]
         self.extracted_dataset[mode] = dataset
 
+    @staticmethod
+    def _get_no_auto_shard_options():
+        # the data is already sharded per worker
+        options = tf.data.Options()
+        if hasattr(tf.data.experimental, "AutoShardPolicy"):
+            options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+        else:
+            options.experimental_distribute.auto_shard = False
+        return options
+
+    @staticmethod
+    def _shard(dataset):
+        # every worker of a multi-worker strategy reads its own part of the data
+        if get_num_workers() > 1:
+            dataset = dataset.shard(get_num_workers(), get_worker_index())
+        return dataset
+
     def _transform_dataset(self, mode):
         all_output_keys = []
         signature_epoch, mode_ops = self._get_signature_epoch(mode)
@@ -264,33 +361,10 @@ class Pipeline:
         state = {"mode": mode}
         dataset_map = {}
         for epoch in signature_epoch:
-            epoch_ops_all = []
-            forward_ops_epoch = []
-            filter_ops_epoch = []
-            forward_ops_between_filter = []
             # get batch size for the epoch
             global_batch_size = self.get_global_batch_size(epoch)
-            # generate ops for specific mode and epoch
-            for op in mode_ops:
-                if isinstance(op, Scheduler):
-                    scheduled_op = op.get_current_value(epoch)
-                    if scheduled_op:
-                        epoch_ops_all.append(scheduled_op)
-                else:
-                    epoch_ops_all.append(op)
-            # check the ops
-            epoch_ops_without_filter = [op for op in epoch_ops_all if not isinstance(op, TensorFilter)]
-            verify_ops(epoch_ops_without_filter, "Pipeline")
-            # arrange operation according to filter location
-            for op in epoch_ops_all:
-                all_output_keys.append(op.outputs)
-                if not isinstance(op, TensorFilter):
-                    forward_ops_between_filter.append(op)
-                else:
-                    forward_ops_epoch.append(forward_ops_between_filter)
-                    filter_ops_epoch.append(op)
-                    forward_ops_between_filter = []
-            forward_ops_epoch.append(forward_ops_between_filter)
+            epoch_ops_all, forward_ops_epoch, filter_ops_epoch = self._get_epoch_ops(mode_ops, epoch)
+            all_output_keys.extend([op.outputs for op in epoch_ops_all])
             # execute the operations
             dataset = self._execute_ops(extracted_ds, forward_ops_epoch, filter_ops_epoch, state)
             if self.expand_dims:
@@ -303,11 +377,41 @@ class Pipeline:
                     dataset = dataset.batch(global_batch_size)
             dataset = dataset.prefetch(buffer_size=1)
             if fe.distribute_strategy:
+                if get_num_workers() > 1:
+                    dataset = dataset.with_options(self._get_no_auto_shard_options())
                 dataset = fe.distribute_strategy.experimental_distribute_dataset(dataset)
             dataset_map[epoch] = iter(dataset)
         self.dataset_schedule[mode] = Scheduler(epoch_dict=dataset_map)
         self.all_output_keys = self.all_output_keys | set(flatten_list(all_output_keys))
 
+    @staticmethod
+    def _get_epoch_ops(mode_ops, epoch):
+        epoch_ops_all = []
+        forward_ops_epoch = []
+        filter_ops_epoch = []
+        forward_ops_between_filter = []
+        # generate ops for specific mode and epoch
+        for op in mode_ops:
+            if isinstance(op, Scheduler):
+                scheduled_op = op.get_current_value(epoch)
+                if scheduled_op:
+                    epoch_ops_all.append(scheduled_op)
+            else:
+                epoch_ops_all.append(op)
+        # check the ops
+        epoch_ops_without_filter = [op for op in epoch_ops_all if not isinstance(op, TensorFilter)]
+        verify_ops(epoch_ops_without_filter, "Pipeline")
+        # arrange operation according to filter location
+        for op in epoch_ops_all:
+            if not isinstance(op, TensorFilter):
+                forward_ops_between_filter.append(op)
+            else:
+                forward_ops_epoch.append(forward_ops_between_filter)
+                filter_ops_epoch.append(op)
+                forward_ops_between_filter = []
+        forward_ops_epoch.append(forward_ops_between_filter)
+        return epoch_ops_all, forward_ops_epoch, filter_ops_epoch
+
     def _get_padded_shape(self, dataset):
         padded_shape = {}
         for key in dataset:
@@ -356,12 +460,23 @@ class Pipeline:
 
     def _decode_records(self, dataset, mode, idx):
         decoded_data = {}
-        all_data = tf.io.parse_single_example(dataset, features=self.all_features[mode][idx])
+        # only parse the features that are read, the others are skipped without being copied
+        features = {key: self.all_features[mode][idx][key] for key in self.feature_name[mode][idx]}
+        block_size = None
+        if self.examples_per_record[mode][idx] > 1:
+            features[BLOCK_SIZE_KEY] = tf.io.FixedLenFeature([], tf.int64)
+        all_data = tf.io.parse_single_example(dataset, features=features)
+        if self.examples_per_record[mode][idx] > 1:
+            block_size = tf.cast(all_data[BLOCK_SIZE_KEY], tf.int32)
         for feature in self.feature_name[mode][idx]:
             data = all_data[feature]
             if "str" in str(data.dtype) and "str" not in self.feature_dtype[mode][idx][feature]:
                 data = tf.io.decode_raw(data, convert_tf_dtype(self.feature_dtype[mode][idx][feature]))
-                data = tf.reshape(data, self.record_feature_shape[mode][idx][feature])
+                shape = list(self.record_feature_shape[mode][idx][feature])
+                if block_size is not None:
+                    # a block holds all examples of the record stacked along a new leading dimension
+                    shape = [block_size] + shape
+                data = tf.reshape(data, shape)
             if "int" in str(data.dtype):
                 data = tf.cast(data, tf.int32)
             elif "str" not in self.feature_dtype[mode][idx][feature]:
@@ -369,6 +484,65 @@ class Pipeline:
             decoded_data[feature] = data
         return decoded_data
 
+    def _extract_memmap_dataset(self, mode, idx):
+        num_examples = self.num_examples[mode][idx]
+        # the indices are sharded before they are shuffled, so the workers read disjoint examples
+        dataset = self._shard(tf.data.Dataset.range(num_examples))
+        if mode == "train" or self.eval_shuffle:
+            dataset = dataset.shuffle(num_examples)
+        return self._read_memmap_indices(dataset, mode, idx)
+
+    def _read_memmap_indices(self, dataset, mode, idx, read_size=64):
+        feature_shape = self.record_feature_shape[mode][idx]
+        if any(feature_shape[feature] == [-1] for feature in self.feature_name[mode][idx]):
+            # variable length features cannot be stacked, so they are read one example at a time
+            read_size = 1
+        dataset = dataset.batch(read_size)
+        dataset = dataset.map(lambda index: self._decode_memmap(index, mode, idx), num_parallel_calls=self.num_core)
+        return dataset.unbatch()
+
+    def _read_ordered_records(self, mode, idx=0):
+        """Decoded examples of a record feature set in the order they were written, without shuffle, shard or repeat.
+        """
+        if self.record_format[mode][idx] == "memmap":
+            return self._read_memmap_indices(tf.data.Dataset.range(self.num_examples[mode][idx]), mode, idx)
+        dataset = tf.data.TFRecordDataset(self.file_names[mode][idx], compression_type=self.compression[mode][idx])
+        dataset = dataset.map(lambda ds_lam: self._decode_records(ds_lam, mode, idx), num_parallel_calls=self.num_core)
+        if self.examples_per_record[mode][idx] > 1:
+            dataset = dataset.unbatch()
+        return dataset
+
+    def _decode_memmap(self, index, mode, idx):
+        feature_name = self.feature_name[mode][idx]
+        dtypes = [
+            tf.int32 if "int" in self.feature_dtype[mode][idx][feature] else tf.float32 for feature in feature_name
+        ]
+        all_data = tf.numpy_function(lambda index_np: self._read_memmap(index_np, mode, idx), [index], dtypes)
+        decoded_data = {}
+        for feature, data in zip(feature_name, all_data):
+            shape = self.record_feature_shape[mode][idx][feature]
+            data.set_shape([None] + ([None] if shape == [-1] else list(shape)))
+            decoded_data[feature] = data
+        return decoded_data
+
+    def _read_memmap(self, index, mode, idx):
+        memmap = self.memmap_columns[mode][idx]
+        shard_idx = np.searchsorted(memmap["shard_start"], index, side="right") - 1
+        local_idx = index - memmap["shard_start"][shard_idx]
+        all_data = []
+        for feature in self.feature_name[mode][idx]:
+            dtype = np.int32 if "int" in self.feature_dtype[mode][idx][feature] else np.float32
+            if self.record_feature_shape[mode][idx][feature] == [-1]:
+                values, offsets = memmap["columns"][shard_idx[0]][feature]
+                data = values[offsets[local_idx[0]]:offsets[local_idx[0] + 1]][np.newaxis]
+            else:
+                data = np.empty([len(index)] + list(self.record_feature_shape[mode][idx][feature]), dtype=dtype)
+                for shard in np.unique(shard_idx):
+                    mask = shard_idx == shard
+                    data[mask] = memmap["columns"][shard][feature][0][local_idx[mask]]
+            all_data.append(data.astype(dtype, copy=False))
+        return all_data
+
     @staticmethod
     def _combine_dataset(*dataset):
         combined_dict = {}
@@ -448,6 +622,72 @@ class Pipeline:
         result = self.show_results(mode=mode, num_steps=num_example)
         return result
 
+    def bulk_transform(self, data, mode, current_epoch=0):
+        """Processes the pipeline ops on many examples at once with a single compiled function.
+
+        Unlike `transform`, no dataset is built: the ops of the given mode and epoch are applied to every example
+        through one `tf.map_fn` inside a `tf.function`, which is traced once and reused by later calls with the same
+        input signature. Examples rejected by a `TensorFilter` are dropped from the results, the ops after the filter
+        are skipped on them unless one of their outputs has a dynamic shape.
+
+        Args:
+            data: A dictionary of features, each being a list or numpy array with the same number of examples.
+            mode: can be either "train" or "eval".
+            current_epoch: to specify the current epoch in the training. This is useful if you are using a schedule to
+                change the pipeline during training.
+
+        Returns:
+            A dictionary of stacked numpy arrays, one entry per feature after the pipeline ops.
+        """
+        self._verify_dict(dictionary=data)
+        epoch_ops_all, forward_ops_epoch, filter_ops_epoch = self._get_epoch_ops(get_op_from_mode(self.ops, mode),
+                                                                                  current_epoch)
+        transform_key = (mode, tuple(id(op) for op in epoch_ops_all))
+        if transform_key not in self._bulk_transform_fn:
+            self._bulk_transform_fn[transform_key] = self._build_bulk_transform_fn(
+                forward_ops_epoch, filter_ops_epoch, {"mode": mode})
+        result = self._bulk_transform_fn[transform_key]({key: np.asarray(value) for key, value in data.items()})
+        return {key: value.numpy() for key, value in result.items()}
+
+    def _build_bulk_transform_fn(self, forward_ops_epoch, filter_ops_epoch, state):
+        def _transform_example(feature):
+            keep = tf.constant(True)
+            feature = self._preprocess_fn(feature, forward_ops_epoch[0], state)
+            for filter_op, forward_ops in zip(filter_ops_epoch, forward_ops_epoch[1:]):
+                keep = tf.logical_and(keep, self._filter_fn(feature, filter_op, state))
+                feature = self._preprocess_if_kept(feature, forward_ops, state, keep)
+            return feature, keep
+
+        @tf.function(experimental_relax_shapes=True)
+        def _transform_batch(data):
+            example_spec = {key: tf.TensorSpec(value.shape[1:], value.dtype) for key, value in data.items()}
+            output_spec = tf.function(_transform_example).get_concrete_function(example_spec).structured_outputs
+            output_dtype = tf.nest.map_structure(lambda x: x.dtype, output_spec)
+            feature, keep = tf.map_fn(_transform_example, data, dtype=output_dtype,
+                                      parallel_iterations=self.num_core)
+            result = {}
+            for key, value in feature.items():
+                value = tf.boolean_mask(value, keep)
+                if self.expand_dims:
+                    value = tf.reshape(value, tf.concat([[-1], tf.shape(value)[2:]], axis=0))
+                result[key] = value
+            return result
+
+        return _transform_batch
+
+    def _preprocess_if_kept(self, feature, forward_ops, state, keep):
+        # like the dataset filter, the ops after a filter are skipped on the rejected examples. The stacked outputs need
+        # a placeholder of the same shape for them, so the ops run on every example when an output shape is dynamic.
+        feature_spec = {key: tf.TensorSpec(value.shape, value.dtype) for key, value in feature.items()}
+        output_spec = tf.function(lambda x: self._preprocess_fn(dict(x), forward_ops, state)).get_concrete_function(
+            feature_spec).structured_outputs
+        if not all(spec.shape.is_fully_defined() for spec in output_spec.values()):
+            return self._preprocess_fn(feature, forward_ops, state)
+        return tf.cond(keep,
+                       lambda: self._preprocess_fn(dict(feature), forward_ops, state),
+                       lambda: {key: tf.zeros(spec.shape, spec.dtype)
+                                for key, spec in output_spec.items()})
+
     def _verify_dict(self, dictionary):
         feature_name = dictionary.keys()
         num_example_list = []
@@ -0,0 +1,89 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+import tensorflow as tf
+
+from fastestimator.op import TensorOp
+from fastestimator.op.tensorop.filter import TensorFilter
+from fastestimator.pipeline import Pipeline
+from fastestimator.record_writer import RecordWriter
+
+
+def _read_worker_shard(record_dir, num_workers, worker_index, num_examples):
+    with mock.patch("fastestimator.pipeline.get_num_workers", return_value=num_workers), \
+            mock.patch("fastestimator.pipeline.get_worker_index", return_value=worker_index):
+        pipeline = Pipeline(data=record_dir, batch_size=1)
+        pipeline.prepare()
+        dataset = pipeline.extracted_dataset["train"].take(num_examples)
+        return [int(example["y"]) for example in dataset]
+
+
+class _KeepPositive(TensorFilter):
+    def forward(self, data, state):
+        return data > 0
+
+
+class _CheckedLog(TensorOp):
+    """Take the logarithm of positive values, failing on any other value."""
+    def forward(self, data, state):
+        with tf.control_dependencies([tf.debugging.assert_positive(data)]):
+            return tf.math.log(data)
+
+
+class TestPipeline(TestCase):
+    # -------------------------------------------------------------------------------------------------------- #
+    # ---------------------------------------------- Sharding ------------------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    def _assert_shards_partition(self, record_dir, num_examples, num_workers):
+        shards = []
+        for worker_index in range(num_workers):
+            shard_size = len(range(worker_index, num_examples, num_workers))
+            shards.append(_read_worker_shard(record_dir, num_workers, worker_index, shard_size))
+        examples = [example for shard in shards for example in shard]
+        self.assertEqual(len(examples), len(set(examples)), "the shards of the workers overlap")
+        self.assertSetEqual(set(examples), set(range(num_examples)))
+
+    def test_memmap_shards_are_disjoint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            record_dir = os.path.join(tmp_dir, "records")
+            data = {"x": np.random.rand(30, 2).astype("float32"), "y": np.arange(30)}
+            RecordWriter(train_data=data, save_dir=record_dir, output_format="memmap").write()
+            self._assert_shards_partition(record_dir, num_examples=30, num_workers=3)
+
+    def test_tfrecord_shards_are_disjoint_with_few_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            record_dir = os.path.join(tmp_dir, "records")
+            data = {"x": np.random.rand(30, 2).astype("float32"), "y": np.arange(30)}
+            RecordWriter(train_data=data, save_dir=record_dir).write()
+            pipeline = Pipeline(data=record_dir, batch_size=1)
+            pipeline.prepare()
+            # more workers than files, so the examples are sharded instead of the files
+            num_workers = len(pipeline.file_names["train"][0]) + 1
+            self._assert_shards_partition(record_dir, num_examples=30, num_workers=num_workers)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # -------------------------------------------- Bulk Transform -------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_bulk_transform_skips_ops_after_filter(self):
+        data = {"x": np.array([1.0, -1.0, np.e], dtype="float32")}
+        pipeline = Pipeline(data={"train": data},
+                            batch_size=1,
+                            ops=[_KeepPositive(inputs="x"), _CheckedLog(inputs="x", outputs="x")])
+        result = pipeline.bulk_transform(data, "train")
+        np.testing.assert_allclose(result["x"], [0.0, 1.0], atol=1e-6)
@@ -23,10 +23,13 @@ import pandas as pd
 import tensorflow as tf
 
 from fastestimator.op import get_inputs_by_op, get_op_from_mode, verify_ops, write_outputs_by_key
+from fastestimator.util.cpu_budget import get_cpu_budget
+
+BLOCK_SIZE_KEY = "_fe_block_size"
 
 
 class RecordWriter:
-    """Write data into TFRecords.
+    """Write data into TFRecords or memory-mapped column files.
 
     This class can handle unpaired features. For example, in cycle-gan the hourse and zebra images are unpaired, which
     means during training you do not have one-to-one correspondance between hourse image and zebra image. When the
@@ -49,9 +52,19 @@ class RecordWriter:
         expand_dims (bool, optional): When set to `True`, the first dimension of each feature will be used as batch
             dimension. `RecordWriter` will split the batch into single examples and write one example at a time into
             TFRecord. Defaults to False.
-        max_record_size_mb (int, optional): Maximum size of single TFRecord file. Defaults to 300 MB.
+        max_record_size_mb (int, optional): Maximum size of single TFRecord file. Each writer starts a new file once the
+            bytes it has written (before compression) reach this size. Defaults to 300 MB.
         compression (str, optional): Compression type can be `"GZIP"`, `"ZLIB"`, or `""` (no compression). Defaults to
             None.
+        examples_per_record (int, optional): Number of examples stored in each record. When larger than 1, every
+            feature of consecutive examples is stored as one contiguous array so that `Pipeline` can decode the whole
+            block at once, which greatly reduces parsing overhead for small examples. All examples within a record
+            must then share the same feature shapes, and string features are not supported. Defaults to 1.
+        output_format (str, optional): `"tfrecord"` or `"memmap"`. With `"memmap"` every feature is written as a raw
+            column file that `Pipeline` reads through `np.memmap` without any protobuf decoding, 1 dimensional
+            features of variable length get an additional offsets file. It is best suited to small or medium datasets
+            with fixed shapes and does not support compression, string features or `examples_per_record`. Defaults to
+            "tfrecord".
     """
     def __init__(self,
                  train_data,
@@ -61,7 +74,9 @@ class RecordWriter:
                  write_feature=None,
                  expand_dims=False,
                  max_record_size_mb=300,
-                 compression=None):
+                 compression=None,
+                 examples_per_record=1,
+                 output_format="tfrecord"):
         self.train_data = train_data
         self.save_dir = save_dir
         self.validation_data = validation_data
@@ -70,19 +85,26 @@ class RecordWriter:
         self.expand_dims = expand_dims
         self.max_record_size_mb = max_record_size_mb
         self.compression = compression
-        self.num_process = os.cpu_count() or 1
+        self.examples_per_record = examples_per_record
+        self.output_format = output_format
+        self.num_process = get_cpu_budget().num_processes
         self.compression_option = tf.io.TFRecordOptions(compression_type=compression)
         self.global_file_idx = {"train": 0, "eval": 0}
         self.global_feature_key = {"train": [], "eval": []}
         self.feature_set_idx = 0
         self._verify_inputs()
 
-        self.num_example_csv, self.num_example_record, self.mb_per_csv_example, self.mb_per_record_example = \
-            {}, {}, {}, {}
+        self.num_example_csv, self.num_example_record, self.example_size_mb = {}, {}, {}
         self.mode_ops, self.feature_name, self.feature_dtype, self.feature_shape = {}, {}, {}, {}
         self.train_data_local, self.validation_data_local, self.write_feature_local, self.ops_local = {}, {}, {}, {}
 
     def _verify_inputs(self):
+        assert isinstance(self.examples_per_record, int) and self.examples_per_record > 0, \
+            "examples_per_record must be a positive integer"
+        assert self.output_format in ("tfrecord", "memmap"), "output_format must be either 'tfrecord' or 'memmap'"
+        if self.output_format == "memmap":
+            assert not self.compression, "memmap output_format does not support compression"
+            assert self.examples_per_record == 1, "memmap output_format does not support examples_per_record"
         if any(isinstance(inp, tuple) for inp in [self.train_data, self.validation_data, self.ops, self.write_feature]):
             num_unpaired_feature_sets = [len(self.train_data)]
             if self.validation_data:
@@ -137,7 +159,7 @@ class RecordWriter:
         return tf.train.Feature(float_list=tf.train.FloatList(value=[value]))
 
     def write(self, save_dir=None):
-        """Write TFRecods in parallel. Number of processes is set to number of CPU cores."""
+        """Write records in parallel. Number of processes is set to number of CPU cores."""
         if not save_dir:
             save_dir = self.save_dir
         self._prepare_savepath(save_dir)
@@ -147,8 +169,7 @@ class RecordWriter:
             self.feature_set_idx += 1
 
     def _create_record_local(self, train_data, validation_data, write_feature, ops):
-        self.num_example_csv, self.num_example_record, self.mb_per_csv_example, self.mb_per_record_example = \
-            {}, {}, {}, {}
+        self.num_example_csv, self.num_example_record, self.example_size_mb = {}, {}, {}
         self.mode_ops, self.feature_name, self.feature_dtype, self.feature_shape = {}, {}, {}, {}
         self.train_data_local, self.validation_data_local, self.write_feature_local, self.ops_local = \
             train_data, validation_data, write_feature, ops
@@ -157,10 +178,10 @@ class RecordWriter:
         if validation_data:
             self._prepare_validation()
             self._get_feature_info(self.validation_data_local, "eval")
-        self.num_example_record["train"] = self._write_tfrecord_parallel(self.train_data_local, mode="train")
+        self.num_example_record["train"] = self._write_record_parallel(self.train_data_local, mode="train")
         self._write_json_summary("train")
         if validation_data:
-            self.num_example_record["eval"] = self._write_tfrecord_parallel(self.validation_data_local, mode="eval")
+            self.num_example_record["eval"] = self._write_record_parallel(self.validation_data_local, mode="eval")
             self._write_json_summary("eval")
 
     def _get_feature_info(self, dictionary, mode):
@@ -175,19 +196,17 @@ class RecordWriter:
         assert len(set(self.global_feature_key[mode])) == len(
             self.global_feature_key[mode]), "found duplicate key in feature name during {}: {}".format(
             mode, self.global_feature_key[mode])
-        self.mb_per_csv_example[mode] = 0
-        self.mb_per_record_example[mode] = 0
         self.feature_dtype[mode] = {}
         self.feature_shape[mode] = {}
         for key in self.feature_name[mode]:
             data = np.asarray(feature[key])
-            self.mb_per_csv_example[mode] += data.nbytes / 1e6
             if self.expand_dims:
                 data = data[0]
-            self.mb_per_record_example[mode] += data.nbytes / 1e6
             dtype = str(data.dtype)
             if "<U" in dtype:
                 dtype = "str"
+            assert dtype != "str" or self.output_format != "memmap", \
+                "memmap output_format does not support string feature '{}'".format(key)
             self.feature_dtype[mode][key] = dtype
             if data.size == 1:
                 self.feature_shape[mode][key] = []
@@ -196,38 +215,43 @@ class RecordWriter:
             else:
                 self.feature_shape[mode][key] = data.shape
 
-    def _write_tfrecord_parallel(self, dictionary, mode):
+    def _write_record_parallel(self, dictionary, mode):
         num_example_list = []
         feature_shape_list = []
-        num_files_process = int(
-            np.ceil(self.num_example_csv[mode] * self.mb_per_csv_example[mode] / self.max_record_size_mb /
-                    self.num_process))
+        example_size_list = []
         num_example_process_remain = self.num_example_csv[mode] % self.num_process
         futures = []
         with ProcessPoolExecutor(max_workers=self.num_process) as executor:
             serial_start = 0
-            file_idx_start = 0
             for i in range(self.num_process):
                 if i < num_example_process_remain:
                     num_example_process = self.num_example_csv[mode] // self.num_process + 1
                 else:
                     num_example_process = self.num_example_csv[mode] // self.num_process
+                if num_example_process == 0:
+                    continue
                 serial_end = serial_start + num_example_process
                 futures.append(
-                    executor.submit(self._write_tfrecord_serial,
+                    executor.submit(self._write_memmap_serial
+                                    if self.output_format == "memmap" else self._write_tfrecord_serial,
                                     dictionary,
                                     serial_start,
                                     serial_end,
-                                    num_files_process,
-                                    file_idx_start,
+                                    i + self.global_file_idx[mode],
                                     mode))
                 serial_start += num_example_process
-                file_idx_start += num_files_process
         for future in futures:
             result = future.result()
             num_example_list.extend(result[0])
             feature_shape_list.append(result[1])
-        self._reconfirm_shape(feature_shape_list, mode)
+            example_size_list.append(result[2])
+        if self.output_format == "memmap":
+            self._reconfirm_memmap_shape(feature_shape_list, mode)
+            self._remove_fixed_length_offsets(num_example_list, mode)
+        else:
+            self._reconfirm_shape(feature_shape_list, mode)
+        self._reconfirm_example_size(example_size_list, mode)
+        self.global_file_idx[mode] += self.num_process
         return num_example_list
 
     def _reconfirm_shape(self, feature_shape_list, mode):
@@ -238,66 +262,127 @@ class RecordWriter:
                     feature_shape[key] = [-1]
         self.feature_shape[mode] = feature_shape
 
-    def _write_tfrecord_serial(self, dictionary, serial_start, serial_end, num_files_process, file_idx_start, mode):
+    def _reconfirm_memmap_shape(self, feature_shape_list, mode):
+        # a 1 dimensional feature keeps its fixed length only if every process found the same length
+        for key in self.feature_shape[mode]:
+            shapes = {tuple(feature_shape[key]) for feature_shape in feature_shape_list}
+            self.feature_shape[mode][key] = list(shapes.pop()) if len(shapes) == 1 else [-1]
+
+    def _remove_fixed_length_offsets(self, num_example_list, mode):
+        for shard, _ in num_example_list:
+            for key in list(shard["offsets"]):
+                if self.feature_shape[mode][key] != [-1]:
+                    os.remove(os.path.join(self.save_dir, shard["offsets"].pop(key)))
+
+    def _reconfirm_example_size(self, example_size_list, mode):
+        num_example = sum(example_size["num_example"] for example_size in example_size_list)
+        total_mb = sum(example_size["total_mb"] for example_size in example_size_list)
+        self.example_size_mb[mode] = {
+            "mean": total_mb / max(num_example, 1),
+            "max": max([example_size["max_mb"] for example_size in example_size_list] or [0.0])
+        }
+
+    def _write_tfrecord_serial(self, dictionary, serial_start, serial_end, file_idx, mode):
         num_example_list = []
-        num_csv_example_per_file = (serial_end - serial_start) // num_files_process
-        show_progress = serial_start == 0
-        file_start = serial_start
-        file_end = file_start + num_csv_example_per_file
-        for i in range(num_files_process):
-            file_idx = i + file_idx_start + self.global_file_idx[mode]
-            filename = mode + str(file_idx) + ".tfrecord"
-            if i == (num_files_process - 1):
-                file_end = serial_end
-            num_example_list.append(
-                self._write_single_file(dictionary,
-                                        filename,
-                                        file_start,
-                                        file_end,
-                                        serial_start,
-                                        serial_end,
-                                        show_progress,
-                                        mode))
-            file_start += num_csv_example_per_file
-            file_end += num_csv_example_per_file
-        return num_example_list, self.feature_shape[mode]
-
-    def _write_single_file(self,
-                           dictionary,
-                           filename,
-                           file_start,
-                           file_end,
-                           serial_start,
-                           serial_end,
-                           show_progress,
-                           mode):
+        example_size = {"num_example": 0, "total_mb": 0.0, "max_mb": 0.0}
+        max_record_size_bytes = self.max_record_size_mb * 1e6
+        writer, filename, shard_idx, num_example_file, num_bytes_file = None, None, 0, 0, 0
+        examples = self._generate_examples(dictionary, serial_start, serial_end, mode)
+        for block in self._get_blocks(examples, self.examples_per_record):
+            if writer is None:
+                filename = "{}{}_{}.tfrecord".format(mode, file_idx, shard_idx)
+                writer = tf.io.TFRecordWriter(os.path.join(self.save_dir, filename), options=self.compression_option)
+            if self.examples_per_record > 1:
+                record_bytes, block_mb = self._write_example_block(block, writer, mode)
+            else:
+                record_bytes, example_mb = self._write_single_example(block[0], writer, mode)
+                block_mb = [example_mb]
+            num_example_file += len(block_mb)
+            num_bytes_file += record_bytes
+            self._update_example_size(example_size, block_mb)
+            if num_bytes_file >= max_record_size_bytes:
+                writer.close()
+                num_example_list.append((filename, num_example_file))
+                writer, shard_idx, num_example_file, num_bytes_file = None, shard_idx + 1, 0, 0
+        if writer is not None:
+            writer.close()
+            num_example_list.append((filename, num_example_file))
+        return num_example_list, self.feature_shape[mode], example_size
+
+    def _write_memmap_serial(self, dictionary, serial_start, serial_end, file_idx, mode):
+        example_size = {"num_example": 0, "total_mb": 0.0, "max_mb": 0.0}
+        feature_files = {
+            key: "{}{}_{}.bin".format(mode, file_idx, key_idx)
+            for key_idx, key in enumerate(self.feature_name[mode])
+        }
+        # element counts of 0 or 1 dimensional features, used to build offsets for variable length features
+        feature_sizes = {key: [] for key in self.feature_name[mode] if len(self.feature_shape[mode][key]) <= 1}
+        writers = {key: open(os.path.join(self.save_dir, name), "wb") for key, name in feature_files.items()}
+        try:
+            for example in self._generate_examples(dictionary, serial_start, serial_end, mode):
+                example_mb = 0.0
+                for key in self.feature_name[mode]:
+                    data = self._verify_feature(example[key], key, mode)
+                    writers[key].write(data.tobytes())
+                    example_mb += data.nbytes / 1e6
+                    if key in feature_sizes:
+                        feature_sizes[key].append(data.size)
+                self._update_example_size(example_size, [example_mb])
+        finally:
+            for writer in writers.values():
+                writer.close()
+        offset_files = {}
+        feature_shape = dict(self.feature_shape[mode])
+        for key, sizes in feature_sizes.items():
+            if feature_shape[key] == [-1]:
+                offset_files[key] = "{}{}_{}_offsets.npy".format(mode, file_idx, self.feature_name[mode].index(key))
+                np.save(os.path.join(self.save_dir, offset_files[key]), np.cumsum([0] + sizes, dtype=np.int64))
+                if len(set(sizes)) == 1:
+                    # fixed length features are read in batches, the offsets are removed if all processes agree
+                    feature_shape[key] = [sizes[0]]
+        shard = {"features": feature_files, "offsets": offset_files}
+        return [(shard, example_size["num_example"])], feature_shape, example_size
+
+    def _generate_examples(self, dictionary, serial_start, serial_end, mode):
         goal_number = serial_end - serial_start
         logging_interval = max(goal_number // 20, 1)
+        show_progress = serial_start == 0
+        time_start = time.perf_counter()
         num_example = 0
-        with tf.io.TFRecordWriter(os.path.join(self.save_dir, filename), options=self.compression_option) as writer:
-            for i in range(file_start, file_end):
-                if i == file_start and show_progress:
-                    time_start = time.perf_counter()
-                    example_start = num_example
-                if (i - serial_start) % logging_interval == 0 and show_progress:
-                    if i == 0:
-                        record_per_sec = 0.0
-                    else:
-                        record_per_sec = (num_example - example_start) * self.num_process / (time.perf_counter() -
-                                                                                             time_start)
-                    print("FastEstimator: Converting %s TFRecords %.1f%%, Speed: %.2f record/sec" %
-                          (mode.capitalize(), (i - serial_start) / goal_number * 100, record_per_sec))
-                feature = self._transform_one_slice(dictionary, i, mode=mode)
-                if self.expand_dims:
-                    num_patches = self._verify_dict(feature, mode)
-                    for j in range(num_patches):
-                        feature_patch = self._get_dict_slice(feature, j, keys=self.feature_name[mode])
-                        self._write_single_example(feature_patch, writer, mode)
-                        num_example += 1
+        for i in range(serial_start, serial_end):
+            if (i - serial_start) % logging_interval == 0 and show_progress:
+                if i == 0:
+                    record_per_sec = 0.0
                 else:
-                    self._write_single_example(feature, writer, mode)
+                    record_per_sec = num_example * self.num_process / (time.perf_counter() - time_start)
+                print("FastEstimator: Converting %s Records %.1f%%, Speed: %.2f record/sec" %
+                      (mode.capitalize(), (i - serial_start) / goal_number * 100, record_per_sec))
+            feature = self._transform_one_slice(dictionary, i, mode=mode)
+            if self.expand_dims:
+                num_patches = self._verify_dict(feature, mode)
+                for j in range(num_patches):
                     num_example += 1
-        return filename, num_example
+                    yield self._get_dict_slice(feature, j, keys=self.feature_name[mode])
+            else:
+                num_example += 1
+                yield feature
+
+    @staticmethod
+    def _get_blocks(examples, block_size):
+        block = []
+        for example in examples:
+            block.append(example)
+            if len(block) == block_size:
+                yield block
+                block = []
+        if block:
+            yield block
+
+    @staticmethod
+    def _update_example_size(example_size, examples_mb):
+        example_size["num_example"] += len(examples_mb)
+        example_size["total_mb"] += sum(examples_mb)
+        example_size["max_mb"] = max([example_size["max_mb"]] + examples_mb)
 
     def _transform_one_slice(self, dictionary, index, mode):
         feature = self._get_dict_slice(dictionary, index)
@@ -306,25 +391,59 @@ class RecordWriter:
         return feature
 
     def _write_single_example(self, dictionary, writer, mode):
+        """Write one example and return its record size in bytes together with its decoded size in MB."""
         feature_tfrecord = {}
+        example_mb = 0.0
         for key in self.feature_name[mode]:
-            data = np.array(dictionary[key]).astype(self.feature_dtype[mode][key])
-            expected_shape = self.feature_shape[mode][key]
-            assert data.size > 0, "found empty data on feature '{}'".format(key)
-            if len(expected_shape) > 1:
-                assert expected_shape == data.shape, \
-                    "inconsistent shape on same feature `{}` among different examples, expected `{}`, found `{}`" \
-                    .format(key, expected_shape, data.shape)
-            else:
-                if data.size > 1:
-                    assert max(data.shape) == np.prod(data.shape), "inconsistent shape on same feature `{}` among \
-                        different examples, expected 0 or 1 dimensional array, found `{}`" \
-                        .format(key, data.shape)
-                    if not expected_shape:
-                        self.feature_shape[mode][key] = [-1]
+            data = self._verify_feature(dictionary[key], key, mode)
             feature_tfrecord[key] = self._bytes_feature(data.tostring())
+            example_mb += data.nbytes / 1e6
+        return self._write_features(feature_tfrecord, writer), example_mb
+
+    def _write_example_block(self, examples, writer, mode):
+        """Write several examples as one record, each feature being stored as a single contiguous array.
+
+        Returns:
+            The record size in bytes and the decoded size in MB of every example in the block.
+        """
+        feature_tfrecord = {BLOCK_SIZE_KEY: self._int64_feature(len(examples))}
+        examples_mb = [0.0] * len(examples)
+        for key in self.feature_name[mode]:
+            assert self.feature_dtype[mode][key] != "str", \
+                "examples_per_record > 1 does not support string feature '{}'".format(key)
+            data = [self._verify_feature(example[key], key, mode) for example in examples]
+            assert len(set(elem.shape for elem in data)) == 1, \
+                "feature '{}' must have the same shape for all examples in a record when examples_per_record > 1" \
+                .format(key)
+            feature_tfrecord[key] = self._bytes_feature(np.stack(data).tostring())
+            for idx, elem in enumerate(data):
+                examples_mb[idx] += elem.nbytes / 1e6
+        return self._write_features(feature_tfrecord, writer), examples_mb
+
+    @staticmethod
+    def _write_features(feature_tfrecord, writer):
         example = tf.train.Example(features=tf.train.Features(feature=feature_tfrecord))
-        writer.write(example.SerializeToString())
+        serialized_example = example.SerializeToString()
+        writer.write(serialized_example)
+        # each tfrecord entry is framed by an 8-byte length and two 4-byte crc checksums
+        return len(serialized_example) + 16
+
+    def _verify_feature(self, value, key, mode):
+        data = np.array(value).astype(self.feature_dtype[mode][key])
+        expected_shape = self.feature_shape[mode][key]
+        assert data.size > 0, "found empty data on feature '{}'".format(key)
+        if len(expected_shape) > 1:
+            assert expected_shape == data.shape, \
+                "inconsistent shape on same feature `{}` among different examples, expected `{}`, found `{}`" \
+                .format(key, expected_shape, data.shape)
+        else:
+            if data.size > 1:
+                assert max(data.shape) == np.prod(data.shape), "inconsistent shape on same feature `{}` among \
+                    different examples, expected 0 or 1 dimensional array, found `{}`" \
+                    .format(key, data.shape)
+                if not expected_shape:
+                    self.feature_shape[mode][key] = [-1]
+        return data
 
     @staticmethod
     def _get_dict_slice(dictionary, index, keys=None):
@@ -403,20 +522,24 @@ class RecordWriter:
                 self.save_dir)
         else:
             os.makedirs(self.save_dir)
-        print("FastEstimator: Saving tfrecord to %s" % self.save_dir)
+        print("FastEstimator: Saving %s to %s" % (self.output_format, self.save_dir))
 
     def _write_json_summary(self, mode):
         summary = {"feature_dtype": self.feature_dtype[mode], "feature_shape": self.feature_shape[mode]}
         files, num_examples = zip(*self.num_example_record[mode])
         summary["file_names"] = list(files)
         summary["num_examples"] = list(num_examples)
-        summary["example_size_mb"] = self.mb_per_record_example[mode]
+        summary["example_size_mb"] = self.example_size_mb[mode]["mean"]
+        summary["max_example_size_mb"] = self.example_size_mb[mode]["max"]
         if self.compression:
             summary["compression"] = self.compression
+        if self.examples_per_record > 1:
+            summary["examples_per_record"] = self.examples_per_record
+        if self.output_format != "tfrecord":
+            summary["format"] = self.output_format
         file_name = "%s_summary%d.json" % (mode, self.feature_set_idx)
         with open(os.path.join(self.save_dir, file_name), 'w') as fp:
             json.dump(summary, fp, indent=4)
-        self.global_file_idx[mode] += len(files)
 
     def transform(self, data, mode):
         assert isinstance(data, dict), "please provide dictionary with different features as key"
@@ -434,3 +557,38 @@ class RecordWriter:
                 for key, value in feature.items():
                     result[key].append(value)
         return result
+
+    def bulk_transform(self, data, mode, num_process=None):
+        """Apply the `RecordWriter` ops to many examples in parallel.
+
+        Examples are split into contiguous chunks that are processed by a pool of worker processes, and the results are
+        stacked into arrays instead of being returned as lists of single examples.
+
+        Args:
+            data (dict): Features to transform, each being a list or numpy array with the same number of examples.
+            mode (str): Mode of the ops to apply, either "train" or "eval".
+            num_process (int, optional): Number of worker processes. If None, `self.num_process` is used. Defaults to
+                None.
+
+        Returns:
+            dict: Stacked numpy array of every feature after the ops, empty if `data` has no examples.
+        """
+        assert isinstance(data, dict), "please provide dictionary with different features as key"
+        assert len(self.ops) <= 1, "transform does not support unpaired dataset yet"
+        num_data = self._verify_dict(dictionary=data)
+        if num_data == 0:
+            return {}
+        self.ops_local = self.ops[0]
+        self._check_ops(mode)
+        num_process = min(num_process or self.num_process, num_data)
+        futures = []
+        with ProcessPoolExecutor(max_workers=num_process) as executor:
+            for chunk in np.array_split(np.arange(num_data), num_process):
+                chunk_data = {key: value[chunk[0]:chunk[-1] + 1] for key, value in data.items()}
+                futures.append(executor.submit(self._transform_chunk, chunk_data, mode))
+        results = [future.result() for future in futures]
+        return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+    def _transform_chunk(self, data, mode):
+        features = [self._transform_one_slice(data, idx, mode) for idx in range(self._verify_dict(dictionary=data))]
+        return {key: np.stack([feature[key] for feature in features]) for key in features[0]}
@@ -0,0 +1,58 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from fastestimator.op.numpyop import Minmax
+from fastestimator.pipeline import Pipeline
+from fastestimator.record_writer import RecordWriter
+
+
+class TestRecordWriter(TestCase):
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------------ Memmap ------------------------------------------------ #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_memmap_fixed_length_feature(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_dir = os.path.join(tmp_dir, "records")
+            data = {"x": np.random.rand(20, 4).astype("float32"), "y": np.arange(20)}
+            RecordWriter(train_data=data, save_dir=save_dir, output_format="memmap").write()
+            with open(os.path.join(save_dir, "train_summary0.json")) as summary_file:
+                summary = json.load(summary_file)
+            self.assertEqual(summary["feature_shape"]["x"], [4])
+            self.assertFalse(any(shard["offsets"] for shard in summary["file_names"]))
+            self.assertFalse(any(name.endswith("_offsets.npy") for name in os.listdir(save_dir)))
+            batch = Pipeline(data=save_dir, batch_size=5).show_results()[0]
+            self.assertEqual(batch["x"].shape, (5, 4))
+            np.testing.assert_allclose(batch["x"].numpy(), data["x"][batch["y"].numpy()])
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # -------------------------------------------- Bulk Transform -------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_bulk_transform_matches_transform(self):
+        writer = RecordWriter(train_data={"x": []}, save_dir="unused", ops=Minmax(inputs="x", outputs="x"))
+        data = {"x": np.random.rand(10, 3, 3).astype("float32"), "y": np.arange(10)}
+        expected = writer.transform(data, "train")
+        actual = writer.bulk_transform(data, "train", num_process=3)
+        for key in ["x", "y"]:
+            np.testing.assert_allclose(actual[key], np.stack(expected[key]))
+
+    def test_bulk_transform_empty(self):
+        writer = RecordWriter(train_data={"x": []}, save_dir="unused", ops=Minmax(inputs="x", outputs="x"))
+        self.assertDictEqual(writer.bulk_transform({"x": np.zeros((0, 3))}, "train"), {})
@@ -35,3 +35,12 @@ class Summary:
         for mode, sub in other.history.items():
             for key, val in sub.items():
                 self.history[mode][key].update(val)
+
+    def __getstate__(self):
+        return {"name": self.name, "history": {mode: dict(sub) for mode, sub in self.history.items()}}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.history = defaultdict(lambda: defaultdict(dict))
+        for mode, sub in state["history"].items():
+            self.history[mode].update(sub)
@@ -14,6 +14,6 @@
 # ==============================================================================
 from fastestimator.trace.trace import Trace, TrainInfo, MonitorLoss  # isort:skip
 from fastestimator.trace.adapt import EarlyStopping, LRController, TerminateOnNaN
-from fastestimator.trace.io import Caricature, CSVLogger, GradCam, Logger, ModelSaver, Saliency, SlackNotification, \
-    TensorBoard, UMap, VisLogger
+from fastestimator.trace.io import Caricature, Checkpoint, CSVLogger, GradCam, Logger, ModelSaver, Saliency, \
+    SlackNotification, TensorBoard, UMap, VisLogger
 from fastestimator.trace.metric import Accuracy, ConfusionMatrix, Dice, F1Score, MeanAvgPrecision, Precision, Recall
@@ -33,11 +33,14 @@ class EarlyStopping(Trace):
         baseline (float, optional): Baseline value for the monitored quantity. Training will stop if the model doesn't
             show improvement over the baseline. Defaults to None.
         restore_best_weights (bool, optional): Whether to restore model weights from the epoch with the best value of
-            the monitored quantity. If False, the model weights obtained at the last step of training are used.
-            Defaults to False.
+            the monitored quantity. If False, the model weights obtained at the last step of training are used. Models
+            with a moving average of the weights get both their weights and their averages restored. Defaults to
+            False.
         mode (str, optional): Restrict the trace to run only on given modes {'train', 'eval', 'test'}. None will always
                     execute. Defaults to 'eval'.
     """
+    state_keys = ("best", "best_weights", "wait")
+
     def __init__(self,
                  monitor="loss",
                  min_delta=0,
@@ -47,7 +50,7 @@ class EarlyStopping(Trace):
                  baseline=None,
                  restore_best_weights=False,
                  mode='eval'):
-        super().__init__(inputs=monitor, mode=mode)
+        super().__init__(inputs=monitor, mode=mode, batch_inputs=[])
 
         if len(self.inputs) != 1:
             raise ValueError("EarlyStopping supports only one monitor key")
@@ -84,7 +87,13 @@ class EarlyStopping(Trace):
             self.best = current
             self.wait = 0
             if self.restore_best_weights:
-                self.best_weights = dict(map(lambda x: (x[0], x[1].get_weights()), self.network.model.items()))
+                # snapshots are shared with ModelSaver, so the weights are copied to host memory only once per step. The
+                # moving averages are swapped in at the epoch end, the trained weights are then in the average slots
+                self.best_weights = {
+                    name: (self.network.snapshot_weights(name, state["train_step"]),
+                           self.network.snapshot_averages(name))
+                    for name in self.network.model
+                }
         else:
             self.wait += 1
             if self.wait >= self.patience:
@@ -92,7 +101,7 @@ class EarlyStopping(Trace):
                 if self.restore_best_weights:
                     if self.verbose > 0:
                         print('FastEstimator-EarlyStopping: Restoring best model weights')
-                    for name, model in self.network.model.items():
-                        model.set_weights(self.best_weights[name])
+                    for name in self.network.model:
+                        self.network.restore_weights(name, *self.best_weights[name])
                 print("FastEstimator-EarlyStopping: '{}' triggered an early stop. Its best value was {} at epoch {}\
                       ".format(self.monitored_key, self.best, state['epoch'] - self.wait))
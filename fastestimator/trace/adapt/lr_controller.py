@@ -15,8 +15,10 @@
 import numpy as np
 from tensorflow.python.keras import backend
 
+from fastestimator.op.tensorop import UpdateOp
 from fastestimator.schedule import LRSchedule
 from fastestimator.trace import Trace
+from fastestimator.util.util import get_base_optimizer
 
 
 class LRController(Trace):
@@ -36,6 +38,8 @@ class LRController(Trace):
             "min".
         min_lr (float, optional): Minimum learning rate. Defaults to 1e-6.
     """
+    state_keys = ("base_lr", "current_lr", "reduce_lr_ratio", "reduce_metric_best", "wait")
+
     def __init__(self,
                  model_name,
                  lr_schedule=None,
@@ -46,9 +50,9 @@ class LRController(Trace):
                  min_lr=1e-6):
 
         if isinstance(reduce_on_eval, str):
-            super().__init__(inputs=reduce_on_eval)
+            super().__init__(inputs=reduce_on_eval, batch_inputs=[])
         else:
-            super().__init__()
+            super().__init__(batch_inputs=[])
         self.model_name = model_name
         self.lr_schedule = lr_schedule
         self.reduce_on_eval = reduce_on_eval
@@ -63,6 +67,7 @@ class LRController(Trace):
         self.model = None
         self.change_lr = False
         self.wait = 0
+        self.accumulation_steps = 1
         if self.lr_schedule:
             assert isinstance(self.lr_schedule, LRSchedule), "lr_schedule must be instance of LRSchedule"
         if self.reduce_mode == "min":
@@ -77,17 +82,18 @@ class LRController(Trace):
     def on_begin(self, state):
         self.log_steps = state["log_steps"]
         self.model = self.network.model[self.model_name]
-        self.base_lr = backend.get_value(self.model.optimizer.lr)
+        self.base_lr = backend.get_value(get_base_optimizer(self.model.optimizer).lr)
         self.current_lr = max(self.base_lr * self.reduce_lr_ratio, self.min_lr)
         if self.reduce_on_eval is True:
             self.reduce_on_eval = self.model.loss_name
         if self.lr_schedule:
             self.lr_schedule.total_epochs = state["total_epochs"]
-            self.lr_schedule.total_train_steps = state["total_train_steps"]
+            self.lr_schedule.total_train_steps = state["total_train_steps"] // self._get_accumulation_steps(0)
             self.lr_schedule.initial_lr = self.current_lr
 
     def on_epoch_begin(self, state):
         if state["mode"] == "train":
+            self.accumulation_steps = self._get_accumulation_steps(state["epoch"])
             if self.lr_schedule and self.lr_schedule.schedule_mode == "epoch":
                 self.base_lr = self.lr_schedule.schedule_fn(state["epoch"], self.base_lr)
                 self.change_lr = True
@@ -95,7 +101,9 @@ class LRController(Trace):
     def on_batch_begin(self, state):
         if state["mode"] == "train":
             if self.lr_schedule and self.lr_schedule.schedule_mode == "step":
-                self.base_lr = self.lr_schedule.schedule_fn(state["train_step"], self.base_lr)
+                # with gradient accumulation the optimizer only steps once every accumulation_steps batches
+                optimizer_step = state["train_step"] // self.accumulation_steps
+                self.base_lr = self.lr_schedule.schedule_fn(optimizer_step, self.base_lr)
                 self.change_lr = True
             if self.change_lr:
                 self._update_lr()
@@ -119,7 +127,13 @@ class LRController(Trace):
                     print("FastEstimator-LRController: learning rate reduced by factor of {}".format(
                         self.reduce_factor))
 
+    def _get_accumulation_steps(self, epoch):
+        for op in self.network.op_schedule["train"].get_current_value(epoch):
+            if isinstance(op, UpdateOp) and op.model is self.model:
+                return op.accumulation_steps
+        return 1
+
     def _update_lr(self):
         self.current_lr = max(self.base_lr * self.reduce_lr_ratio, self.min_lr)
-        backend.set_value(self.model.optimizer.lr, self.current_lr)
+        backend.set_value(get_base_optimizer(self.model.optimizer).lr, self.current_lr)
         self.change_lr = False
@@ -32,7 +32,7 @@ class TerminateOnNaN(Trace):
     """
     def __init__(self, monitor_names=None):
         self.monitored_keys = monitor_names if monitor_names is None else set(monitor_names)
-        super().__init__(inputs=self.monitored_keys)
+        super().__init__(inputs=self.monitored_keys, batch_inputs=[])
         self.all_loss_keys = {}
         self.monitored_loss_keys = {}
         self.monitored_state_keys = {}
@@ -13,6 +13,7 @@
 # limitations under the License.
 # ==============================================================================
 from fastestimator.trace.io.caricature import Caricature
+from fastestimator.trace.io.checkpoint import Checkpoint
 from fastestimator.trace.io.csv_logger import CSVLogger
 from fastestimator.trace.io.grad_cam import GradCam
 from fastestimator.trace.io.logger import Logger, VisLogger
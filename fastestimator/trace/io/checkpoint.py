@@ -0,0 +1,166 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import pickle
+import random
+import shutil
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.training.tracking import base as trackable
+
+from fastestimator.trace import Trace
+
+
+class Checkpoint(Trace):
+    """Periodically save the full training state so that `Estimator.fit(resume_from=...)` can continue an interrupted
+    training.
+
+    A checkpoint holds the model weights, the optimizer states (including slots and iterations), the `state_keys` of
+    every trace, the numpy, python and tensorflow global random generators, the position in the training (epoch, step
+    and batch) and the data iterators of the pipeline, so that the resumed training reads the same data in the same
+    order. Iterators which tensorflow cannot save (for example of generator datasets or distributed datasets) are left
+    out, and the resumed training skips the consumed batches instead. Each checkpoint is written into a temporary
+    directory which is then renamed, so an interruption during saving never corrupts the latest checkpoint.
+
+    Args:
+        save_dir (str): Directory to save the checkpoints.
+        save_steps (int, optional): Number of training steps between checkpoints. Defaults to None.
+        save_minutes (float, optional): Number of minutes between checkpoints. Defaults to None.
+        max_to_keep (int, optional): Number of most recent checkpoints to keep. Defaults to 2.
+    """
+    chief_only = True
+
+    def __init__(self, save_dir, save_steps=None, save_minutes=None, max_to_keep=2):
+        super().__init__(mode="train", batch_inputs=[])
+        assert save_steps or save_minutes, "must provide save_steps or save_minutes"
+        assert max_to_keep > 0, "max_to_keep must be positive"
+        self.save_dir = os.path.normpath(save_dir)
+        self.save_steps = save_steps
+        self.save_minutes = save_minutes
+        self.max_to_keep = max_to_keep
+        self.last_save_time = None
+        self.save_pending = False
+
+    def on_begin(self, state):
+        os.makedirs(self.save_dir, exist_ok=True)
+        self.last_save_time = time.perf_counter()
+
+    def on_batch_end(self, state):
+        step = state["train_step"] + 1
+        if self.save_steps and step % self.save_steps == 0:
+            self.save_pending = True
+        elif self.save_minutes and time.perf_counter() - self.last_save_time >= self.save_minutes * 60:
+            self.save_pending = True
+
+    def save(self, models, traces, position, iterators=None):
+        """Write a checkpoint. The estimator calls it once every trace has processed the current batch.
+
+        Args:
+            models (dict): Models of the network, keyed by model name.
+            traces (list): Sorted traces of the estimator.
+            position (dict): "epoch", "batch_idx" and "train_step" to resume from.
+            iterators (dict, optional): Data iterators of the pipeline, keyed by a name unique in the estimator.
+                Defaults to None.
+        """
+        name = "ckpt_{}".format(position["train_step"])
+        temp_dir = os.path.join(self.save_dir, "tmp_" + name)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        iterators = _get_trackable_iterators(iterators)
+        try:
+            _get_tf_checkpoint(models, iterators).write(os.path.join(temp_dir, "variables"))
+        except (tf.errors.OpError, ValueError, TypeError):
+            if not iterators:
+                raise
+            print("FastEstimator-Checkpoint: The data iterators cannot be saved, the resumed training will skip the "
+                  "consumed batches instead")
+            iterators = {}
+            _get_tf_checkpoint(models).write(os.path.join(temp_dir, "variables"))
+        meta = dict(position)
+        meta["iterators"] = sorted(iterators)
+        meta["traces"] = [(type(trace).__name__, trace.get_state()) for trace in traces]
+        meta["numpy_rng"] = np.random.get_state()
+        meta["python_rng"] = random.getstate()
+        with open(os.path.join(temp_dir, "state.pkl"), "wb") as fp:
+            pickle.dump(meta, fp)
+        final_dir = os.path.join(self.save_dir, name)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(temp_dir, final_dir)
+        _write_atomic(os.path.join(self.save_dir, "latest"), name)
+        self._remove_old_checkpoints()
+        self.save_pending = False
+        self.last_save_time = time.perf_counter()
+        print("FastEstimator-Checkpoint: Saved checkpoint to {}".format(final_dir))
+
+    def _remove_old_checkpoints(self):
+        checkpoints = [name for name in os.listdir(self.save_dir) if name.startswith("ckpt_")]
+        checkpoints.sort(key=lambda name: int(name[len("ckpt_"):]))
+        for name in checkpoints[:-self.max_to_keep]:
+            shutil.rmtree(os.path.join(self.save_dir, name), ignore_errors=True)
+
+    @staticmethod
+    def load(path, models, iterators=None):
+        """Restore the models, optimizers, random generators and data iterators from a checkpoint.
+
+        Args:
+            path (str): A checkpoint directory, or a save_dir of `Checkpoint` in which case the latest checkpoint is
+                used.
+            models (dict): Models of the network, keyed by model name.
+            iterators (dict, optional): Data iterators of the pipeline, keyed by the names used when saving. They are
+                restored only if the checkpoint holds all of them. Defaults to None.
+
+        Returns:
+            dict: The training position, the trace states and "data_restored", whether the data iterators are restored.
+        """
+        if os.path.exists(os.path.join(path, "latest")):
+            with open(os.path.join(path, "latest"), "r") as fp:
+                path = os.path.join(path, fp.read().strip())
+        assert os.path.exists(os.path.join(path, "state.pkl")), "cannot find a checkpoint in {}".format(path)
+        with open(os.path.join(path, "state.pkl"), "rb") as fp:
+            meta = pickle.load(fp)
+        iterators = _get_trackable_iterators(iterators)
+        meta["data_restored"] = bool(iterators) and sorted(iterators) == meta.pop("iterators", [])
+        if not meta["data_restored"]:
+            iterators = {}
+        _get_tf_checkpoint(models, iterators).read(os.path.join(path, "variables")).assert_existing_objects_matched()
+        np.random.set_state(meta.pop("numpy_rng"))
+        random.setstate(meta.pop("python_rng"))
+        print("FastEstimator-Checkpoint: Restored checkpoint from {}".format(path))
+        return meta
+
+
+def _get_trackable_iterators(iterators):
+    return {name: ds_iter for name, ds_iter in (iterators or {}).items() if isinstance(ds_iter, trackable.Trackable)}
+
+
+def _get_tf_checkpoint(models, iterators=None):
+    objects = {"rng": tf.random.experimental.get_global_generator()}
+    for name, ds_iter in (iterators or {}).items():
+        objects["data_" + name] = ds_iter
+    for name, model in models.items():
+        objects["model_" + name] = model
+        objects["optimizer_" + name] = model.optimizer
+        if getattr(model, "ema", None):
+            objects["ema_" + name] = model.ema.variables
+    return tf.train.Checkpoint(**objects)
+
+
+def _write_atomic(path, content):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as fp:
+        fp.write(content)
+    os.replace(temp_path, path)
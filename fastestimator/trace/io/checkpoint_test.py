@@ -0,0 +1,77 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import tensorflow as tf
+
+import fastestimator as fe
+from fastestimator.trace import Checkpoint, EarlyStopping, MonitorLoss
+
+
+def _build_model():
+    return fe.build(model_def=lambda: tf.keras.Sequential([tf.keras.layers.Dense(1, input_shape=(2, ))]),
+                    model_name="model",
+                    optimizer="sgd",
+                    loss_name="loss")
+
+
+def _get_iterator():
+    return iter(tf.data.Dataset.range(100).shuffle(100).repeat().batch(4))
+
+
+class TestCheckpoint(TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.models = {"model": _build_model()}
+
+    def test_resume_data_order(self):
+        ds_iter = _get_iterator()
+        for _ in range(3):
+            next(ds_iter)
+        Checkpoint(save_dir=self.save_dir, save_steps=1).save(models=self.models,
+                                                              traces=[],
+                                                              position={
+                                                                  "epoch": 0, "batch_idx": 3, "train_step": 3
+                                                              },
+                                                              iterators={"train_0_0": ds_iter})
+        expected = [next(ds_iter).numpy() for _ in range(5)]
+        resumed_iter = _get_iterator()
+        meta = Checkpoint.load(self.save_dir, self.models, iterators={"train_0_0": resumed_iter})
+        self.assertTrue(meta["data_restored"])
+        for batch in expected:
+            np.testing.assert_array_equal(next(resumed_iter).numpy(), batch)
+
+    def test_unsaved_iterators_are_not_restored(self):
+        Checkpoint(save_dir=self.save_dir, save_steps=1).save(models=self.models,
+                                                              traces=[],
+                                                              position={
+                                                                  "epoch": 0, "batch_idx": 3, "train_step": 3
+                                                              })
+        meta = Checkpoint.load(self.save_dir, self.models, iterators={"train_0_0": _get_iterator()})
+        self.assertFalse(meta["data_restored"])
+
+    def test_trace_states_are_declared(self):
+        monitor_loss = MonitorLoss()
+        monitor_loss.best_loss = 0.5
+        monitor_loss.epochs_since_best = 2
+        monitor_loss.epoch_losses = ["loss"]
+        self.assertEqual(monitor_loss.get_state(), {"best_loss": 0.5, "epochs_since_best": 2})
+        early_stopping = EarlyStopping()
+        early_stopping.set_state({"best": 0.1, "best_weights": None, "wait": 3})
+        self.assertEqual(early_stopping.wait, 3)
+        self.assertEqual(early_stopping.best, 0.1)
+        self.assertEqual(Checkpoint(save_dir=self.save_dir, save_steps=1).get_state(), {})
@@ -31,9 +31,11 @@ class CSVLogger(Trace):
         mode (str, optional): Restrict the trace to run only on given modes {'train', 'eval', 'test'}. None will always
             execute. Defaults to 'eval'.
     """
+    chief_only = True
+
     def __init__(self, filename, monitor_names=None, separator=", ", append=False, mode="eval"):
         self.keys = monitor_names if monitor_names is None else to_list(monitor_names)
-        super().__init__(inputs="*" if self.keys is None else monitor_names, mode=mode)
+        super().__init__(inputs="*" if self.keys is None else monitor_names, mode=mode, batch_inputs=[])
         self.separator = separator
         self.file = open(filename, 'a' if append else 'w')
         self.file_empty = os.stat(filename).st_size == 0
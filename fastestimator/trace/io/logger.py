@@ -27,8 +27,10 @@ class Logger(Trace):
     """Logger that prints log. Please don't add this trace into an estimator manually. An estimators will add it
         automatically.
     """
+    chief_only = True
+
     def __init__(self):
-        super().__init__(inputs="*")
+        super().__init__(inputs="*", batch_inputs=[])
         self.log_steps = 0
         self.persist_summary = False
         self.epoch_losses = []
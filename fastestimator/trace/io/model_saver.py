@@ -13,8 +13,10 @@
 # limitations under the License.
 # ==============================================================================
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+import tensorflow as tf
 
 from fastestimator.trace import Trace
 
@@ -22,6 +24,12 @@ from fastestimator.trace import Trace
 class ModelSaver(Trace):
     """Save trained model in hdf5 format.
 
+    Weights are copied to host memory at the end of the epoch and the file is written by a background thread, so
+    training continues while the model is being saved. A save waits for the previous one, and the last one is completed
+    at the end of the training, so that an error of a background save is raised instead of being lost. Files are
+    written under a temporary name and renamed once complete. Models which cannot be cloned (subclassed models) are
+    saved synchronously.
+
     Args:
         model_name (str): Name of FE model.
         save_dir (str): Directory to save the trained models.
@@ -30,18 +38,26 @@ class ModelSaver(Trace):
         save_best_mode (str, optional): Can be `'min'`, `'max'`, or `'auto'`. Defaults to 'min'.
         save_freq (int, optional): Number of epochs to save models. Cannot be used with `save_best_only=True`. Defaults
             to 1.
+        max_to_keep (int, optional): Number of model files to keep. With `save_best`, the files of the best
+            `max_to_keep` epochs by the monitored value are kept, otherwise the most recent ones. None keeps a single
+            best file, or every periodic file. Defaults to None.
     """
-    def __init__(self, model_name, save_dir, save_best=False, save_best_mode='min', save_freq=1):
+    chief_only = True
+    state_keys = ("best", "saved_files")
+
+    def __init__(self, model_name, save_dir, save_best=False, save_best_mode='min', save_freq=1, max_to_keep=None):
         if isinstance(save_best, str):
-            super().__init__(inputs=save_best)
+            super().__init__(inputs=save_best, batch_inputs=[])
         else:
-            super().__init__()
+            super().__init__(batch_inputs=[])
         self.model_name = model_name
         self.save_dir = save_dir
         self.save_best = save_best
         self.save_best_mode = save_best_mode
         self.save_freq = save_freq
+        self.max_to_keep = max_to_keep
         assert isinstance(self.save_freq, int), "save_freq must be integer"
+        assert max_to_keep is None or max_to_keep > 0, "max_to_keep must be positive"
         if self.save_best_mode == "min":
             self.best = np.Inf
             self.monitor_op = np.less
@@ -51,6 +67,11 @@ class ModelSaver(Trace):
         else:
             raise ValueError("save_best_mode must be either 'min' or 'max'")
         self.model = None
+        self.best_weights = None
+        self.saved_files = []  # (monitored value, path), ordered from best to worst or from newest to oldest
+        self.shadow_model = None
+        self.executor = None
+        self.future = None
 
     def on_begin(self, state):
         if self.save_dir:
@@ -59,17 +80,76 @@ class ModelSaver(Trace):
         self.model = self.network.model[self.model_name]
         if self.save_best is True:
             self.save_best = self.model.loss_name
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            with tf.device("/cpu:0"):
+                self.shadow_model = tf.keras.models.clone_model(self.model)
+        except (ValueError, TypeError, NotImplementedError):
+            self.shadow_model = None
 
     def on_epoch_end(self, state):
         if self.save_best:
-            if state["mode"] == "eval" and self.monitor_op(state[self.save_best], self.best):
-                self.best = state[self.save_best]
-                self._save_model("{}_best_{}.h5".format(self.model_name, self.save_best))
+            if state["mode"] == "eval":
+                current = state[self.save_best]
+                improved = self.monitor_op(current, self.best)
+                if improved:
+                    self.best = current
+                    # host copy shared with other traces of the same step, for example EarlyStopping
+                    self.best_weights = self.network.snapshot_weights(self.model_name, state["train_step"])
+                if self.max_to_keep is None:
+                    if improved:
+                        self._save_model("{}_best_{}.h5".format(self.model_name, self.save_best), state)
+                elif self._is_top_k(current):
+                    name = "{}_best_{}_epoch_{}.h5".format(self.model_name, self.save_best, state["epoch"])
+                    self._save_model(name, state, current)
         elif state["mode"] == "train" and state["epoch"] % self.save_freq == 0:
-            self._save_model("{}_epoch_{}_step_{}.h5".format(self.model_name, state['epoch'], state['train_step']))
+            self._save_model("{}_epoch_{}_step_{}.h5".format(self.model_name, state['epoch'], state['train_step']),
+                             state)
 
-    def _save_model(self, name):
-        if self.save_dir:
-            save_path = os.path.join(self.save_dir, name)
-            self.model.save(save_path, include_optimizer=False)
-            print("FastEstimator-ModelSaver: Saving model to {}".format(save_path))
+    def on_end(self, state):
+        if self.executor:
+            try:
+                self._wait_for_save()
+            finally:
+                self.executor.shutdown(wait=True)
+
+    def _is_top_k(self, value):
+        return len(self.saved_files) < self.max_to_keep or self.monitor_op(value, self.saved_files[-1][0])
+
+    def _save_model(self, name, state, value=None):
+        if not self.save_dir:
+            return
+        save_path = os.path.join(self.save_dir, name)
+        removed_paths = []
+        if self.max_to_keep:
+            if value is None:
+                self.saved_files.insert(0, (value, save_path))
+            else:
+                self.saved_files.append((value, save_path))
+                self.saved_files.sort(key=lambda item: item[0], reverse=self.save_best_mode == "max")
+            removed_paths = [path for _, path in self.saved_files[self.max_to_keep:]]
+            self.saved_files = self.saved_files[:self.max_to_keep]
+        if self.shadow_model is None:
+            self._write_model(self.model, None, save_path, removed_paths)
+        else:
+            weights = self.network.snapshot_weights(self.model_name, state["train_step"])
+            # at most one save is in flight, so errors surface at the next save and snapshots do not pile up
+            self._wait_for_save()
+            self.future = self.executor.submit(self._write_model, self.shadow_model, weights, save_path, removed_paths)
+
+    def _wait_for_save(self):
+        if self.future is not None:
+            future, self.future = self.future, None
+            future.result()
+
+    @staticmethod
+    def _write_model(model, weights, save_path, removed_paths):
+        if weights is not None:
+            model.set_weights(weights)
+        temp_path = save_path[:-len(".h5")] + "_tmp.h5"
+        model.save(temp_path, include_optimizer=False)
+        os.replace(temp_path, save_path)
+        print("FastEstimator-ModelSaver: Saving model to {}".format(save_path))
+        for path in removed_paths:
+            if os.path.exists(path):
+                os.remove(path)
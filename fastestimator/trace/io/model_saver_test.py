@@ -0,0 +1,64 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import tensorflow as tf
+
+import fastestimator as fe
+from fastestimator.op.tensorop import ModelOp
+from fastestimator.trace import ModelSaver
+
+
+def _get_network():
+    model = fe.build(model_def=lambda: tf.keras.Sequential([tf.keras.layers.Dense(1, input_shape=(2, ))]),
+                     model_name="model",
+                     optimizer="sgd",
+                     loss_name="loss")
+    network = fe.Network(ops=[ModelOp(model=model, inputs="x", outputs="y_pred")])
+    network.prepare(mode_list=["train"])
+    return network
+
+
+class TestModelSaver(TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.model_saver = ModelSaver(model_name="model", save_dir=self.save_dir)
+        self.model_saver.network = _get_network()
+        self.model_saver.on_begin({})
+
+    def _end_epoch(self, epoch):
+        self.model_saver.on_epoch_end({"mode": "train", "epoch": epoch, "train_step": epoch + 1})
+
+    def test_saves_are_complete_at_end(self):
+        for epoch in range(3):
+            self._end_epoch(epoch)
+        self.model_saver.on_end({})
+        for epoch in range(3):
+            path = os.path.join(self.save_dir, "model_epoch_{}_step_{}.h5".format(epoch, epoch + 1))
+            self.assertTrue(os.path.exists(path))
+
+    def test_error_is_raised_by_next_save(self):
+        with mock.patch.object(ModelSaver, "_write_model", side_effect=OSError("disk full")):
+            self._end_epoch(0)
+            with self.assertRaises(OSError):
+                self._end_epoch(1)
+
+    def test_error_is_raised_at_end(self):
+        with mock.patch.object(ModelSaver, "_write_model", side_effect=OSError("disk full")):
+            self._end_epoch(0)
+            with self.assertRaises(OSError):
+                self.model_saver.on_end({})
@@ -44,8 +44,10 @@ class SlackNotification(Trace):
         TypeError: If `begin_msg` or `end_msg` is not (str, function).
 
     """
+    chief_only = True
+
     def __init__(self, channel, end_msg, begin_msg=None, token=None, verbose=0):
-        super().__init__()
+        super().__init__(batch_inputs=[])
 
         if begin_msg:
             self._check_str_or_function(begin_msg)
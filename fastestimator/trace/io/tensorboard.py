@@ -51,6 +51,8 @@ class TensorBoard(Trace):
             for this embedding layer is saved. See the details about metadata files format. In case if the same
             metadata file is used for all embedding layers, string can be passed. Defaults to None.
     """
+    chief_only = True
+
     def __init__(self,
                  log_dir='logs',
                  histogram_freq=0,
@@ -60,7 +62,7 @@ class TensorBoard(Trace):
                  profile_batch=2,
                  embeddings_freq=0,
                  embeddings_metadata=None):
-        super().__init__(inputs="*")
+        super().__init__(inputs="*", batch_inputs=[])
         current_time = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
         self.train_log_dir = os.path.join(os.path.join(log_dir, current_time), 'train')
         eval_log_dir = os.path.join(os.path.join(log_dir, current_time), 'eval')
@@ -51,7 +51,7 @@ class XAiTrace(Trace):
             self.resample_inputs = False
         if output_key is None:
             self.output_key = "{}_{}".format(model_name, type(self).__name__)
-        super().__init__(inputs=self.input_key, outputs=output_key, mode=mode)
+        super().__init__(inputs=self.input_key, outputs=output_key, mode=mode, batch_inputs=[])
         self.model_name = model_name
         self.model = None
         self.im_freq = im_freq
@@ -29,7 +29,7 @@ class Accuracy(Trace):
     """
     def __init__(self, true_key, pred_key, mode="eval", output_name="accuracy"):
 
-        super().__init__(outputs=output_name, mode=mode)
+        super().__init__(outputs=output_name, mode=mode, batch_inputs=[true_key, pred_key])
         self.true_key = true_key
         self.pred_key = pred_key
         self.total = 0
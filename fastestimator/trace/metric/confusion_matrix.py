@@ -30,7 +30,7 @@ class ConfusionMatrix(Trace):
         output_name (str, optional): Name of the key to store to the state. Defaults to "confusion_matrix".
     """
     def __init__(self, true_key, pred_key, num_classes, mode="eval", output_name="confusion_matrix"):
-        super().__init__(outputs=output_name, mode=mode)
+        super().__init__(outputs=output_name, mode=mode, batch_inputs=[true_key, pred_key])
         self.true_key = true_key
         self.pred_key = pred_key
         self.num_classes = num_classes
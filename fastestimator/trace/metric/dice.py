@@ -29,7 +29,7 @@ class Dice(Trace):
         output_name (str, optional): Name of the key to store to the state. Defaults to "dice".
     """
     def __init__(self, true_key, pred_key, threshold=0.5, mode="eval", output_name="dice"):
-        super().__init__(outputs=output_name, mode=mode)
+        super().__init__(outputs=output_name, mode=mode, batch_inputs=[true_key, pred_key])
         self.true_key = true_key
         self.pred_key = pred_key
         self.smooth = 1e-7
@@ -46,7 +46,7 @@ class F1Score(Trace):
                  sample_weight=None,
                  mode="eval",
                  output_name="f1score"):
-        super().__init__(outputs=output_name, mode=mode)
+        super().__init__(outputs=output_name, mode=mode, batch_inputs=[true_key, pred_key])
         self.true_key = true_key
         self.pred_key = pred_key
         self.labels = labels
@@ -25,7 +25,7 @@ class MeanAvgPrecision(Trace):
     """Calculates mean avg precision for various ios. Based out of cocoapi
     """
     def __init__(self, num_classes, input_shape, pred_key, gt_key, mode="eval", output_name=("mAP", "AP50", "AP75")):
-        super().__init__(outputs=output_name, mode=mode)
+        super().__init__(outputs=output_name, mode=mode, batch_inputs=[pred_key, gt_key])
         self.pred_key = pred_key
         self.gt_key = gt_key
         self.output_name = output_name
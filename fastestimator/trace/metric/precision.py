@@ -46,7 +46,7 @@ class Precision(Trace):
                  sample_weight=None,
                  mode="eval",
                  output_name="precision"):
-        super().__init__(outputs=output_name, mode=mode)
+        super().__init__(outputs=output_name, mode=mode, batch_inputs=[true_key, pred_key])
         self.true_key = true_key
         self.pred_key = pred_key
         self.labels = labels
@@ -47,7 +47,7 @@ class Recall(Trace):
                  mode="eval",
                  output_name="recall"):
 
-        super().__init__(outputs=output_name, mode=mode)
+        super().__init__(outputs=output_name, mode=mode, batch_inputs=[true_key, pred_key])
         self.true_key = true_key
         self.pred_key = pred_key
         self.labels = labels
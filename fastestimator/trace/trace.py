@@ -19,23 +19,40 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.python.keras import backend
 
+from fastestimator.util.util import get_base_optimizer
+
 
 class Trace:
     """Trace base class. User can use `Trace` to customize their own operations during training, validation and testing.
     The `Network` instance can be accessible by `self.network`. Trace execution order will attempt to be inferred
-    whenever possible based on the provided inputs and outputs variables.
+    whenever possible based on the provided inputs and outputs variables. Traces which only write results outside of the
+    training (logs, models, summaries) set the class attribute `chief_only`, so that only the chief worker runs them in
+    multi-worker training. Traces which carry state across epochs list the names of these attributes in the class
+    attribute `state_keys`, so that a checkpoint can save and restore them.
 
     Args:
         inputs (str, list, set): A set of keys that this trace intends to read from the state dictionary as inputs
         outputs (str, list, set): A set of keys that this trace intends to write into the state dictionary
         mode (string): Restrict the trace to run only on given modes ('train', 'eval', 'test'). None will always
                         execute
+        batch_inputs (str, list, set): A set of keys that this trace reads from the batch dictionary (state["batch"]),
+                        an empty list if it reads none. Unused network ops and features are only removed when every
+                        trace declares them, keeping these keys and the `inputs`. None means undeclared, which keeps
+                        all ops and features.
     """
-    def __init__(self, inputs=None, outputs=None, mode=None):
+    chief_only = False
+    state_keys = ()
+
+    def __init__(self, inputs=None, outputs=None, mode=None, batch_inputs=None):
         self.network = None
         self.mode = mode
-        self.inputs = set(filter(None, inputs or {})) if not isinstance(inputs, str) else {inputs}
-        self.outputs = set(filter(None, outputs or {})) if not isinstance(outputs, str) else {outputs}
+        self.inputs = self._to_key_set(inputs)
+        self.outputs = self._to_key_set(outputs)
+        self.batch_inputs = None if batch_inputs is None else self._to_key_set(batch_inputs)
+
+    @staticmethod
+    def _to_key_set(keys):
+        return set(filter(None, keys or {})) if not isinstance(keys, str) else {keys}
 
     def on_begin(self, state):
         """Runs once at the beginning of training
@@ -118,14 +135,35 @@ class Trace:
                 * any keys written by 'on_end' of previous traces
         """
 
+    def get_state(self):
+        """Return the state to store in a checkpoint, which is the attributes listed in `state_keys`.
+
+        Returns:
+            dict: Attribute name to value.
+        """
+        return {key: getattr(self, key) for key in self.state_keys}
+
+    def set_state(self, state):
+        """Restore a state returned by `get_state`. It is called after `on_begin` when training resumes, and again after
+        `on_epoch_begin` when it resumes in the middle of an epoch.
+
+        Args:
+            state (dict): Attribute name to value.
+        """
+        for key, value in state.items():
+            setattr(self, key, value)
+
 
 class MonitorLoss(Trace):
     """Records loss value. Please don't add this trace into an estimator manually. An estimator will add it
     automatically.
 
     """
+    state_keys = ("best_loss", "epochs_since_best")
+
     def __init__(self):
-        super().__init__()
+        # the losses are always kept in the batch
+        super().__init__(batch_inputs=[])
         self.epochs_since_best = 0
         self.best_loss = None
         self.epoch_losses = []
@@ -165,24 +203,33 @@ class MonitorLoss(Trace):
     @staticmethod
     @tf.function
     def _reduce_loss(element_wise_loss, global_batch_size):
-        return tf.reduce_sum(element_wise_loss) / global_batch_size
+        return tf.reduce_sum(tf.cast(element_wise_loss, tf.float32)) / global_batch_size
 
 
 class TrainInfo(Trace):
     """Essential training information for logging during training. Please don't add this trace into an estimator
     manually. An estimator will add it automatically.
 
+    Besides the throughput, it reports the steady-state time of a training step and the compile time, which is the
+    extra time spent by the first step on tracing (and XLA compilation when enabled) compared with the later steps.
+    The eager warmup run which creates the variables of the ops is reported separately as the warmup time.
+
     Args:
         log_steps (int): Interval steps of logging
     """
     def __init__(self):
-        super().__init__(mode="train")
+        super().__init__(mode="train", batch_inputs=[])
         self.log_steps = 0
         self.elapse_times = []
         self.num_example = 0
         self.time_start = None
         self.train_start = None
         self.total_train_steps = None
+        self.step_start = None
+        self.first_step_time = None
+        self.step_times = []
+        self.compile_time = None
+        self.warmup_time = 0.0
 
     def on_begin(self, state):
         self.train_start = time.perf_counter()
@@ -194,13 +241,31 @@ class TrainInfo(Trace):
     def on_epoch_begin(self, state):
         self.time_start = time.perf_counter()
 
+    def on_batch_begin(self, state):
+        self.step_start = time.perf_counter()
+
     def on_batch_end(self, state):
         self.num_example += state["batch_size"]
+        # the warmup only happens in the first step of each phase, it is not a part of the step time
+        self.warmup_time += state.get("warmup_time", 0.0)
+        step_time = time.perf_counter() - self.step_start - state.get("warmup_time", 0.0)
+        if self.first_step_time is None:
+            self.first_step_time = step_time
+        else:
+            self.step_times.append(step_time)
         if state["train_step"] % self.log_steps == 0:
             if state["train_step"] > 0:
                 self.elapse_times.append(time.perf_counter() - self.time_start)
                 state["examples/sec"] = round(self.num_example / np.sum(self.elapse_times), 1)
                 state["progress"] = "{:.1%}".format(state["train_step"] / self.total_train_steps)
+            if self.step_times:
+                mean_step_time = np.mean(self.step_times)
+                state["step_time"] = "{:.2f} ms".format(mean_step_time * 1000)
+                if self.compile_time is None:
+                    self.compile_time = max(self.first_step_time - mean_step_time, 0.0)
+                    state["compile_time"] = "{} sec".format(round(self.compile_time, 2))
+                    state["warmup_time"] = "{} sec".format(round(self.warmup_time, 2))
+            self.step_times = []
             self.elapse_times = []
             self.num_example = 0
             self.time_start = time.perf_counter()
@@ -210,12 +275,11 @@ class TrainInfo(Trace):
 
     def on_end(self, state):
         state['total_time'] = "{} sec".format(round(time.perf_counter() - self.train_start, 2))
+        if self.compile_time is not None:
+            state["compile_time"] = "{} sec".format(round(self.compile_time, 2))
         self._get_lr(state)
 
     def _get_lr(self, state):
         for model_name, model in self.network.model.items():
-            if hasattr(model.optimizer, "lr"):
-                lr = backend.get_value(model.optimizer.lr)
-            else:
-                lr = backend.get_value(model.optimizer._optimizer.lr)
+            lr = backend.get_value(get_base_optimizer(model.optimizer).lr)
             state[model_name + "_lr"] = round(lr, 6)
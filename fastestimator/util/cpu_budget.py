@@ -0,0 +1,128 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Budget of the cpus shared by the data pipeline, the TensorFlow op thread pools and the data writer processes."""
+import math
+import os
+
+import tensorflow as tf
+
+_CPU_BUDGET = None
+
+
+class CpuBudget:
+    """Split the cpus of the process between tf.data, the TensorFlow op thread pools and the data writer processes.
+
+    tf.data and the op thread pools run at the same time during training, so they share the cpus: the op threads get
+    half of them without a GPU and a quarter with one, tf.data gets the rest. Data writers (`RecordWriter` and the
+    dataset loaders) run before training and use every cpu.
+
+    Args:
+        num_cpus (int, optional): Number of cpus to use. None uses every cpu available to the process, as limited by
+            its affinity mask and cgroup cpu quota. Defaults to None.
+    """
+    def __init__(self, num_cpus=None):
+        assert num_cpus is None or num_cpus > 0, "num_cpus must be positive"
+        self.num_cpus = num_cpus or get_available_cpus()
+        op_share = 4 if tf.config.experimental.list_physical_devices("GPU") else 2
+        self.op_threads = max(1, self.num_cpus // op_share)
+        self.inter_op_threads = min(2, self.op_threads)
+        self.data_threads = max(1, self.num_cpus - self.op_threads)
+        self.num_processes = self.num_cpus
+
+    def apply(self):
+        """Configure the TensorFlow op thread pools, which is only possible before TensorFlow is initialized. It is
+        called when fastestimator is imported, with the budget of the FE_NUM_CPUS environment variable.
+
+        Returns:
+            bool: Whether the thread pools were configured.
+        """
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(self.op_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError:
+            return False
+        return True
+
+
+def get_available_cpus():
+    """Return the number of cpus usable by the process, honoring its affinity mask and cgroup cpu quota.
+
+    Returns:
+        int: Number of usable cpus.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        num_cpus = len(os.sched_getaffinity(0))
+    else:
+        num_cpus = os.cpu_count() or 1
+    quota = _get_cgroup_cpu_quota()
+    if quota:
+        num_cpus = min(num_cpus, quota)
+    return max(1, num_cpus)
+
+
+def _get_cgroup_cpu_quota():
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()[:2]
+        if quota != "max":
+            return math.ceil(int(quota) / int(period))
+        return None
+    except (OSError, ValueError):
+        pass
+    for cgroup_dir in ("/sys/fs/cgroup/cpu", "/sys/fs/cgroup/cpu,cpuacct"):
+        try:
+            with open(os.path.join(cgroup_dir, "cpu.cfs_quota_us")) as quota_file:
+                quota = int(quota_file.read())
+            with open(os.path.join(cgroup_dir, "cpu.cfs_period_us")) as period_file:
+                period = int(period_file.read())
+        except (OSError, ValueError):
+            continue
+        if quota > 0 and period > 0:
+            return math.ceil(quota / period)
+    return None
+
+
+def get_cpu_budget():
+    """Return the cpu budget of the process, created from the FE_NUM_CPUS environment variable when it is set.
+
+    Returns:
+        CpuBudget: The cpu budget.
+    """
+    global _CPU_BUDGET
+    if _CPU_BUDGET is None:
+        num_cpus = os.environ.get("FE_NUM_CPUS")
+        _CPU_BUDGET = CpuBudget(int(num_cpus) if num_cpus else None)
+    return _CPU_BUDGET
+
+
+def set_num_cpus(num_cpus=None):
+    """Set the number of cpus used by the data pipelines and the data writer processes.
+
+    The TensorFlow op thread pools are sized once, when fastestimator is imported, because importing it initializes
+    TensorFlow (to detect the devices and create the distribute strategy). To size them as well, set the FE_NUM_CPUS
+    environment variable before importing fastestimator. Pipelines and RecordWriters read the budget when they are
+    created.
+
+    Args:
+        num_cpus (int, optional): Number of cpus to use. None uses every cpu available to the process. Defaults to
+            None.
+
+    Returns:
+        CpuBudget: The new cpu budget.
+    """
+    global _CPU_BUDGET
+    _CPU_BUDGET = CpuBudget(num_cpus)
+    return _CPU_BUDGET
@@ -0,0 +1,67 @@
+# Copyright 2019 The FastEstimator Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import subprocess
+import sys
+import textwrap
+from unittest import TestCase
+
+import numpy as np
+import tensorflow as tf
+
+import fastestimator as fe
+from fastestimator.util import cpu_budget
+from fastestimator.util.cpu_budget import CpuBudget, get_cpu_budget, set_num_cpus
+
+# the op thread pools are sized when fastestimator is imported, so it needs a fresh process
+_OP_THREADS = textwrap.dedent("""
+    import tensorflow as tf
+
+    import fastestimator as fe
+
+    intra_op_threads = tf.config.threading.get_intra_op_parallelism_threads()
+    assert intra_op_threads == fe.get_cpu_budget().op_threads, intra_op_threads
+    fe.set_num_cpus(1)
+    assert tf.config.threading.get_intra_op_parallelism_threads() == intra_op_threads
+""")
+
+
+class TestCpuBudget(TestCase):
+    def setUp(self):
+        self.budget = get_cpu_budget()
+
+    def tearDown(self):
+        cpu_budget._CPU_BUDGET = self.budget
+
+    def test_split(self):
+        budget = CpuBudget(8)
+        op_share = 4 if tf.config.experimental.list_physical_devices("GPU") else 2
+        self.assertEqual(budget.op_threads, 8 // op_share)
+        self.assertEqual(budget.data_threads, 8 - 8 // op_share)
+        self.assertEqual(budget.num_processes, 8)
+
+    def test_set_num_cpus_sizes_pipelines_and_writers(self):
+        set_num_cpus(2)
+        self.assertEqual(fe.RecordWriter(train_data={"x": []}, save_dir="unused").num_process, 2)
+        self.assertEqual(fe.Pipeline(data={"train": {"x": np.zeros(2)}}, batch_size=1).num_core, get_cpu_budget().data_threads)
+
+    def test_env_var_sizes_op_thread_pools(self):
+        env = dict(os.environ, FE_NUM_CPUS="4")
+        result = subprocess.run([sys.executable, "-c", _OP_THREADS],
+                                env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stdout)
@@ -14,12 +14,14 @@
 # ==============================================================================
 """Utilities for FastEstimator."""
 import json
+import os
 import re
 import string
 import sys
 import time
 from ast import literal_eval
 from collections import defaultdict
+from collections.abc import Mapping
 from contextlib import ContextDecorator
 from itertools import chain
 
@@ -316,13 +318,67 @@ def get_num_devices():
     """Return number of devices.
 
     Returns:
-        int: Number of GPUs available. Returns 1 if no GPU is found.
+        int: Number of GPUs available. Without GPU, the number of cpu replicas (see `get_num_cpu_replicas`) if there
+            are more than one, otherwise 1.
     """
     local_device_protos = device_lib.list_local_devices()
     gpu_list = [x.name for x in local_device_protos if x.device_type == 'GPU']
+    if get_num_workers() > 1:
+        return max(1, len(gpu_list)) * get_num_workers()
+    if not gpu_list and get_num_cpu_replicas() > 1:
+        return get_num_cpu_replicas()
     return max(1, len(gpu_list))
 
 
+def _get_tf_config():
+    return json.loads(os.environ.get("TF_CONFIG", "{}"))
+
+
+def get_num_workers():
+    """Return the number of workers of the cluster described by the TF_CONFIG environment variable.
+
+    Returns:
+        int: Number of workers (including the chief), 1 if TF_CONFIG is not set.
+    """
+    cluster = _get_tf_config().get("cluster", {})
+    return max(1, len(cluster.get("worker", [])) + len(cluster.get("chief", [])))
+
+
+def get_worker_index():
+    """Return the index of the current worker among all the workers of the cluster, the chief coming first.
+
+    Returns:
+        int: Index of the worker, 0 if TF_CONFIG is not set.
+    """
+    tf_config = _get_tf_config()
+    task = tf_config.get("task", {})
+    if task.get("type", "chief") == "chief":
+        return 0
+    return task.get("index", 0) + len(tf_config.get("cluster", {}).get("chief", []))
+
+
+def is_chief():
+    """Return whether the current process is the chief of the cluster described by TF_CONFIG, which is the chief task,
+    or the first worker when the cluster has no chief task.
+
+    Returns:
+        bool: Whether the current process is the chief, True if TF_CONFIG is not set.
+    """
+    return get_worker_index() == 0
+
+
+def get_num_cpu_replicas():
+    """Return the number of virtual cpu devices requested through the FE_NUM_CPU_REPLICAS environment variable.
+
+    On machines without GPU, FastEstimator splits the cpu into that many logical devices when it is imported and trains
+    data-parallel on them with a `MirroredStrategy`, the same way as on multiple GPUs.
+
+    Returns:
+        int: Number of cpu replicas, 0 if the variable is not set.
+    """
+    return int(os.environ.get("FE_NUM_CPU_REPLICAS", 0))
+
+
 def flatten_list(input_list):
     """Return a flattened list.
 
@@ -405,6 +461,82 @@ def per_replica_to_global(data):
         return set([per_replica_to_global(val) for val in data])
 
 
+class ReplicaData(Mapping):
+    """A read-only dictionary over the values of the local replicas, which combines the values of a key into one the
+    first time the key is read.
+
+    Combining every key after each step copies data such as full resolution images across devices even when nothing
+    reads them, this class only pays for the keys which are used.
+
+    Args:
+        data (dict): Tuples of the values of the local replicas, as returned by
+            `tf.distribute.Strategy.experimental_local_results`.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.combined = {}
+
+    def __getitem__(self, key):
+        if key not in self.combined:
+            values = self.data[key]
+            if values[0].shape.rank == 0:
+                self.combined[key] = tf.stack(values)
+            else:
+                self.combined[key] = tf.concat(values, axis=0)
+        return self.combined[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def get_base_optimizer(optimizer):
+    """Return the optimizer wrapped by a `LossScaleOptimizer`.
+
+    Args:
+        optimizer: A tf.optimizers.Optimizer instance, possibly wrapped for loss scaling.
+
+    Returns:
+        obj: The wrapped optimizer, or the input itself when it is not wrapped.
+    """
+    return getattr(optimizer, "_optimizer", optimizer)
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of the process reported by `get_peak_rss`, only supported on linux.
+
+    Returns:
+        bool: Whether the peak was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss():
+    """Return the peak resident memory of the process since the start or the last `reset_peak_rss`.
+
+    Returns:
+        int: Peak resident memory in bytes.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource  # not available on windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on mac and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
 class KeyDefaultDict(defaultdict):
     def __missing__(self, key):
         if self.default_factory is None:
@@ -412,3 +544,63 @@ class KeyDefaultDict(defaultdict):
         else:
             ret = self[key] = self.default_factory(key)
             return ret
+
+
+class RetraceMonitor(object):
+    """A class which counts the traces of tf.functions and reports which argument triggered each retrace.
+
+    `record` should be called from the python body of the tf.function, which only runs while the function is traced: ::
+
+        monitor = RetraceMonitor()
+
+        @tf.function
+        def step(batch, state):
+            monitor.record("train step", batch=batch, state=state)
+            ...
+
+    """
+    def __init__(self):
+        self.trace_counts = defaultdict(int)
+        self.signatures = {}
+
+    @tf.autograph.experimental.do_not_convert
+    def record(self, name, **kwargs):
+        """Count a trace of the function `name` and print the arguments which differ from its previous trace.
+
+        Args:
+            name (str): Name of the traced function.
+            **kwargs: Arguments of the function.
+        """
+        signature = {}
+        for key, value in kwargs.items():
+            self._add_signature(signature, key, value)
+        self.trace_counts[name] += 1
+        previous = self.signatures.get(name)
+        self.signatures[name] = signature
+        if previous is None:
+            return
+        changes = []
+        for key in sorted(set(previous) | set(signature)):
+            if previous.get(key) != signature.get(key):
+                changes.append("{}: {} -> {}".format(key, previous.get(key), signature.get(key)))
+        print("FastEstimator-Retrace: {} traced {} times, triggered by {}".format(
+            name, self.trace_counts[name], "; ".join(changes) or "an unknown argument"))
+
+    def _add_signature(self, signature, path, value):
+        if isinstance(value, dict):
+            for key, elem in value.items():
+                self._add_signature(signature, "{}[{!r}]".format(path, key), elem)
+        elif isinstance(value, (list, tuple)):
+            for idx, elem in enumerate(value):
+                self._add_signature(signature, "{}[{}]".format(path, idx), elem)
+        elif isinstance(value, DistributedValues):
+            self._add_signature(signature, path, value.values)
+        elif isinstance(value, (tf.Tensor, tf.Variable)):
+            shape = value.shape.as_list() if value.shape.rank is not None else "[unknown rank]"
+            signature[path] = "{}{}".format(value.dtype.name, shape)
+        elif isinstance(value, (bool, int, float, str)) or value is None:
+            signature[path] = "python {!r}".format(value)
+        elif isinstance(value, np.generic):
+            signature[path] = "{} {!r}".format(value.dtype.name, value)
+        else:
+            signature[path] = "{} object {}".format(type(value).__name__, id(value))
@@ -13,10 +13,13 @@
 # limitations under the License.
 # ==============================================================================
 import copy
-from unittest import TestCase
+from unittest import TestCase, mock
+
+import tensorflow as tf
 
 from fastestimator.cli.cli_util import parse_cli_to_dictionary
-from .util import (get_num_devices, parse_string_to_python, prettify_metric_name, remove_blacklist_keys, strip_suffix)
+from .util import (RetraceMonitor, get_num_cpu_replicas, get_num_devices, parse_string_to_python, prettify_metric_name,
+                   remove_blacklist_keys, strip_suffix)
 
 
 class TestUtil(TestCase):
@@ -48,6 +51,12 @@ class TestUtil(TestCase):
             devices = 1
         assert devices == get_num_devices()
 
+    def test_get_num_cpu_replicas(self):
+        with mock.patch.dict("os.environ", {"FE_NUM_CPU_REPLICAS": "4"}):
+            self.assertEqual(get_num_cpu_replicas(), 4)
+        with mock.patch.dict("os.environ", clear=True):
+            self.assertEqual(get_num_cpu_replicas(), 0)
+
     # -------------------------------------------------------------------------------------------------------- #
     # ------------------------------------------- KEY Blacklisting ------------------------------------------- #
     # -------------------------------------------------------------------------------------------------------- #
@@ -381,3 +390,23 @@ class TestUtil(TestCase):
         expected = {"key1": (0, 1), "key2": [True, False, 'args']}
         actual = parse_cli_to_dictionary(input_list)
         self.assertDictEqual(actual, expected)
+
+    # -------------------------------------------------------------------------------------------------------- #
+    # ------------------------------------------- Retrace Monitor -------------------------------------------- #
+    # -------------------------------------------------------------------------------------------------------- #
+    def test_retrace_monitor_counts_traces(self):
+        monitor = RetraceMonitor()
+
+        @tf.function
+        def step(batch, state):
+            monitor.record("step", batch=batch, state=state)
+            return batch["x"] * 2
+
+        step({"x": tf.ones((2, 3))}, {"num_examples": 10})
+        step({"x": tf.ones((2, 3))}, {"num_examples": 10})
+        self.assertEqual(monitor.trace_counts["step"], 1)
+        step({"x": tf.ones((2, 3))}, {"num_examples": 20})
+        self.assertEqual(monitor.signatures["step"]["state['num_examples']"], "python 20")
+        step({"x": tf.ones((1, 3))}, {"num_examples": 20})
+        self.assertEqual(monitor.signatures["step"]["batch['x']"], "float32[1, 3]")
+        self.assertEqual(monitor.trace_counts["step"], 3)